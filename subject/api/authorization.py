@@ -318,6 +318,8 @@ class ImmutableSubjectProxy(object):
     protected = _immutable_attr('base', 'protected')
     locations = _immutable_attr('base', 'locations', proxy=ImmutableLocations)
     checksum = _immutable_attr('base', 'checksum')
+    os_hash_algo = _immutable_attr('base', 'os_hash_algo')
+    os_hash_value = _immutable_attr('base', 'os_hash_value')
     owner = _immutable_attr('base', 'owner')
     disk_format = _immutable_attr('base', 'disk_format')
     subject_format = _immutable_attr('base', 'subject_format')
@@ -23,12 +23,16 @@ the local cached copy of the subject file is returned.
 """
 
 import re
+import uuid
+
 import six
 
 from oslo_log import log as logging
+from oslo_utils import units
 import webob
 
 from subject.api.common import size_checked_iter
+from subject.api.common import subject_send_notification
 from subject.api import policy
 from subject.api.v1 import subjects
 from subject.common import exception
@@ -49,6 +53,101 @@ PATTERNS = {
     ('v1', 'DELETE'): re.compile(r'^/v1/subjects/([^\/]+)$')
 }
 
+# Size of the reads used to serve cached subject files. Larger reads mean
+# fewer trips through the Python iterator stack per byte served.
+CACHE_READ_CHUNK_SIZE = 256 * units.Ki
+
+# Requests asking for more ranges than this are served the whole subject.
+MAX_BYTE_RANGES = 64
+
+
+def parse_byte_ranges(header, length):
+    """
+    Parse the value of an HTTP Range header against an subject of the
+    given length.
+
+    :param header: Value of the Range header
+    :param length: Size of the subject in bytes
+    :returns: None if the header is not a valid byte range set and should
+              be ignored, otherwise a (possibly empty) list of the
+              satisfiable ranges as (start, stop) tuples, stop being
+              exclusive, in the order they were requested
+    """
+    unit, sep, range_set = header.partition('=')
+    if not sep or unit.strip().lower() != 'bytes':
+        return None
+
+    specs = [spec.strip() for spec in range_set.split(',') if spec.strip()]
+    if not specs or len(specs) > MAX_BYTE_RANGES:
+        return None
+
+    ranges = []
+    for spec in specs:
+        first, sep, last = spec.partition('-')
+        first, last = first.strip(), last.strip()
+        if (not sep or (first and not first.isdigit()) or
+                (last and not last.isdigit()) or not (first or last)):
+            return None
+
+        if not first:
+            # A suffix range: the last N bytes of the subject.
+            suffix = int(last)
+            if suffix:
+                ranges.append((max(length - suffix, 0), length))
+            continue
+
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        stop = int(last) + 1 if last else length
+        if start < length:
+            ranges.append((start, min(stop, length)))
+    return ranges
+
+
+class CachedSubjectFile(object):
+
+    """
+    File-like view of a cached subject file for use with a WSGI server's
+    ``wsgi.file_wrapper``, which lets servers that support it send the file
+    with sendfile(2) instead of copying it through Python.
+
+    Closing it closes the cache file, which records the cache hit, and
+    calls the supplied callback with the number of bytes sent. That is the
+    number of bytes read, or the position of the file if a server sending
+    it with sendfile(2) has moved it further.
+    """
+
+    def __init__(self, cache_context, on_close=None):
+        self.cache_context = cache_context
+        self.cache_file = cache_context.__enter__()
+        self.on_close = on_close
+        self.closed = False
+        self.bytes_read = 0
+
+    def fileno(self):
+        return self.cache_file.fileno()
+
+    def read(self, size=-1):
+        data = self.cache_file.read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        bytes_sent = self.bytes_read
+        try:
+            bytes_sent = max(bytes_sent, self.cache_file.tell())
+        except (IOError, OSError, ValueError):
+            pass
+        try:
+            self.cache_context.__exit__(None, None, None)
+        finally:
+            if self.on_close is not None:
+                self.on_close(bytes_sent)
+
 
 class CacheFilter(wsgi.Middleware):
 
@@ -148,8 +247,19 @@ class CacheFilter(wsgi.Middleware):
 
         self._stash_request_info(request, subject_id, method, version)
 
-        if request.method != 'GET' or not self.cache.is_cached(subject_id):
+        if request.method != 'GET':
             return None
+
+        fill_iterator = None
+        if not self.cache.is_cached(subject_id):
+            # With single-flight filling enabled, a request for an subject
+            # that is being cached by this process follows that fill
+            # instead of going to the backend store itself.
+            if 'Range' not in request.headers:
+                fill_iterator = self.cache.get_fill_iter(subject_id)
+            if fill_iterator is None:
+                return None
+
         method = getattr(self, '_get_%s_subject_metadata' % version)
         subject_metadata = method(request, subject_id)
 
@@ -162,11 +272,22 @@ class CacheFilter(wsgi.Middleware):
         except exception.Forbidden:
             return None
 
-        LOG.debug("Cache hit for subject '%s'", subject_id)
-        subject_iterator = self.get_from_cache(subject_id)
+        if fill_iterator is not None:
+            LOG.debug("Cache fill in progress for subject '%s'", subject_id)
+            subject_iterator = fill_iterator
+        else:
+            LOG.debug("Cache hit for subject '%s'", subject_id)
+            subject_iterator = self.get_from_cache(subject_id)
+            request.environ['api.cache.hit'] = True
         method = getattr(self, '_process_%s_request' % version)
 
         try:
+            ranges = None
+            if fill_iterator is None and self._is_range_request(request):
+                ranges = self._get_request_ranges(request, subject_metadata)
+            if ranges is not None:
+                return self._process_range_request(request, subject_id,
+                                                   subject_metadata, ranges)
             return method(request, subject_id, subject_iterator, subject_metadata)
         except exception.SubjectNotFound:
             msg = _LE("Subject cache contained subject file for subject '%s', "
@@ -208,12 +329,40 @@ class CacheFilter(wsgi.Middleware):
         self._verify_metadata(subject_meta)
 
         response = webob.Response(request=request)
+        file_wrapper = request.environ.get('wsgi.file_wrapper')
+        if file_wrapper is not None and request.environ.get('api.cache.hit'):
+            # NOTE: the server sends the whole file itself, so there are
+            # no chunks for size_checked_iter to count and the subject.send
+            # notification is generated once the server closes the file.
+            response.app_iter = self.get_file_wrapper_from_cache(
+                request, subject_id, subject_meta, file_wrapper)
+            # NOTE: set the headers the serializer sets after app_iter,
+            # which resets them.
+            response.headers['Content-Type'] = 'application/octet-stream'
+            response.headers['Content-Length'] = str(subject_meta['size'])
+            self._inject_v1_headers(response, subject_meta)
+            return response
+
         raw_response = {
             'subject_iterator': subject_iterator,
             'subject_meta': subject_meta,
         }
         return self.serializer.show(response, raw_response)
 
+    @staticmethod
+    def _inject_v1_headers(response, subject_meta):
+        """
+        Sets the x-subject-meta-* and ETag headers of a v1 subject download
+        response, as the v1 serializer does.
+        """
+        headers = utils.subject_meta_to_http_headers(subject_meta)
+        for key, value in six.iteritems(headers):
+            response.headers[key] = value
+        checksum = subject_meta.get('checksum')
+        if checksum is not None:
+            response.headers['ETag'] = (checksum.encode('utf-8')
+                                        if six.PY2 else checksum)
+
     def _process_v2_request(self, request, subject_id, subject_iterator,
                             subject_meta):
         # We do some contortions to get the subject_metadata so
@@ -242,6 +391,79 @@ class CacheFilter(wsgi.Middleware):
             response.headers['Content-MD5'] = (subject.checksum.encode('utf-8')
                                                if six.PY2 else subject.checksum)
         response.headers['Content-Length'] = str(subject.size)
+        response.headers['Accept-Ranges'] = 'bytes'
+        return response
+
+    @staticmethod
+    def _is_range_request(request):
+        # NOTE: a conditional range request would need an entity tag or
+        # date to compare against, which subjects don't carry, so those
+        # are always answered with the whole subject.
+        return ('Range' in request.headers and
+                'If-Range' not in request.headers)
+
+    def _get_request_ranges(self, request, subject_meta):
+        """
+        Returns the byte ranges asked for in the Range header of the
+        request, or None if the header is invalid and should be ignored.
+        """
+        self._verify_metadata(subject_meta)
+        return parse_byte_ranges(request.headers['Range'],
+                                 int(subject_meta['size']))
+
+    def _process_range_request(self, request, subject_id, subject_meta,
+                               ranges):
+        """
+        Serve the ranges of a cached subject asked for in the Range header
+        of the request, as described in RFC 7233.
+        """
+        size = int(subject_meta['size'])
+        response = webob.Response(request=request)
+        if not ranges:
+            response.status_int = 416
+            response.headers['Content-Range'] = 'bytes */%d' % size
+            return response
+
+        if len(ranges) == 1:
+            start, stop = ranges[0]
+            parts = [(b'', start, stop)]
+            trailer = b''
+            content_type = 'application/octet-stream'
+            content_range = 'bytes %d-%d/%d' % (start, stop - 1, size)
+        else:
+            boundary = uuid.uuid4().hex
+            parts = []
+            for start, stop in ranges:
+                part_header = ('\r\n--%s\r\n'
+                               'Content-Type: application/octet-stream\r\n'
+                               'Content-Range: bytes %d-%d/%d\r\n\r\n' %
+                               (boundary, start, stop - 1, size))
+                parts.append((part_header.encode('ascii'), start, stop))
+            trailer = ('\r\n--%s--\r\n' % boundary).encode('ascii')
+            content_type = 'multipart/byteranges; boundary=%s' % boundary
+            content_range = None
+
+        payload_length = sum(stop - start for part_header, start, stop
+                             in parts)
+        content_length = len(trailer) + payload_length + sum(
+            len(part_header) for part_header, start, stop in parts)
+        response.status_int = 206
+        # NOTE: only the subject data is counted for the subject.send
+        # notification, not the multipart headers around it.
+        payload = size_checked_iter(
+            response, subject_meta, payload_length,
+            self.get_ranges_from_cache(
+                subject_id, [(start, stop) for part_header, start, stop
+                             in parts]),
+            notifier.Notifier())
+        response.app_iter = self._join_parts(parts, trailer, payload)
+        # NOTE: set the headers after app_iter, which resets them.
+        self._inject_v1_headers(response, subject_meta)
+        response.headers['Content-Type'] = content_type
+        if content_range:
+            response.headers['Content-Range'] = content_range
+        response.headers['Content-Length'] = str(content_length)
+        response.headers['Accept-Ranges'] = 'bytes'
         return response
 
     def process_response(self, resp):
@@ -283,6 +505,12 @@ class CacheFilter(wsgi.Middleware):
         return resp
 
     def _process_GET_response(self, resp, subject_id, version=None):
+        if (self.get_status_code(resp) == 206 or
+                'Range' in resp.request.headers):
+            # Only part of the subject is being sent; caching it would
+            # leave a truncated subject file in the cache.
+            return resp
+
         subject_checksum = resp.headers.get('Content-MD5')
         if not subject_checksum:
             # API V1 stores the checksum in a different header:
@@ -319,6 +547,63 @@ class CacheFilter(wsgi.Middleware):
     def get_from_cache(self, subject_id):
         """Called if cache hit"""
         with self.cache.open_for_read(subject_id) as cache_file:
-            chunks = utils.chunkiter(cache_file)
+            chunks = utils.chunkiter(cache_file, CACHE_READ_CHUNK_SIZE)
             for chunk in chunks:
                 yield chunk
+
+    def get_file_wrapper_from_cache(self, request, subject_id, subject_meta,
+                                    file_wrapper):
+        """
+        Called if cache hit and the WSGI server provides a
+        ``wsgi.file_wrapper``.
+        """
+        size = int(subject_meta['size'])
+
+        def notify_subject_sent(bytes_sent):
+            subject_send_notification(bytes_sent, size, subject_meta, request,
+                                      notifier.Notifier())
+
+        cache_file = CachedSubjectFile(self.cache.open_for_read(subject_id),
+                                       on_close=notify_subject_sent)
+        return file_wrapper(cache_file, CACHE_READ_CHUNK_SIZE)
+
+    def get_ranges_from_cache(self, subject_id, ranges):
+        """
+        Called if cache hit for a range request. Yields the (start, stop)
+        ranges of the cached subject file in turn, no chunk spanning two
+        ranges.
+        """
+        with self.cache.open_for_read(subject_id) as cache_file:
+            for start, stop in ranges:
+                cache_file.seek(start)
+                remaining = stop - start
+                while remaining > 0:
+                    chunk = cache_file.read(min(CACHE_READ_CHUNK_SIZE,
+                                                remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    yield chunk
+
+    @staticmethod
+    def _join_parts(parts, trailer, payload):
+        """
+        Yields, for each of the (header, start, stop) parts, the header
+        followed by the chunks of payload making up that range, and then
+        the trailer.
+        """
+        payload = iter(payload)
+        for part_header, start, stop in parts:
+            if part_header:
+                yield part_header
+            remaining = stop - start
+            while remaining > 0:
+                chunk = next(payload)
+                remaining -= len(chunk)
+                yield chunk
+        # NOTE: resume the payload once more, so that it counts its last
+        # chunk and checks the size of what was sent.
+        for chunk in payload:
+            yield chunk
+        if trailer:
+            yield trailer
@@ -16,11 +16,17 @@
 
 """Policy Engine For Glance"""
 
+import ast
+import collections
 import copy
+import itertools
+import re
 
 from oslo_config import cfg
 from oslo_log import log as logging
+from oslo_policy import _checks
 from oslo_policy import policy
+import six
 
 from subject.common import exception
 import subject.domain.proxy
@@ -28,7 +34,35 @@ from subject.i18n import _
 
 
 LOG = logging.getLogger(__name__)
+
+policy_opts = [
+    cfg.IntOpt('policy_decision_cache_size',
+               default=0,
+               min=0,
+               help=_("""
+The number of policy decisions each API worker caches.
+
+Policy decisions are always cached for the duration of a request, so that
+a rule enforced for every subject of a listing is evaluated once for each
+distinct set of the credentials and target attributes the rule refers to.
+Provide the maximum number of decisions to also keep across requests, so
+that requests made with the same roles reuse them. Once the cache is full,
+the least recently used decisions are dropped first. Decisions cached
+before the policy file is reloaded are not used again. Setting this to 0
+disables the cache across requests.
+
+Possible values:
+    * Zero
+    * Positive integer
+
+Related options:
+    * None
+
+""")),
+]
+
 CONF = cfg.CONF
+CONF.register_opts(policy_opts)
 
 DEFAULT_RULES = policy.Rules.from_dict({
     'context_is_admin': 'role:admin',
@@ -36,11 +70,106 @@ DEFAULT_RULES = policy.Rules.from_dict({
     'manage_subject_cache': 'role:admin',
 })
 
+_TARGET_REFERENCE = re.compile(r'%\(([^)]+)\)')
+_MISSING = object()
+_GENERATIONS = itertools.count()
+_CACHE = None
+
+
+class DecisionStats(object):
+
+    """Counts how often policy decisions are found cached."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.uncacheable = 0
+
+    @property
+    def hit_rate(self):
+        """The fraction of cacheable decisions that were found cached."""
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
+
+    def to_dict(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'uncacheable': self.uncacheable, 'hit_rate': self.hit_rate}
+
+
+STATS = DecisionStats()
+
+
+class DecisionCache(object):
+
+    """A least recently used cache of policy decisions."""
+
+    def __init__(self, size):
+        self.size = size
+        self._decisions = collections.OrderedDict()
+
+    def get(self, key):
+        """Returns the decision cached under key, or None."""
+        decision = self._decisions.pop(key, None)
+        if decision is not None:
+            self._decisions[key] = decision
+        return decision
+
+    def set(self, key, decision):
+        self._decisions.pop(key, None)
+        self._decisions[key] = decision
+        while len(self._decisions) > self.size:
+            self._decisions.popitem(last=False)
+
+    def clear(self):
+        self._decisions.clear()
+
+
+def get_cache():
+    """
+    Returns the policy decision cache of this process, or None if it is
+    disabled.
+    """
+    global _CACHE
+    size = CONF.policy_decision_cache_size
+    if not size:
+        return None
+    if _CACHE is None or _CACHE.size != size:
+        _CACHE = DecisionCache(size)
+    return _CACHE
+
+
+def _freeze(value, ordered=True):
+    """
+    Returns a hashable equivalent of a credential or target value. Lists
+    in credentials are only ever searched, so their order is not kept.
+
+    :raises: TypeError if the value cannot be made hashable
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v, ordered))
+                            for k, v in six.iteritems(value)))
+    if isinstance(value, (list, tuple)):
+        if ordered:
+            return tuple(_freeze(v, ordered) for v in value)
+        return frozenset(_freeze(v, ordered) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(_freeze(v, ordered) for v in value)
+    hash(value)
+    return value
+
+
+def _target_value(target, key):
+    try:
+        return target[key]
+    except KeyError:
+        return _MISSING
+
 
 class Enforcer(policy.Enforcer):
     """Responsible for loading and enforcing rules"""
 
     def __init__(self):
+        self._rules_changed()
         if CONF.find_file(CONF.oslo_policy.policy_file):
             kwargs = dict(rules=None, use_conf=True)
         else:
@@ -51,6 +180,125 @@ class Enforcer(policy.Enforcer):
         """Add new rules to the Rules object"""
         self.set_rules(rules, overwrite=False, use_conf=self.use_conf)
 
+    def set_rules(self, rules, overwrite=True, use_conf=False):
+        super(Enforcer, self).set_rules(rules, overwrite=overwrite,
+                                        use_conf=use_conf)
+        self._rules_changed()
+
+    def clear(self):
+        super(Enforcer, self).clear()
+        self._rules_changed()
+
+    def _rules_changed(self):
+        # Decisions are cached under a generation unique across enforcers,
+        # so those made with rules since replaced are never used again, and
+        # are left for the least recently used ones to age out.
+        self._generation = next(_GENERATIONS)
+        self._references = {}
+
+    def _collect_references(self, check, creds, target, seen):
+        """
+        Adds the credential and target keys the check refers to into creds
+        and target. Returns False if the outcome of the check may depend on
+        anything else, such as an external service.
+        """
+        if isinstance(check, (_checks.TrueCheck, _checks.FalseCheck)):
+            return True
+        if isinstance(check, (_checks.AndCheck, _checks.OrCheck)):
+            return all(self._collect_references(rule, creds, target, seen)
+                       for rule in check.rules)
+        if isinstance(check, _checks.NotCheck):
+            return self._collect_references(check.rule, creds, target, seen)
+        if type(check) is _checks.RuleCheck:
+            if check.match in seen:
+                return True
+            seen.add(check.match)
+            try:
+                rule = self.rules[check.match]
+            except KeyError:
+                return True
+            return self._collect_references(rule, creds, target, seen)
+        if type(check) is _checks.RoleCheck:
+            creds.add('roles')
+        elif type(check) is _checks.GenericCheck:
+            try:
+                ast.literal_eval(check.kind)
+            except (ValueError, SyntaxError):
+                creds.add(check.kind.split('.')[0])
+        else:
+            return False
+        target.update(_TARGET_REFERENCE.findall(check.match))
+        return True
+
+    def _get_references(self, action):
+        """
+        Returns the credential and target keys the rule of the action refers
+        to, or None if its decisions cannot be cached.
+        """
+        try:
+            return self._references[action]
+        except KeyError:
+            pass
+
+        creds = set()
+        target = set()
+        try:
+            rule = self.rules[action]
+        except KeyError:
+            references = None
+        else:
+            if self._collect_references(rule, creds, target, set([action])):
+                references = (sorted(creds), sorted(target))
+            else:
+                references = None
+        self._references[action] = references
+        return references
+
+    def _get_decision_key(self, action, target, creds):
+        references = self._get_references(action)
+        if references is None:
+            return None
+        cred_keys, target_keys = references
+        try:
+            return (self._generation, action,
+                    tuple(_freeze(creds.get(key, _MISSING), ordered=False)
+                          for key in cred_keys),
+                    tuple(_freeze(_target_value(target, key))
+                          for key in target_keys))
+        except TypeError:
+            return None
+
+    def _decide(self, context, action, target):
+        """
+        Returns the decision of the rule of the action on the target in
+        this context, as cached for the request or the process if it was
+        made before with the same credentials and target attributes.
+        """
+        creds = context.to_policy_values()
+        # Reload the rules first if the policy file changed, so that the
+        # decisions made with the rules it replaces are not used.
+        self.load_rules()
+        key = self._get_decision_key(action, target, creds)
+        if key is None:
+            STATS.uncacheable += 1
+            return super(Enforcer, self).enforce(action, target, creds)
+
+        decisions = getattr(context, 'policy_decisions', None)
+        cache = get_cache()
+        decision = decisions.get(key) if decisions is not None else None
+        if decision is None and cache is not None:
+            decision = cache.get(key)
+        if decision is not None:
+            STATS.hits += 1
+        else:
+            STATS.misses += 1
+            decision = (super(Enforcer, self).enforce(action, target, creds),)
+            if cache is not None:
+                cache.set(key, decision)
+        if decisions is not None:
+            decisions[key] = decision
+        return decision[0]
+
     def enforce(self, context, action, target):
         """Verifies that the action is valid on the target in this context.
 
@@ -60,11 +308,10 @@ class Enforcer(policy.Enforcer):
            :raises: `subject.common.exception.Forbidden`
            :returns: A non-False value if access is allowed.
         """
-        return super(Enforcer, self).enforce(action, target,
-                                             context.to_policy_values(),
-                                             do_raise=True,
-                                             exc=exception.Forbidden,
-                                             action=action)
+        result = self._decide(context, action, target)
+        if not result:
+            raise exception.Forbidden(action=action)
+        return result
 
     def check(self, context, action, target):
         """Verifies that the action is valid on the target in this context.
@@ -74,9 +321,7 @@ class Enforcer(policy.Enforcer):
            :param target: Dictionary representing the object of the action.
            :returns: A non-False value if access is allowed.
         """
-        return super(Enforcer, self).enforce(action,
-                                             target,
-                                             context.to_policy_values())
+        return self._decide(context, action, target)
 
     def check_is_admin(self, context):
         """Check if the given context is associated with an admin role,
@@ -13,6 +13,8 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import itertools
+import json as std_json
 import re
 
 import subject_store
@@ -44,6 +46,14 @@ CONF.import_opt('subject_formats', 'subject.common.config',
                 group='subject_format')
 CONF.import_opt('show_multiple_locations', 'subject.common.config')
 
+# Subject list responses are sent in chunks of about this many bytes.
+INDEX_CHUNK_SIZE = 64 * 1024
+
+# NOTE: One encoder is reused for every subject in a list response. Its
+# C accelerated implementation is used when the json module provides one.
+_INDEX_ENCODER = std_json.JSONEncoder(ensure_ascii=False,
+                                      default=json.to_primitive)
+
 
 class SubjectsController(object):
     def __init__(self, db_api=None, policy_enforcer=None, notifier=None,
@@ -110,7 +120,8 @@ class SubjectsController(object):
                                      filters=filters,
                                      member_status=member_status)
             if len(subjects) != 0 and len(subjects) == limit:
-                result['next_marker'] = subjects[-1].subject_id
+                result['next_marker'] = self._get_next_marker(subjects[-1],
+                                                              sort_key)
         except (exception.NotFound, exception.InvalidSortKey,
                 exception.InvalidFilterRangeValue,
                 exception.InvalidParameterValue,
@@ -124,6 +135,22 @@ class SubjectsController(object):
         result['subjects'] = subjects
         return result
 
+    @staticmethod
+    def _get_next_marker(subject, sort_key):
+        """
+        Build the marker of the next page out of the sort key values of the
+        last subject of a page, so that the next page can be selected
+        without looking up the marker subject again.
+        """
+        sort_keys = utils.keyset_sort_keys(sort_key)
+        values = []
+        for key in sort_keys:
+            attr = 'subject_id' if key == 'id' else key
+            if not hasattr(subject, attr):
+                return subject.subject_id
+            values.append(getattr(subject, attr))
+        return utils.encode_keyset_marker(sort_keys, values)
+
     def show(self, req, subject_id):
         subject_repo = self.gateway.get_repo(req.context)
         try:
@@ -344,13 +371,15 @@ class RequestDeserializer(wsgi.JSONRequestDeserializer):
 
     _disallowed_properties = ('direct_url', 'self', 'file', 'schema')
     _readonly_properties = ('created_at', 'updated_at', 'status', 'checksum',
-                            'size', 'virtual_size', 'direct_url', 'self',
-                            'file', 'schema', 'id')
+                            'os_hash_algo', 'os_hash_value', 'size',
+                            'virtual_size', 'direct_url', 'self', 'file',
+                            'schema', 'id')
     _reserved_properties = ('location', 'deleted', 'deleted_at')
-    _base_properties = ('checksum', 'created_at', 'subject_format',
-                        'disk_format', 'id', 'min_disk', 'min_ram', 'name',
-                        'size', 'virtual_size', 'status', 'tags', 'owner',
-                        'updated_at', 'visibility', 'protected')
+    _base_properties = ('checksum', 'os_hash_algo', 'os_hash_value',
+                        'created_at', 'subject_format', 'disk_format', 'id',
+                        'min_disk', 'min_ram', 'name', 'size', 'virtual_size',
+                        'status', 'tags', 'owner', 'updated_at', 'visibility',
+                        'protected')
     _available_sort_keys = ('name', 'status', 'subject_format',
                             'disk_format', 'size', 'id', 'created_at',
                             'updated_at')
@@ -753,9 +782,9 @@ class ResponseSerializer(wsgi.JSONResponseSerializer):
             subject_view = dict(subject.extra_properties)
             attributes = ['name', 'type', 'tar_format', 'subject_format',
                           'visibility', 'size', 'contributor', 'status',
-                          'checksum', 'protected', 'phase', 'language',
-                          'score', 'knowledge', 'description', 'subject_desc',
-                          'owner']
+                          'checksum', 'os_hash_algo', 'os_hash_value',
+                          'protected', 'phase', 'language', 'score',
+                          'knowledge', 'description', 'subject_desc', 'owner']
             for key in attributes:
                 subject_view[key] = getattr(subject, key)
             subject_view['id'] = subject.subject_id
@@ -815,24 +844,52 @@ class ResponseSerializer(wsgi.JSONResponseSerializer):
         response.unicode_body = six.text_type(body)
         response.content_type = 'application/json'
 
+    def _iter_index(self, subjects, links):
+        """
+        Yields the JSON list response in UTF-8 encoded chunks of about
+        INDEX_CHUNK_SIZE bytes, formatting and encoding the subjects only
+        as the chunks holding them are needed.
+        """
+        encode = _INDEX_ENCODER.encode
+        parts = ['{"subjects": [']
+        size = 0
+        for index, item in enumerate(subjects):
+            part = encode(self._format_subject(item))
+            if index:
+                part = ', ' + part
+            parts.append(part)
+            size += len(part)
+            if size >= INDEX_CHUNK_SIZE:
+                yield encodeutils.safe_encode(''.join(parts))
+                parts = []
+                size = 0
+        parts.append('], ')
+        # Add the links after the subjects, without their opening brace
+        parts.append(encode(links)[1:])
+        yield encodeutils.safe_encode(''.join(parts))
+
     def index(self, response, result):
         params = dict(response.request.params)
         params.pop('marker', None)
         query = urlparse.urlencode(params)
-        body = {
-            'subjects': [self._format_subject(i) for i in result['subjects']],
+        links = {
             'first': '/v1/subjects',
             'schema': '/v1/schemas/subjects',
         }
         if query:
-            body['first'] = '%s?%s' % (body['first'], query)
+            links['first'] = '%s?%s' % (links['first'], query)
         if 'next_marker' in result:
             params['marker'] = result['next_marker']
             next_query = urlparse.urlencode(params)
-            body['next'] = '/v1/subjects?%s' % next_query
-        response.unicode_body = six.text_type(json.dumps(body,
-                                                         ensure_ascii=False))
+            links['next'] = '/v1/subjects?%s' % next_query
+
+        # NOTE: Produce the first chunk before the response is started, so
+        # that an error formatting the subjects in it, which is every subject
+        # of most pages, is still returned as an error response.
+        chunks = self._iter_index(result['subjects'], links)
+        first_chunk = next(chunks)
         response.content_type = 'application/json'
+        response.app_iter = itertools.chain([first_chunk], chunks)
 
     def delete(self, response, result):
         response.status_int = 204
@@ -889,6 +946,19 @@ def get_base_properties():
             'description': _('md5 hash of subject contents.'),
             'maxLength': 32,
         },
+        'os_hash_algo': {
+            'type': ['null', 'string'],
+            'readOnly': True,
+            'description': _('Algorithm to calculate the os_hash_value'),
+            'maxLength': 64,
+        },
+        'os_hash_value': {
+            'type': ['null', 'string'],
+            'readOnly': True,
+            'description': _('Hexdigest of the subject contents using the '
+                             'algorithm specified by the os_hash_algo'),
+            'maxLength': 128,
+        },
         'contributor': {
             'type': ['null', 'string'],
             'description': _('contributor of the subject'),
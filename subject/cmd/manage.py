@@ -109,8 +109,16 @@ class DbCommands(object):
     @args('--age_in_days', type=int,
           help='Purge deleted rows older than age in days')
     @args('--max_rows', type=int,
-          help='Limit number of records to delete')
-    def purge(self, age_in_days=30, max_rows=100):
+          help='Limit number of records to delete from a table at once')
+    @args('--batch_sleep', type=float,
+          help='Seconds to sleep between two batches of deletes')
+    @args('--batch_duration', type=float,
+          help='Seconds each batch of deletes should take, adapting the '
+               'number of records deleted at once up to max_rows')
+    @args('--dry_run', action='store_true',
+          help='Only report the number of records that would be deleted')
+    def purge(self, age_in_days=30, max_rows=100, batch_sleep=0,
+              batch_duration=None, dry_run=False):
         """Purge deleted rows older than a given age from subject tables."""
         try:
             age_in_days = int(age_in_days)
@@ -130,12 +138,26 @@ class DbCommands(object):
             sys.exit(_("Maximal age is count of days since epoch."))
         if max_rows < 1:
             sys.exit(_("Minimal rows limit is 1."))
+        if batch_sleep < 0:
+            sys.exit(_("Must supply a non-negative value for batch sleep."))
+        if batch_duration is not None and batch_duration <= 0:
+            sys.exit(_("Must supply a positive, non-zero value for batch "
+                       "duration."))
         ctx = context.get_admin_context(show_deleted=True)
         try:
-            db_api.purge_deleted_rows(ctx, age_in_days, max_rows)
+            purged = db_api.purge_deleted_rows(
+                ctx, age_in_days, max_rows, batch_sleep=batch_sleep,
+                batch_duration=batch_duration, dry_run=dry_run)
         except exception.Invalid as exc:
             sys.exit(exc.msg)
 
+        if dry_run:
+            print(_("Rows that would be purged:"))
+        else:
+            print(_("Rows purged:"))
+        for tbl, rows in purged.items():
+            print("%(tbl)s: %(rows)d" % {'tbl': tbl, 'rows': rows})
+
 
 class DbLegacyCommands(object):
     """Class for managing the db using legacy commands"""
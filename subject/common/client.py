@@ -23,11 +23,14 @@ import errno
 import functools
 import os
 import re
+import time
 
 try:
+    from eventlet.green import select
     from eventlet.green import socket
     from eventlet.green import ssl
 except ImportError:
+    import select
     import socket
     import ssl
 
@@ -59,6 +62,15 @@ CHUNKSIZE = 65536
 
 VERSION_REGEX = re.compile(r"/?v[0-9\.]+")
 
+# Number of idle connections kept open to each endpoint, and the number of
+# seconds they are kept open for
+POOL_MAX_SIZE = 10
+POOL_MAX_IDLE = 60
+
+# Connection pools per process, connection type, endpoint and connection
+# parameters, so that forked processes never share a connection
+_POOLS = {}
+
 
 def handle_unauthenticated(func):
     """
@@ -93,6 +105,111 @@ def handle_redirects(func):
     return wrapped
 
 
+def _is_connection_idle(connection):
+    """
+    Returns True if a connection is still open and nothing can be read from
+    it. A connection that can be read from before a request was sent on it
+    has been closed by the server, or holds the unread rest of a response.
+    """
+    sock = getattr(connection, 'sock', None)
+    if sock is None:
+        return False
+    try:
+        readable = select.select([sock], [], [], 0)[0]
+    except (socket.error, ValueError):
+        return False
+    return not readable
+
+
+def _on_response_closed(response, callback):
+    """
+    Calls callback(done) once, when a response is closed. done is True if
+    the body of the response was read to the end before it was closed, in
+    which case the connection it was received on can send another request.
+    """
+    state = {'closing': False, 'released': False}
+
+    def release(done):
+        if not state['released']:
+            state['released'] = True
+            callback(done)
+
+    close = response.close
+
+    def close_response():
+        # NOTE: A response read to the end is already closed on Python 3,
+        # and still has a length of 0 left to read on Python 2.
+        done = response.isclosed() or response.length == 0
+        state['closing'] = True
+        try:
+            close()
+        finally:
+            state['closing'] = False
+        release(done)
+
+    response.close = close_response
+
+    close_conn = getattr(response, '_close_conn', None)
+    if close_conn is not None:
+        def close_response_conn():
+            close_conn()
+            # NOTE: Outside of close(), Python 3 only closes the response
+            # once its body has been read to the end.
+            if not state['closing']:
+                release(True)
+
+        response._close_conn = close_response_conn
+
+
+class ConnectionPool(object):
+
+    """
+    Keeps the connections to an endpoint open after their response has been
+    read, so that later requests to the endpoint are sent on them instead of
+    connecting again.
+
+    A connection is handed back to the pool only once its response has been
+    read to the end and closed, so the connections in the pool are all idle
+    and the oldest one can be closed when the pool is full.
+    """
+
+    def __init__(self, max_size=POOL_MAX_SIZE, max_idle=POOL_MAX_IDLE):
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.connections = collections.deque()
+
+    def get(self):
+        """
+        Returns an idle connection from the pool, or None if there is none.
+        """
+        now = time.time()
+        while self.connections:
+            try:
+                connection, released_at = self.connections.pop()
+            except IndexError:
+                break
+            if (now - released_at <= self.max_idle and
+                    _is_connection_idle(connection)):
+                return connection
+            connection.close()
+        return None
+
+    def put(self, connection):
+        """
+        Hands a connection whose response has been read back to the pool.
+        """
+        if self.max_size <= 0:
+            connection.close()
+            return
+        self.connections.append((connection, time.time()))
+        while len(self.connections) > self.max_size:
+            try:
+                connection, released_at = self.connections.popleft()
+            except IndexError:
+                break
+            connection.close()
+
+
 class HTTPSClientAuthConnection(http_client.HTTPSConnection):
     """
     Class to make a HTTPS connection, with support for
@@ -168,7 +285,8 @@ class BaseClient(object):
     def __init__(self, host, port=None, timeout=None, use_ssl=False,
                  auth_token=None, creds=None, doc_root=None, key_file=None,
                  cert_file=None, ca_file=None, insecure=False,
-                 configure_via_auth=True):
+                 configure_via_auth=True, pool_size=POOL_MAX_SIZE,
+                 pool_idle_timeout=POOL_MAX_IDLE):
         """
         Creates a new client to some service.
 
@@ -202,6 +320,10 @@ class BaseClient(object):
                          URL returned from the service catalog for the subject
                          endpoint will **override** the URL supplied to in
                          the host parameter.
+        :param pool_size: Optional. Number of idle connections to the service
+                          this process keeps open for later requests.
+        :param pool_idle_timeout: Optional. Number of seconds idle
+                                  connections to the service are kept open.
         """
         self.host = host
         self.port = port or self.DEFAULT_PORT
@@ -223,6 +345,8 @@ class BaseClient(object):
         self.cert_file = cert_file
         self.ca_file = ca_file
         self.insecure = insecure
+        self.pool_size = pool_size
+        self.pool_idle_timeout = pool_idle_timeout
         self.auth_plugin = self.make_auth_plugin(self.creds, self.insecure)
         self.connect_kwargs = self.get_connect_kwargs()
 
@@ -451,60 +575,41 @@ class BaseClient(object):
             if 'x-auth-token' not in headers and self.auth_token:
                 headers['x-auth-token'] = self.auth_token
 
-            c = connection_type(url.hostname, url.port, **self.connect_kwargs)
-
-            def _pushing(method):
-                return method.lower() in ('post', 'put')
-
-            def _simple(body):
-                return body is None or isinstance(body, bytes)
-
-            def _filelike(body):
-                return hasattr(body, 'read')
-
-            def _sendbody(connection, iter):
-                connection.endheaders()
-                for sent in iter:
-                    # iterator has done the heavy lifting
-                    pass
-
-            def _chunkbody(connection, iter):
-                connection.putheader('Transfer-Encoding', 'chunked')
-                connection.endheaders()
-                for chunk in iter:
-                    connection.send('%x\r\n%s\r\n' % (len(chunk), chunk))
-                connection.send('0\r\n\r\n')
-
-            # Do a simple request or a chunked request, depending
-            # on whether the body param is file-like or iterable and
-            # the method is PUT or POST
-            #
-            if not _pushing(method) or _simple(body):
-                # Simple request...
-                c.request(method, path, body, headers)
-            elif _filelike(body) or self._iterable(body):
-                c.putrequest(method, path)
-
-                use_sendfile = self._sendable(body)
-
-                # According to HTTP/1.1, Content-Length and Transfer-Encoding
-                # conflict.
-                for header, value in headers.items():
-                    if use_sendfile or header.lower() != 'content-length':
-                        c.putheader(header, str(value))
-
-                iter = utils.chunkreadable(body)
-
-                if use_sendfile:
-                    # send actual file without copying into userspace
-                    _sendbody(c, iter)
-                else:
-                    # otherwise iterate and chunk
-                    _chunkbody(c, iter)
-            else:
-                raise TypeError('Unsupported subject type: %s' % body.__class__)
+            pool_key = (os.getpid(), connection_type, url.hostname, url.port,
+                        tuple(sorted(self.connect_kwargs.items())))
+            pool = _POOLS.get(pool_key)
+            c = pool.get() if pool is not None else None
+            reused = c is not None
+            if not reused:
+                c = connection_type(url.hostname, url.port,
+                                    **self.connect_kwargs)
 
-            res = c.getresponse()
+            try:
+                res = self._send_request(c, method, path, body, headers)
+            except (socket.error, IOError, http_client.HTTPException) as e:
+                c.close()
+                # NOTE: The server may close an idle connection just as it
+                # is reused. The request is sent again on a new connection
+                # if its body can be sent again, but only when the failure
+                # shows the server never got it, as registry RPC calls are
+                # not idempotent.
+                if (not reused or not self._simple(body) or
+                        not self._stale_connection_error(e)):
+                    raise
+                c = connection_type(url.hostname, url.port,
+                                    **self.connect_kwargs)
+                res = self._send_request(c, method, path, body, headers)
+
+            if self.pool_size > 0 and not getattr(res, 'will_close', True):
+                if pool is None:
+                    pool = _POOLS.setdefault(
+                        pool_key, ConnectionPool(self.pool_size,
+                                                 self.pool_idle_timeout))
+                self._release_on_close(pool, c, res)
+                if res.length == 0:
+                    # NOTE: There is no body to read, so the response is
+                    # done with right away.
+                    res.close()
 
             def _retry(res):
                 return res.getheader('Retry-After')
@@ -546,6 +651,99 @@ class BaseClient(object):
         except (socket.error, IOError) as e:
             raise exception.ClientConnectionError(e)
 
+    @staticmethod
+    def _stale_connection_error(e):
+        """
+        Whether an error raised while using a pooled connection shows the
+        server closed the connection before reading the request, so the
+        request can safely be sent again.
+        """
+        if isinstance(e, socket.timeout):
+            return False
+        remote_disconnected = getattr(http_client, 'RemoteDisconnected', ())
+        if remote_disconnected and isinstance(e, remote_disconnected):
+            return True
+        if isinstance(e, http_client.BadStatusLine):
+            # NOTE: An empty status line means the connection was closed
+            # before any response byte was read.
+            return e.line in ('', "''")
+        return getattr(e, 'errno', None) in (errno.ECONNRESET, errno.EPIPE)
+
+    @staticmethod
+    def _release_on_close(pool, connection, response):
+        """
+        Hands a connection back to the pool once its response has been
+        read to the end, or closes it if the response is closed before.
+        """
+        def release(done):
+            if done:
+                pool.put(connection)
+            else:
+                connection.close()
+
+        _on_response_closed(response, release)
+
+    def _send_request(self, connection, method, path, body, headers):
+        """
+        Sends a request on a connection and returns the response.
+
+        If the body param has a read attribute, and method is either
+        POST or PUT, the request is sent with chunked-transfer encoding (or
+        with sendfile, where supported).
+        """
+        def _pushing(method):
+            return method.lower() in ('post', 'put')
+
+        def _filelike(body):
+            return hasattr(body, 'read')
+
+        def _sendbody(connection, iter):
+            connection.endheaders()
+            for sent in iter:
+                # iterator has done the heavy lifting
+                pass
+
+        def _chunkbody(connection, iter):
+            connection.putheader('Transfer-Encoding', 'chunked')
+            connection.endheaders()
+            for chunk in iter:
+                connection.send('%x\r\n%s\r\n' % (len(chunk), chunk))
+            connection.send('0\r\n\r\n')
+
+        # Do a simple request or a chunked request, depending
+        # on whether the body param is file-like or iterable and
+        # the method is PUT or POST
+        #
+        if not _pushing(method) or self._simple(body):
+            # Simple request...
+            connection.request(method, path, body, headers)
+        elif _filelike(body) or self._iterable(body):
+            connection.putrequest(method, path)
+
+            use_sendfile = self._sendable(body)
+
+            # According to HTTP/1.1, Content-Length and Transfer-Encoding
+            # conflict.
+            for header, value in headers.items():
+                if use_sendfile or header.lower() != 'content-length':
+                    connection.putheader(header, str(value))
+
+            iter = utils.chunkreadable(body)
+
+            if use_sendfile:
+                # send actual file without copying into userspace
+                _sendbody(connection, iter)
+            else:
+                # otherwise iterate and chunk
+                _chunkbody(connection, iter)
+        else:
+            raise TypeError('Unsupported subject type: %s' % body.__class__)
+
+        return connection.getresponse()
+
+    def _simple(self, body):
+        return body is None or isinstance(body, bytes)
+
     def _seekable(self, body):
         # pipes are not seekable, avoids sendfile() failure on e.g.
         #   cat /path/to/subject | subject add ...
@@ -446,6 +446,30 @@ Possible values:
 Related options:
     * None
 
+""")),
+    cfg.BoolOpt('track_user_storage_usage', default=False,
+                help=_("""
+Keep a running total of the storage consumed by each tenant in the database.
+
+The storage quota set with ``user_storage_quota`` is enforced on every
+upload and every change to the locations of an subject. By default, the
+storage consumed by the tenant is computed from all of the tenant's subjects
+each time. When this option is enabled, the total is kept in the
+``subject_storage_usage`` table instead, updated in the same transaction as
+the subjects and locations it is computed from, and the quota check reads a
+single row.
+
+The total for a tenant is computed from its subjects the first time it is
+needed. Totals can be recomputed by deleting their rows from the
+``subject_storage_usage`` table.
+
+Possible values:
+    * True
+    * False
+
+Related options:
+    * user_storage_quota
+
 """)),
     # NOTE(nikhil): Even though deprecated, the configuration option
     # ``enable_v1_api`` is set to True by default on purpose. Having it enabled
@@ -0,0 +1,149 @@
+# Copyright 2016 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Single-pass digests of subject data
+
+Subject data is hashed for several reasons as it streams through: for the
+checksum the subject cache verifies, for the secure hash recorded with
+the subject and for signature verification. A MultiDigest updates all the
+digests a stream needs, and the signature verifier, with each chunk in a
+single pass, optionally in a native thread so that hashing a chunk
+overlaps with reading and writing the next one.
+"""
+
+import collections
+import hashlib
+
+import eventlet
+from eventlet import tpool
+from oslo_config import cfg
+import six
+
+from subject.i18n import _
+
+# The algorithms hashlib provides on every platform, but for the SHAKE ones,
+# whose digests have no fixed length.
+HASHING_ALGORITHMS = sorted(name for name in hashlib.algorithms_guaranteed
+                            if not name.startswith('shake_'))
+
+digest_opts = [
+    cfg.StrOpt('hashing_algorithm',
+               default='sha512',
+               choices=HASHING_ALGORITHMS,
+               help=_("""
+Secure hashing algorithm used for computing the ``os_hash_value`` property.
+
+This option configures the hashing algorithm of the secure hash recorded
+with each subject as its data is uploaded, in addition to the MD5
+``checksum`` computed by the store. The name of the algorithm is recorded
+as the ``os_hash_algo`` property of the subject. The secure hash is
+computed in the same pass over the data as signature verification.
+
+Possible values:
+    * The name of a hash algorithm available on every platform in the
+      Python ``hashlib`` library, such as sha256, sha384 or sha512
+
+Related options:
+    * hashing_in_thread
+
+""")),
+    cfg.BoolOpt('hashing_in_thread',
+                default=False,
+                help=_("""
+Compute the digests of subject data in a native thread.
+
+When enabled, the digests of uploaded subject data and of subject data
+fetched into the subject cache are computed in a native thread, one chunk
+at a time, while the next chunk is read and written. As the hashing
+functions do not hold the Python global interpreter lock while hashing,
+this spreads the CPU time of hashing onto another core, at the expense
+of a hand-off between threads for every chunk.
+
+Possible values:
+    * True
+    * False
+
+Related options:
+    * hashing_algorithm
+
+""")),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(digest_opts)
+
+
+class MultiDigest(object):
+
+    """
+    Computes several digests of a stream of chunks in a single pass, and
+    updates a signature verifier with the same chunks.
+
+    In a native thread, a chunk is hashed while the caller goes on to read
+    the next one; the caller must not change a chunk once it is passed to
+    update().
+    """
+
+    def __init__(self, algorithms, verifier=None, in_thread=False):
+        """
+        :param algorithms: Names of the hashlib algorithms to compute
+        :param verifier: Signature verifier to update, or None
+        :param in_thread: Whether to hash in a native thread
+        """
+        self.hashes = collections.OrderedDict(
+            (name, hashlib.new(name)) for name in algorithms)
+        self.verifier = verifier
+        self.in_thread = in_thread
+        self._pending = None
+
+    def _update(self, chunk):
+        for digest in six.itervalues(self.hashes):
+            digest.update(chunk)
+        if self.verifier is not None:
+            self.verifier.update(chunk)
+
+    def update(self, chunk):
+        """Adds a chunk to every digest."""
+        if not self.in_thread:
+            self._update(chunk)
+            return
+        self.wait()
+        self._pending = eventlet.spawn(tpool.execute, self._update, chunk)
+
+    def wait(self):
+        """Waits until every chunk passed to update() has been hashed."""
+        if self._pending is not None:
+            pending, self._pending = self._pending, None
+            pending.wait()
+
+    def hexdigest(self, name):
+        """Returns the digest computed with the named algorithm."""
+        self.wait()
+        return self.hashes[name].hexdigest()
+
+
+def get_upload_digest(verifier=None):
+    """
+    Returns the MultiDigest computing the secure hash of uploaded subject
+    data, and updating the signature verifier if there is one.
+    """
+    return MultiDigest([CONF.hashing_algorithm], verifier=verifier,
+                       in_thread=CONF.hashing_in_thread)
+
+
+def get_checksum_digest():
+    """Returns a MultiDigest computing the MD5 checksum of subject data."""
+    return MultiDigest(['md5'], in_thread=CONF.hashing_in_thread)
@@ -0,0 +1,276 @@
+# Copyright 2016 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Read-through cache of subject metadata for the API tier
+
+Subject metadata changes rarely compared with how often it is read, so each
+API worker may keep the metadata it read from the database or registry for
+a short while. Entries are keyed by subject id and by the parts of the
+request context that decide which subjects are visible, and are dropped
+whenever the subject or its members are changed through this worker, when
+a subject notification sent by another node is received, or at the latest
+once ``subject_metadata_cache_ttl`` seconds have passed.
+"""
+
+import collections
+import copy
+import os
+import socket
+import sys
+import time
+
+from oslo_config import cfg
+from oslo_log import log as logging
+import oslo_messaging
+
+from subject.common import wsgi
+from subject.i18n import _, _LI
+import subject.notifier
+
+LOG = logging.getLogger(__name__)
+
+metadata_cache_opts = [
+    cfg.IntOpt('subject_metadata_cache_size',
+               default=0,
+               min=0,
+               help=_("""
+The number of subjects whose metadata each API worker caches.
+
+Provide the maximum number of subjects whose metadata is kept in memory
+by each API worker, so that repeated reads of the same subjects, such as
+downloads served from the subject cache, do not query the database or the
+registry every time. Once the cache is full, the least recently read
+subjects are dropped first. Setting this to 0 disables the cache.
+
+Possible values:
+    * Zero
+    * Positive integer
+
+Related options:
+    * subject_metadata_cache_ttl
+    * subject_metadata_cache_listen
+
+""")),
+    cfg.IntOpt('subject_metadata_cache_ttl',
+               default=30,
+               min=1,
+               help=_("""
+The number of seconds cached subject metadata is used for.
+
+Provide the longest time, in seconds, that an API worker uses the metadata
+it cached for a subject before reading it again. Changes made through the
+same worker are seen at once. Changes made through other workers or nodes
+are seen once this time has passed, or as soon as their notification is
+received if ``subject_metadata_cache_listen`` is enabled.
+
+Possible values:
+    * Positive integer
+
+Related options:
+    * subject_metadata_cache_size
+    * subject_metadata_cache_listen
+
+""")),
+    cfg.BoolOpt('subject_metadata_cache_listen',
+                default=False,
+                help=_("""
+Drop cached subject metadata on notifications from other nodes.
+
+When enabled, each API worker listens for the ``subject.*`` notifications
+sent on the notification topics and drops the metadata it cached for the
+subjects they name, so that changes made through other workers and nodes
+are seen before ``subject_metadata_cache_ttl`` passes. Every worker
+consumes the notifications from a pool of its own, named after its host,
+program and worker index, so that a restarted worker reuses the queue of
+the worker it replaces.
+
+The messaging broker keeps the queue of every pool, whether or not a
+worker consumes from it. As the workers started by a configuration
+reload run alongside the ones they replace for a while, they take other
+indexes, so up to twice as many queues as workers may exist per host and
+program. When the number of workers is lowered, or when this option is
+disabled, the queues no worker uses any more keep collecting
+``subject.*`` notifications until they are deleted on the broker.
+
+Possible values:
+    * True
+    * False
+
+Related options:
+    * subject_metadata_cache_size
+    * subject_metadata_cache_ttl
+
+""")),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(metadata_cache_opts)
+
+_CACHE = None
+_LISTENER = None
+
+
+class SubjectMetadataCache(object):
+
+    """
+    A least recently used cache of subject metadata whose entries expire
+    after a fixed time.
+
+    Entries of the same subject, read in different visibility contexts,
+    are kept together so that they can be dropped at once.
+    """
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.epoch = 0
+        self._subjects = collections.OrderedDict()
+
+    def get(self, subject_id, key):
+        """Returns the value cached for the subject under key, or None."""
+        entries = self._subjects.pop(subject_id, None)
+        if entries is None:
+            return None
+        self._subjects[subject_id] = entries
+
+        entry = entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.time():
+            del entries[key]
+            return None
+        return value
+
+    def set(self, subject_id, key, value, epoch):
+        """
+        Caches a value for the subject under key, unless a subject was
+        invalidated since epoch was read, as the value may then predate
+        the change.
+        """
+        if epoch != self.epoch:
+            return
+        entries = self._subjects.pop(subject_id, {})
+        entries[key] = (time.time() + self.ttl, value)
+        self._subjects[subject_id] = entries
+        while len(self._subjects) > self.size:
+            self._subjects.popitem(last=False)
+
+    def invalidate(self, subject_id):
+        """Drops everything cached for the subject."""
+        self.epoch += 1
+        self._subjects.pop(subject_id, None)
+
+    def clear(self):
+        self.epoch += 1
+        self._subjects.clear()
+
+
+class SubjectNotificationEndpoint(object):
+
+    """Drops the cached metadata of the subjects notifications name."""
+
+    filter_rule = oslo_messaging.NotificationFilter(
+        event_type=r'^subject\.')
+
+    def info(self, ctxt, publisher_id, event_type, payload, metadata):
+        if not isinstance(payload, dict):
+            return
+        if event_type.startswith('subject.member.'):
+            subject_id = payload.get('subject_id')
+        else:
+            subject_id = payload.get('id')
+        if subject_id:
+            invalidate(subject_id)
+
+
+def _start_listener():
+    global _LISTENER
+    # NOTE: the pool names the queue the notifications are consumed from,
+    # which outlives the process, so it must stay the same when a worker is
+    # restarted. Every worker of the host needs a pool of its own, as the
+    # listeners of a pool share its notifications out between them.
+    pool = 'subject-metadata-cache-%s-%s-%d' % (
+        socket.gethostname(), os.path.basename(sys.argv[0]),
+        wsgi.get_worker_index() or 0)
+    transport = subject.notifier.get_transport()
+    targets = [oslo_messaging.Target(topic=topic)
+               for topic in CONF.oslo_messaging_notifications.topics]
+    _LISTENER = oslo_messaging.get_notification_listener(
+        transport, targets, [SubjectNotificationEndpoint()],
+        executor='eventlet', pool=pool)
+    _LISTENER.start()
+    LOG.info(_LI("Listening for subject notifications in pool %s"), pool)
+
+
+def get_cache():
+    """
+    Returns the subject metadata cache of this process, or None if it is
+    disabled.
+    """
+    global _CACHE
+    size = CONF.subject_metadata_cache_size
+    if not size:
+        return None
+
+    ttl = CONF.subject_metadata_cache_ttl
+    if _CACHE is None or (_CACHE.size, _CACHE.ttl) != (size, ttl):
+        _CACHE = SubjectMetadataCache(size, ttl)
+    if CONF.subject_metadata_cache_listen and _LISTENER is None:
+        _start_listener()
+    return _CACHE
+
+
+def _visibility_key(context):
+    return context.is_admin, context.owner, context.can_see_deleted
+
+
+def get(namespace, context, subject_id, fetch):
+    """
+    Returns a copy of the metadata of a subject as fetch returns it,
+    calling fetch only if it is not cached for this visibility context.
+
+    :param namespace: Name telling apart the callers of this cache, as
+                      they may cache the same subject in different forms
+    :param context: The request context
+    :param subject_id: The subject id
+    :param fetch: Callable returning the metadata, or raising if the
+                  subject cannot be read in this context
+    """
+    cache = get_cache()
+    if cache is None:
+        return fetch()
+
+    key = (namespace,) + _visibility_key(context)
+    value = cache.get(subject_id, key)
+    if value is None:
+        epoch = cache.epoch
+        value = fetch()
+        cache.set(subject_id, key, copy.deepcopy(value), epoch)
+        return value
+    return copy.deepcopy(value)
+
+
+def invalidate(subject_id):
+    """Drops the cached metadata of a subject."""
+    if _CACHE is not None:
+        _CACHE.invalidate(subject_id)
+
+
+def clear():
+    """Drops the cached metadata of every subject."""
+    if _CACHE is not None:
+        _CACHE.clear()
@@ -12,6 +12,8 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+import os
 import re
 
 from oslo_config import cfg
@@ -89,6 +91,13 @@ CONF.register_opts(property_opts)
 # created
 InvalidPropProtectConf = exception.InvalidPropertyProtectionConfiguration
 
+# Number of (property, action, roles) decisions remembered per rule set.
+RULE_DECISION_CACHE_SIZE = 1024
+
+# The rules parsed from the property protection file, shared by every
+# PropertyRules in the process until the file or the configuration changes.
+_RULE_SET = None
+
 
 def is_property_protection_enabled():
     if CONF.property_protection_file:
@@ -96,6 +105,27 @@ def is_property_protection_enabled():
     return False
 
 
+def reset_rule_cache():
+    """Forgets the rules parsed from the property protection file."""
+    global _RULE_SET
+    _RULE_SET = None
+
+
+class _RuleSet(object):
+
+    """
+    The rules of a property protection file, with their expressions
+    compiled, and the decisions already taken with them.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.rules = []
+        self.prop_exp_mapping = {}
+        self.policies = []
+        self.decisions = collections.OrderedDict()
+
+
 class PropertyRules(object):
 
     def __init__(self, policy_enforcer=None):
@@ -108,9 +138,15 @@ class PropertyRules(object):
         self._load_rules()
 
     def _load_rules(self):
+        """
+        Loads the rules of the property protection file, parsing it only if
+        it or the configuration pointing at it changed since it was last
+        parsed in this process, and registers the policy rules they need.
+        """
+        global _RULE_SET
         try:
             conf_file = CONF.find_file(CONF.property_protection_file)
-            CONFIG.read(conf_file)
+            stat = os.stat(conf_file)
         except Exception as e:
             msg = (_LE("Couldn't find property protection file %(file)s: "
                        "%(error)s.") % {'file': CONF.property_protection_file,
@@ -126,6 +162,35 @@ class PropertyRules(object):
             LOG.error(msg)
             raise InvalidPropProtectConf()
 
+        key = (conf_file, stat.st_mtime, stat.st_size,
+               self.prop_prot_rule_format)
+        if _RULE_SET is None or _RULE_SET.key != key:
+            _RULE_SET = self._parse_rules(conf_file, key)
+
+        self.rule_set = _RULE_SET
+        self.rules = self.rule_set.rules
+        self.prop_exp_mapping = self.rule_set.prop_exp_mapping
+        self.policies = self.rule_set.policies
+        for property_exp, operation, permissions in self.policies:
+            # NOTE: The enforcer drops these rules when it reloads the
+            # policy file, so check that they are still there.
+            rule_name = "%s:%s" % (property_exp, operation)
+            if rule_name not in self.policy_enforcer.rules:
+                self._add_policy_rules(property_exp, operation, permissions)
+
+    def _parse_rules(self, conf_file, key):
+        try:
+            for section in CONFIG.sections():
+                CONFIG.remove_section(section)
+            CONFIG.read(conf_file)
+        except Exception as e:
+            msg = (_LE("Couldn't find property protection file %(file)s: "
+                       "%(error)s.") % {'file': CONF.property_protection_file,
+                                        'error': e})
+            LOG.error(msg)
+            raise InvalidPropProtectConf()
+
+        rule_set = _RuleSet(key)
         operations = ['create', 'read', 'update', 'delete']
         properties = CONFIG.sections()
         for property_exp in properties:
@@ -143,9 +208,9 @@ class PropertyRules(object):
                                     "combined in the policy file"),
                                 permissions)
                             raise InvalidPropProtectConf()
-                        self.prop_exp_mapping[compiled_rule] = property_exp
-                        self._add_policy_rules(property_exp, operation,
-                                               permissions)
+                        rule_set.prop_exp_mapping[compiled_rule] = property_exp
+                        rule_set.policies.append((property_exp, operation,
+                                                  permissions))
                         permissions = [permissions]
                     else:
                         permissions = [permission.strip() for permission in
@@ -170,7 +235,9 @@ class PropertyRules(object):
                         {'operation': operation,
                          'rule': property_exp})
 
-            self.rules.append((compiled_rule, property_dict))
+            rule_set.rules.append((compiled_rule, property_dict))
+
+        return rule_set
 
     def _compile_rule(self, rule):
         try:
@@ -209,13 +276,31 @@ class PropertyRules(object):
         return True
 
     def check_property_rules(self, property_name, action, context):
-        roles = context.roles
         if not self.rules:
             return True
 
         if action not in ['create', 'read', 'update', 'delete']:
             return False
 
+        if self.prop_prot_rule_format == 'policies':
+            # NOTE: Policy rules may look at more of the context than its
+            # roles, so their decisions are not remembered.
+            return self._check_property_rules(property_name, action, context)
+
+        key = (str(property_name), action, frozenset(context.roles))
+        decisions = self.rule_set.decisions
+        try:
+            allowed = decisions.pop(key)
+        except KeyError:
+            allowed = self._check_property_rules(property_name, action,
+                                                 context)
+            if len(decisions) >= RULE_DECISION_CACHE_SIZE:
+                decisions.popitem(last=False)
+        decisions[key] = allowed
+        return allowed
+
+    def _check_property_rules(self, property_name, action, context):
+        roles = context.roles
         for rule_exp, rule in self.rules:
             if rule_exp.search(str(property_name)):
                 break
@@ -267,8 +267,9 @@ class RPCClient(client.BaseClient):
 
         # NOTE(flaper87): Return the first result if
         # a single command was executed.
-        content = content[0]
+        return self._unpack_result(content[0])
 
+    def _unpack_result(self, content):
         # NOTE(flaper87): Check if content is an error
         # and re-raise it if raise_exc is True. Before
         # checking if content contains the '_error' key,
@@ -287,6 +288,13 @@ class RPCClient(client.BaseClient):
                 raise exception.RPCError(**error)
         return content
 
+    def batch(self):
+        """
+        Returns an RPCBatch that collects the commands called on it
+        and sends them to the server in a single request.
+        """
+        return RPCBatch(self)
+
     def __getattr__(self, item):
         """
         This method returns a method_proxy that
@@ -300,3 +308,100 @@ class RPCClient(client.BaseClient):
             return self.do_request(item, **kw)
 
         return method_proxy
+
+
+class RPCFuture(object):
+
+    """The pending result of a command called on an RPCBatch."""
+
+    def __init__(self, batch):
+        self._batch = batch
+        self._done = False
+        self._content = None
+        self._exc = None
+
+    def _set_content(self, content):
+        self._content = content
+        self._done = True
+
+    def _set_exception(self, exc):
+        self._exc = exc
+        self._done = True
+
+    def done(self):
+        """Returns True once the batch holding the command was sent."""
+        return self._done
+
+    def result(self):
+        """
+        Returns the result of the command, sending the batch holding it
+        first if needed, or raises the error the command failed with.
+        """
+        if not self._done:
+            self._batch.flush()
+        if self._exc is not None:
+            raise self._exc
+        return self._batch.client._unpack_result(self._content)
+
+
+class RPCBatch(object):
+
+    """
+    Collects the commands called on it and sends them to the server in
+    a single request when it is flushed: on leaving the ``with`` block
+    it is used in, or when the result of one of its commands is needed.
+
+    The server executes the commands in the order they were called, so a
+    command may rely on the effects of the commands called before it,
+    and runs each of them whether or not the previous ones failed::
+
+        with client.batch() as batch:
+            subject = batch.subject_get(subject_id=subject_id)
+            tags = batch.subject_tag_get_all(subject_id=subject_id)
+        return subject.result(), tags.result()
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._commands = []
+        self._futures = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        if exc_type is None:
+            self.flush()
+
+    def flush(self):
+        """Sends the commands called since the last flush, if any."""
+        if not self._commands:
+            return
+
+        commands, futures = self._commands, self._futures
+        self._commands, self._futures = [], []
+        try:
+            results = self.client.bulk_request(commands)
+        except Exception as e:
+            for future in futures:
+                future._set_exception(e)
+            raise
+
+        for future, content in zip(futures, results):
+            future._set_content(content)
+
+    def __getattr__(self, item):
+        """
+        This method returns a method_proxy that queues the
+        rpc call and returns an RPCFuture for its result.
+        """
+        if item.startswith('_'):
+            raise AttributeError(item)
+
+        def method_proxy(**kw):
+            future = RPCFuture(self)
+            self._commands.append({'command': item, 'kwargs': kw})
+            self._futures.append(future)
+            return future
+
+        return method_proxy
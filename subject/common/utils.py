@@ -20,6 +20,8 @@
 System-level utilities and helper functions.
 """
 
+import base64
+import datetime
 import errno
 
 try:
@@ -36,6 +38,7 @@ import uuid
 from OpenSSL import crypto
 from oslo_config import cfg
 from oslo_log import log as logging
+from oslo_serialization import jsonutils
 from oslo_utils import encodeutils
 from oslo_utils import excutils
 from oslo_utils import netutils
@@ -124,7 +127,10 @@ def cooperative_read(fd):
     return readfn
 
 
-MAX_COOP_READER_BUFFER_SIZE = 134217728  # 128M seems like a sane buffer limit
+COOP_READER_BLOCK_SIZE = 65536
+# Larger blocks are returned in parts, as allocating fresh buffers beyond
+# this size costs more than the smaller reads that fill them.
+MAX_COOP_READER_BLOCK_SIZE = 8388608
 
 
 class CooperativeReader(object):
@@ -136,83 +142,156 @@ class CooperativeReader(object):
     one subject being uploaded/downloaded this prevents eventlet thread
     starvation, ie allows all threads to be scheduled periodically rather than
     having the same thread be continuously active.
+
+    Short reads of the underlying file object or iterator, such as those of
+    a socket, are coalesced into blocks of the requested size, up to
+    MAX_COOP_READER_BLOCK_SIZE bytes, which are filled in place with
+    readinto() when the file object supports it and returned as bytes. Only
+    one sleep is performed for each block, and the number of bytes read can
+    be limited and the blocks hashed without wrapping the reader in further
+    readers.
     """
-    def __init__(self, fd):
+    def __init__(self, fd, limit=None, block_size=COOP_READER_BLOCK_SIZE,
+                 digest=None):
         """
         :param fd: Underlying subject file object
+        :param limit: maximum number of bytes the reader should allow, or
+                      None for no limit
+        :param block_size: size of the blocks yielded when iterating
+        :param digest: subject.common.digest.MultiDigest to update with
+                       the data read, or None
         """
         self.fd = fd
+        self.limit = limit
+        self.block_size = block_size
+        self.digest = digest
+        self.bytes_read = 0
         self.iterator = None
-        # NOTE(markwash): if the underlying supports read(), overwrite the
-        # default iterator-based implementation with cooperative_read which
-        # is more straightforward
-        if hasattr(fd, 'read'):
-            self.read = cooperative_read(fd)
+        # Unread part of the last chunk of an iterator based fd
+        self.buffer = memoryview(b'')
+        if hasattr(fd, 'readinto'):
+            self._read_block = self._readinto_block
+        elif hasattr(fd, 'read'):
+            self._read_block = self._read_file_block
         else:
-            self.iterator = None
-            self.buffer = b''
-            self.position = 0
+            self._read_block = self._read_iterator_block
 
     def read(self, length=None):
-        """Return the requested amount of bytes, fetching the next chunk of
-        the underlying iterator when needed.
+        """Return the requested amount of bytes, or less only at the end of
+        the data or if more than MAX_COOP_READER_BLOCK_SIZE bytes are asked
+        for.
 
-        This is replaced with cooperative_read in __init__ if the underlying
-        fd already supports read().
+        If no length is given, the rest of the data is returned when the
+        underlying fd supports read(), or else its next chunk.
         """
         if length is None:
-            if len(self.buffer) - self.position > 0:
-                # if no length specified but some data exists in buffer,
-                # return that data and clear the buffer
-                result = self.buffer[self.position:]
-                self.buffer = b''
-                self.position = 0
-                return str(result)
+            if hasattr(self.fd, 'read'):
+                result = self.fd.read()
             else:
-                # otherwise read the next chunk from the underlying iterator
-                # and return it as a whole. Reset the buffer, as subsequent
-                # calls may specify the length
-                try:
-                    if self.iterator is None:
-                        self.iterator = self.__iter__()
-                    return next(self.iterator)
-                except StopIteration:
-                    return ''
-                finally:
-                    self.buffer = b''
-                    self.position = 0
+                result = self._read_chunk()
+        elif length > 0:
+            result = self._read_block(min(length,
+                                          MAX_COOP_READER_BLOCK_SIZE))
         else:
-            result = bytearray()
-            while len(result) < length:
-                if self.position < len(self.buffer):
-                    to_read = length - len(result)
-                    chunk = self.buffer[self.position:self.position + to_read]
-                    result.extend(chunk)
-
-                    # This check is here to prevent potential OOM issues if
-                    # this code is called with unreasonably high values of read
-                    # size. Currently it is only called from the HTTP clients
-                    # of Glance backend stores, which use httplib for data
-                    # streaming, which has readsize hardcoded to 8K, so this
-                    # check should never fire. Regardless it still worths to
-                    # make the check, as the code may be reused somewhere else.
-                    if len(result) >= MAX_COOP_READER_BUFFER_SIZE:
-                        raise exception.LimitExceeded()
-                    self.position += len(chunk)
-                else:
-                    try:
-                        if self.iterator is None:
-                            self.iterator = self.__iter__()
-                        self.buffer = next(self.iterator)
-                        self.position = 0
-                    except StopIteration:
-                        self.buffer = b''
-                        self.position = 0
-                        return bytes(result)
-            return bytes(result)
+            return b''
+
+        self.bytes_read += len(result)
+        if self.limit is not None and self.bytes_read > self.limit:
+            raise exception.SubjectSizeLimitExceeded()
+        if self.digest is not None and result:
+            self.digest.update(result)
+        sleep(0)
+        return result
+
+    def _readinto_block(self, length):
+        block = bytearray(length)
+        view = memoryview(block)
+        filled = 0
+        while filled < length:
+            count = self.fd.readinto(view[filled:])
+            if not count:
+                break
+            filled += count
+        view.release()
+        if filled < length:
+            del block[filled:]
+        return bytes(block)
+
+    def _read_file_block(self, length):
+        chunk = self.fd.read(length)
+        if len(chunk) in (0, length):
+            return chunk
+
+        more = self.fd.read(length - len(chunk))
+        if not more:
+            return chunk
+
+        # NOTE: The fd returned less than asked for before reaching the end
+        # of the data, as sockets do, so the block is coalesced in place.
+        block = bytearray(length)
+        filled = len(chunk)
+        block[:filled] = chunk
+        while more:
+            block[filled:filled + len(more)] = more
+            filled += len(more)
+            if filled == length:
+                break
+            more = self.fd.read(length - filled)
+        if filled < length:
+            del block[filled:]
+        return bytes(block)
+
+    def _next_chunk(self):
+        if self.iterator is None:
+            self.iterator = iter(self.fd)
+        try:
+            return next(self.iterator)
+        except StopIteration:
+            return None
+
+    def _read_chunk(self):
+        if self.buffer:
+            result, self.buffer = self.buffer.tobytes(), memoryview(b'')
+            return result
+        chunk = self._next_chunk()
+        return b'' if chunk is None else chunk
+
+    def _read_iterator_block(self, length):
+        if not self.buffer:
+            chunk = self._next_chunk()
+            if chunk is None:
+                return b''
+            if len(chunk) == length:
+                return chunk
+            self.buffer = memoryview(chunk)
+
+        if len(self.buffer) >= length:
+            result = self.buffer[:length].tobytes()
+            self.buffer = self.buffer[length:]
+            return result
+
+        block = bytearray(length)
+        filled = 0
+        while filled < length:
+            if not self.buffer:
+                chunk = self._next_chunk()
+                if chunk is None:
+                    break
+                self.buffer = memoryview(chunk)
+            count = min(len(self.buffer), length - filled)
+            block[filled:filled + count] = self.buffer[:count]
+            self.buffer = self.buffer[count:]
+            filled += count
+        if filled < length:
+            del block[filled:]
+        return bytes(block)
 
     def __iter__(self):
-        return cooperative_iter(self.fd.__iter__())
+        while True:
+            block = self.read(self.block_size)
+            if not block:
+                break
+            yield block
 
 
 class LimitingReader(object):
@@ -228,6 +307,10 @@ class LimitingReader(object):
         self.data = data
         self.limit = limit
         self.bytes_read = 0
+        # NOTE: Only offer readinto() if the data supports it, so that a
+        # CooperativeReader wrapping this reader fills its blocks in place.
+        if hasattr(data, 'readinto'):
+            self.readinto = self._readinto
 
     def __iter__(self):
         for chunk in self.data:
@@ -244,6 +327,13 @@ class LimitingReader(object):
             raise exception.SubjectSizeLimitExceeded()
         return result
 
+    def _readinto(self, buf):
+        count = self.data.readinto(buf)
+        self.bytes_read += count or 0
+        if self.bytes_read > self.limit:
+            raise exception.SubjectSizeLimitExceeded()
+        return count
+
 
 def subject_meta_to_http_headers(subject_meta):
     """
@@ -568,6 +658,80 @@ def stash_conf_values():
     return conf
 
 
+# Prefix of markers encoding the sort key values of the last item of a page,
+# which tells them apart from the item IDs used as markers otherwise.
+KEYSET_MARKER_PREFIX = 'ks1.'
+KEYSET_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def keyset_sort_keys(sort_keys):
+    """
+    Returns the sort keys a listing is actually sorted by: the requested
+    sort keys followed by created_at and id, which make the order unique.
+
+    :param sort_keys: list of requested sort keys
+    """
+    sort_keys = list(sort_keys)
+    for key in ['created_at', 'id']:
+        if key not in sort_keys:
+            sort_keys.append(key)
+    return sort_keys
+
+
+def encode_keyset_marker(sort_keys, values):
+    """
+    Encode the sort key values of the last item of a page into an opaque
+    marker, so that the next page can be fetched without looking the item
+    up first.
+
+    :param sort_keys: list of sort keys, as returned by keyset_sort_keys
+    :param values: list of the values of the sort keys for the item
+    """
+    encoded = []
+    for value in values:
+        if isinstance(value, datetime.datetime):
+            value = {'datetime': value.strftime(KEYSET_DATETIME_FORMAT)}
+        encoded.append(value)
+    payload = jsonutils.dumps({'keys': list(sort_keys), 'values': encoded})
+    token = base64.urlsafe_b64encode(encodeutils.safe_encode(payload))
+    return KEYSET_MARKER_PREFIX + encodeutils.safe_decode(token).rstrip('=')
+
+
+def is_keyset_marker(marker):
+    return (isinstance(marker, six.string_types) and
+            marker.startswith(KEYSET_MARKER_PREFIX))
+
+
+def decode_keyset_marker(marker):
+    """
+    Decode a marker created by encode_keyset_marker into a tuple of the
+    sort keys and their values.
+
+    :param marker: the marker to decode
+    :raises: InvalidParameterValue if the marker cannot be decoded
+    """
+    token = marker[len(KEYSET_MARKER_PREFIX):]
+    token += '=' * (-len(token) % 4)
+    try:
+        payload = jsonutils.loads(
+            base64.urlsafe_b64decode(encodeutils.safe_encode(token)))
+        sort_keys = payload['keys']
+        values = []
+        for value in payload['values']:
+            if isinstance(value, dict):
+                value = datetime.datetime.strptime(value['datetime'],
+                                                   KEYSET_DATETIME_FORMAT)
+            values.append(value)
+    except (TypeError, ValueError, KeyError):
+        raise exception.InvalidParameterValue(value=marker, param='marker',
+                                              extra_msg=_('Invalid marker'))
+
+    if len(sort_keys) != len(values):
+        raise exception.InvalidParameterValue(value=marker, param='marker',
+                                              extra_msg=_('Invalid marker'))
+    return sort_keys, values
+
+
 def split_filter_op(expression):
     """Split operator from threshold in an expression.
     Designed for use on a comparative-filtering query field.
@@ -53,6 +53,7 @@ from subject.common import exception
 from subject.common import utils
 from subject import i18n
 from subject.i18n import _, _LE, _LI, _LW
+from subject import notifier
 
 
 bind_opts = [
@@ -329,6 +330,19 @@ profiler_opts.set_defaults(CONF)
 
 ASYNC_EVENTLET_THREAD_POOL_LIST = []
 
+# Index of this worker process among the workers of its server, or None if
+# this process is not a worker
+_WORKER_INDEX = None
+
+
+def get_worker_index():
+    """
+    Returns the index of this worker process among the workers of its
+    server, or None if this process is not a forked worker. A worker
+    started in place of one that exited takes over its index.
+    """
+    return _WORKER_INDEX
+
 
 def get_num_workers():
     """Return the configured number of workers."""
@@ -468,6 +482,8 @@ class Server(object):
         self.threads = threads
         self.children = set()
         self.stale_children = set()
+        # worker index of every child process, by pid
+        self.worker_indexes = {}
         self.running = True
         # NOTE(abhishek): Allows us to only re-initialize subject_store when
         # the API's configuration reloads.
@@ -542,6 +558,7 @@ class Server(object):
             LOG.info(_LI('Removed stale child %s'), pid)
         else:
             LOG.warn(_LW('Unrecognised child %s') % pid)
+        self.worker_indexes.pop(pid, None)
 
     def _verify_and_respawn_children(self, pid, status):
         if len(self.stale_children) == 0:
@@ -629,6 +646,14 @@ class Server(object):
         except KeyboardInterrupt:
             pass
 
+    def _get_free_worker_index(self):
+        """Returns the lowest worker index no child process is using."""
+        used = set(self.worker_indexes.values())
+        index = 0
+        while index in used:
+            index += 1
+        return index
+
     def run_child(self):
         def child_hup(*args):
             """Shuts down child processes, existing requests are handled."""
@@ -636,10 +661,18 @@ class Server(object):
             eventlet.wsgi.is_accepting = False
             self.sock.close()
 
+        def child_term(*args):
+            """Sends queued notifications, then exits on SIGTERM."""
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            eventlet.spawn_n(self._terminate_child)
+
+        global _WORKER_INDEX
+        index = self._get_free_worker_index()
         pid = os.fork()
         if pid == 0:
+            _WORKER_INDEX = index
             signal.signal(signal.SIGHUP, child_hup)
-            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, child_term)
             # ignore the interrupt signal to avoid a race whereby
             # a child worker receives the signal before the parent
             # and is respawned unnecessarily as a result
@@ -656,6 +689,19 @@ class Server(object):
         else:
             LOG.info(_LI('Started child %s'), pid)
             self.children.add(pid)
+            self.worker_indexes[pid] = index
+
+    @staticmethod
+    def _terminate_child():
+        """
+        Flushes the notification queue of a child process and terminates
+        it. The process is killed by SIGTERM, as atexit handlers do not run
+        then.
+        """
+        try:
+            notifier.flush()
+        finally:
+            os.kill(os.getpid(), signal.SIGTERM)
 
     def run_server(self):
         """Run a WSGI server."""
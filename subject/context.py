@@ -31,6 +31,9 @@ class RequestContext(context.RequestContext):
         super(RequestContext, self).__init__(**kwargs)
         self.owner_is_tenant = owner_is_tenant
         self.service_catalog = service_catalog
+        # Policy decisions made for this request, see
+        # subject.api.policy.Enforcer
+        self.policy_decisions = {}
         self.policy_enforcer = policy_enforcer or policy.Enforcer()
         if not self.is_admin:
             self.is_admin = self.policy_enforcer.check_is_admin(self)
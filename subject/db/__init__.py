@@ -17,6 +17,8 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import functools
+
 from oslo_config import cfg
 from oslo_utils import importutils
 from wsme.rest import json
@@ -25,6 +27,7 @@ from subject.common import crypt
 from subject.common import exception
 #from subject.common.glare import serialization
 from subject.common import location_strategy
+from subject.common import metadata_cache
 import subject.domain
 import subject.domain.proxy
 from subject.i18n import _
@@ -53,8 +56,8 @@ BASE_MODEL_ATTRS = set(['id', 'created_at', 'updated_at', 'deleted_at',
 IMAGE_ATTRS = BASE_MODEL_ATTRS | set(['name', 'status', 'size', 'virtual_size',
                                       'disk_format', 'subject_format',
                                       'min_disk', 'min_ram', 'is_public',
-                                      'locations', 'checksum', 'owner',
-                                      'protected'])
+                                      'locations', 'checksum', 'os_hash_algo',
+                                      'os_hash_value', 'owner', 'protected'])
 
 
 class SubjectRepo(object):
@@ -64,16 +67,28 @@ class SubjectRepo(object):
         self.db_api = db_api
 
     def get(self, subject_id):
+        db_api_subject, tags = metadata_cache.get(
+            'subject', self.context, subject_id,
+            functools.partial(self._get_from_db, subject_id))
+        subject = self._format_subject_from_db(db_api_subject, tags)
+        return SubjectProxy(subject, self.context, self.db_api)
+
+    def _get_from_db(self, subject_id):
         try:
-            db_api_subject = dict(self.db_api.subject_get(self.context, subject_id))
+            db_api_subject, tags = self.db_api.subject_get_with_tags(
+                self.context, subject_id)
+            db_api_subject = dict(db_api_subject)
             if db_api_subject['deleted']:
                 raise exception.SubjectNotFound()
         except (exception.SubjectNotFound, exception.Forbidden):
             msg = _("No subject found with ID %s") % subject_id
             raise exception.SubjectNotFound(msg)
-        tags = self.db_api.subject_tag_get_all(self.context, subject_id)
-        subject = self._format_subject_from_db(db_api_subject, tags)
-        return SubjectProxy(subject, self.context, self.db_api)
+        # NOTE: Keep plain values only, the properties may be model objects.
+        db_api_subject['properties'] = [
+            {'name': prop['name'], 'value': prop['value'],
+             'deleted': prop['deleted']}
+            for prop in db_api_subject['properties']]
+        return db_api_subject, tags
 
     def list(self, marker=None, limit=None, sort_key=None,
              sort_dir=None, filters=None, member_status='accepted'):
@@ -115,6 +130,8 @@ class SubjectRepo(object):
             protected=db_subject['protected'],
             locations=location_strategy.get_ordered_locations(locations),
             checksum=db_subject['checksum'],
+            os_hash_algo=db_subject['os_hash_algo'],
+            os_hash_value=db_subject['os_hash_value'],
             owner=db_subject['owner'],
             tar_format=db_subject['tar_format'],
             contributor=db_subject['contributor'],
@@ -151,6 +168,8 @@ class SubjectRepo(object):
             'protected': subject.protected,
             'locations': locations,
             'checksum': subject.checksum,
+            'os_hash_algo': subject.os_hash_algo,
+            'os_hash_value': subject.os_hash_value,
             'owner': subject.owner,
             'tar_format': subject.tar_format,
             'contributor': subject.contributor,
@@ -173,9 +192,12 @@ class SubjectRepo(object):
         # the updated_at value is not set in the _format_subject_to_db
         # function since it is specific to subject create
         subject_values['updated_at'] = subject.updated_at
-        new_values = self.db_api.subject_create(self.context, subject_values)
-        self.db_api.subject_tag_set_all(self.context,
-                                      subject.subject_id, subject.tags)
+        subject_values['tags'] = list(subject.tags)
+        try:
+            new_values = self.db_api.subject_create(self.context,
+                                                    subject_values)
+        finally:
+            metadata_cache.invalidate(subject.subject_id)
         subject.created_at = new_values['created_at']
         subject.updated_at = new_values['updated_at']
 
@@ -184,6 +206,7 @@ class SubjectRepo(object):
         if (subject_values['size'] is not None
            and subject_values['size'] > CONF.subject_size_cap):
             raise exception.SubjectSizeLimitExceeded
+        subject_values['tags'] = list(subject.tags)
         try:
             new_values = self.db_api.subject_update(self.context,
                                                   subject.subject_id,
@@ -193,8 +216,8 @@ class SubjectRepo(object):
         except (exception.SubjectNotFound, exception.Forbidden):
             msg = _("No subject found with ID %s") % subject.subject_id
             raise exception.SubjectNotFound(msg)
-        self.db_api.subject_tag_set_all(self.context, subject.subject_id,
-                                      subject.tags)
+        finally:
+            metadata_cache.invalidate(subject.subject_id)
         subject.updated_at = new_values['updated_at']
 
     def remove(self, subject):
@@ -206,7 +229,11 @@ class SubjectRepo(object):
             msg = _("No subject found with ID %s") % subject.subject_id
             raise exception.SubjectNotFound(msg)
         # NOTE(markwash): don't update tags?
-        new_values = self.db_api.subject_destroy(self.context, subject.subject_id)
+        try:
+            new_values = self.db_api.subject_destroy(self.context,
+                                                     subject.subject_id)
+        finally:
+            metadata_cache.invalidate(subject.subject_id)
         subject.updated_at = new_values['updated_at']
 
 
@@ -273,13 +300,15 @@ class SubjectMemberRepo(object):
                                                 subject_id=self.subject.subject_id,
                                                 member=subject_member.member_id,
                                                 include_deleted=True)
-        if members:
-            new_values = self.db_api.subject_member_update(self.context,
-                                                         members[0]['id'],
-                                                         subject_member_values)
-        else:
-            new_values = self.db_api.subject_member_create(self.context,
-                                                         subject_member_values)
+        try:
+            if members:
+                new_values = self.db_api.subject_member_update(
+                    self.context, members[0]['id'], subject_member_values)
+            else:
+                new_values = self.db_api.subject_member_create(
+                    self.context, subject_member_values)
+        finally:
+            metadata_cache.invalidate(self.subject.subject_id)
         subject_member.created_at = new_values['created_at']
         subject_member.updated_at = new_values['updated_at']
         subject_member.id = new_values['id']
@@ -290,6 +319,8 @@ class SubjectMemberRepo(object):
         except (exception.NotFound, exception.Forbidden):
             msg = _("The specified member %s could not be found")
             raise exception.NotFound(msg % subject_member.id)
+        finally:
+            metadata_cache.invalidate(self.subject.subject_id)
 
     def save(self, subject_member, from_state=None):
         subject_member_values = self._format_subject_member_to_db(subject_member)
@@ -299,6 +330,8 @@ class SubjectMemberRepo(object):
                                                          subject_member_values)
         except (exception.NotFound, exception.Forbidden):
             raise exception.NotFound()
+        finally:
+            metadata_cache.invalidate(self.subject.subject_id)
         subject_member.updated_at = new_values['updated_at']
 
     def get(self, member_id):
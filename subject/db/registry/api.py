@@ -83,6 +83,21 @@ def subject_get(client, subject_id, force_show_deleted=False):
                             force_show_deleted=force_show_deleted)
 
 
+@_get_client
+def subject_get_with_tags(client, subject_id, force_show_deleted=False):
+    """
+    Get an subject and the list of its tags in a single round trip to the
+    registry. Both commands are sent in one batch rather than as the
+    composite subject_get_with_tags command, so that this also works with
+    registries which do not have that command yet.
+    """
+    with client.batch() as batch:
+        subject = batch.subject_get(subject_id=subject_id,
+                                    force_show_deleted=force_show_deleted)
+        tags = batch.subject_tag_get_all(subject_id=subject_id)
+    return subject.result(), tags.result()
+
+
 def is_subject_visible(context, subject, status=None):
     """Return True if the subject is visible in this context."""
     # Is admin == subject visible
@@ -242,6 +257,21 @@ def subject_location_delete(client, subject_id, location_id, status, session=Non
                                  status=status)
 
 
+@_get_client
+def subject_location_get_pending_delete(client, min_age=0, marker=None,
+                                        limit=None, session=None):
+    """Get the locations waiting for the scrubber."""
+    return client.subject_location_get_pending_delete(min_age=min_age,
+                                                      marker=marker,
+                                                      limit=limit)
+
+
+@_get_client
+def subject_locations_scrubbed(client, location_ids, session=None):
+    """Mark scrubbed locations deleted, and their subjects once done."""
+    return client.subject_locations_scrubbed(location_ids=location_ids)
+
+
 @_get_client
 def subject_location_update(client, subject_id, location, session=None):
     """Update subject location."""
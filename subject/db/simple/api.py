@@ -14,8 +14,11 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import bisect
 import copy
+import datetime
 import functools
+import itertools
 import uuid
 
 from oslo_log import log as logging
@@ -31,7 +34,10 @@ LOG = logging.getLogger(__name__)
 
 DATA = {
     'subjects': {},
+    'subjects_by_created': [],
     'members': {},
+    'members_by_subject': {},
+    'members_by_tenant': {},
     'metadef_namespace_resource_types': [],
     'metadef_namespaces': [],
     'metadef_objects': [],
@@ -73,7 +79,10 @@ def reset():
     global DATA
     DATA = {
         'subjects': {},
-        'members': [],
+        'subjects_by_created': [],
+        'members': {},
+        'members_by_subject': {},
+        'members_by_tenant': {},
         'metadef_namespace_resource_types': [],
         'metadef_namespaces': [],
         'metadef_objects': [],
@@ -142,6 +151,45 @@ def _subject_member_format(subject_id, tenant_id, can_share, status='pending',
     }
 
 
+def _member_index_add(member):
+    """Adds a member to the indexes by subject and by member tenant."""
+    by_tenant = DATA['members_by_subject'].setdefault(member['subject_id'], {})
+    by_tenant.setdefault(member['member'], []).append(member)
+    by_subject = DATA['members_by_tenant'].setdefault(member['member'], {})
+    by_subject.setdefault(member['subject_id'], []).append(member)
+
+
+def _member_index_remove(member):
+    """Removes a member from the indexes by subject and by member tenant."""
+    for index, outer, inner in ((DATA['members_by_subject'],
+                                 member['subject_id'], member['member']),
+                                (DATA['members_by_tenant'],
+                                 member['member'], member['subject_id'])):
+        members = [m for m in index[outer][inner] if m is not member]
+        if members:
+            index[outer][inner] = members
+        else:
+            del index[outer][inner]
+            if not index[outer]:
+                del index[outer]
+
+
+def _created_index_key(subject):
+    return subject['created_at'], subject['id']
+
+
+def _subject_copy(subject):
+    """
+    Returns a copy of a stored subject which can be handed out, copying
+    only the nested records rather than deep-copying the whole subject.
+    """
+    subject = dict(subject)
+    subject['properties'] = [dict(prop) for prop in subject['properties']]
+    subject['locations'] = [dict(loc, metadata=copy.deepcopy(loc['metadata']))
+                            for loc in subject['locations']]
+    return subject
+
+
 def _pop_task_info_values(values):
     task_info_values = {}
     for k, v in list(values.items()):
@@ -220,6 +268,8 @@ def _subject_format(subject_id, **values):
         'size': None,
         'virtual_size': None,
         'checksum': None,
+        'os_hash_algo': None,
+        'os_hash_value': None,
         'tags': [],
         'created_at': dt,
         'updated_at': dt,
@@ -241,10 +291,12 @@ def _subject_format(subject_id, **values):
     return _subject_update(subject, values, values.pop('properties', {}))
 
 
-def _filter_subjects(subjects, filters, context,
-                   status='accepted', is_public=None,
-                   admin_as_user=False):
-    filtered_subjects = []
+def _subject_filter(filters, context, status='accepted', is_public=None,
+                    admin_as_user=False):
+    """
+    Returns a function telling whether an subject is visible in this context
+    and matches the supplied filters.
+    """
     if 'properties' in filters:
         prop_filter = filters.pop('properties')
         filters.update(prop_filter)
@@ -254,33 +306,42 @@ def _filter_subjects(subjects, filters, context,
 
     visibility = filters.pop('visibility', None)
 
-    for subject in subjects:
-        member = subject_member_find(context, subject_id=subject['id'],
-                                   member=context.owner, status=status)
-        is_member = len(member) > 0
+    # NOTE: Look the subjects shared with the tenant up once, rather than
+    # looking its membership up for every subject.
+    if context.owner is None:
+        shared_ids = set(m['subject_id'] for m in
+                         subject_member_find(context, status=status))
+    else:
+        shared = DATA['members_by_tenant'].get(context.owner, {})
+        shared_ids = set(subject_id for subject_id, members in shared.items()
+                         if any(status is None or m['status'] == status
+                                for m in members))
+
+    def matches(subject):
+        is_member = subject['id'] in shared_ids
         has_ownership = context.owner and subject['owner'] == context.owner
         can_see = (subject['is_public'] or has_ownership or is_member or
                    (context.is_admin and not admin_as_user))
         if not can_see:
-            continue
+            return False
 
         if visibility:
             if visibility == 'public':
                 if not subject['is_public']:
-                    continue
+                    return False
             elif visibility == 'private':
                 if subject['is_public']:
-                    continue
+                    return False
                 if not (has_ownership or (context.is_admin
                         and not admin_as_user)):
-                    continue
+                    return False
             elif visibility == 'shared':
                 if not is_member:
-                    continue
+                    return False
 
         if is_public is not None:
             if not subject['is_public'] == is_public:
-                continue
+                return False
 
         to_add = True
         for k, value in six.iteritems(filters):
@@ -322,7 +383,7 @@ def _filter_subjects(subjects, filters, context,
                 to_add = subject.get(key) == value
             elif k == 'tags':
                 filter_tags = value
-                subject_tags = subject_tag_get_all(context, subject['id'])
+                subject_tags = DATA['tags'].get(subject['id'], [])
                 for tag in filter_tags:
                     if tag not in subject_tags:
                         to_add = False
@@ -338,16 +399,26 @@ def _filter_subjects(subjects, filters, context,
             if not to_add:
                 break
 
-        if to_add:
-            filtered_subjects.append(subject)
+        return to_add
+
+    return matches
 
-    return filtered_subjects
+
+def _filter_subjects(subjects, filters, context,
+                     status='accepted', is_public=None,
+                     admin_as_user=False):
+    matches = _subject_filter(filters, context, status, is_public,
+                              admin_as_user)
+    return [subject for subject in subjects if matches(subject)]
 
 
 def _do_pagination(context, subjects, marker, limit, show_deleted,
                    status='accepted'):
     start = 0
     end = -1
+    if utils.is_keyset_marker(marker):
+        sort_keys, values = utils.decode_keyset_marker(marker)
+        marker = dict(zip(sort_keys, values)).get('id')
     if marker is None:
         start = 0
     else:
@@ -366,8 +437,41 @@ def _do_pagination(context, subjects, marker, limit, show_deleted,
     return subjects[start:end]
 
 
-def _sort_subjects(subjects, sort_key, sort_dir):
-    sort_key = ['created_at'] if not sort_key else sort_key
+def _do_pagination_by_created(context, matches, marker, limit, sort_dir,
+                              show_deleted, status='accepted'):
+    """
+    Returns a page of the subjects matching the filters, sorted by
+    created_at and id, walking the sorted index from the marker on and
+    stopping once the page is full.
+    """
+    index = DATA['subjects_by_created']
+    if utils.is_keyset_marker(marker):
+        sort_keys, values = utils.decode_keyset_marker(marker)
+        marker = dict(zip(sort_keys, values)).get('id')
+    if marker is None:
+        start = 0 if sort_dir == 'asc' else len(index)
+    else:
+        # Check that the subject is accessible
+        subject = _subject_get(context, marker,
+                               force_show_deleted=show_deleted,
+                               status=status)
+        if not matches(subject):
+            raise exception.SubjectNotFound()
+        if sort_dir == 'asc':
+            start = bisect.bisect_right(index, _created_index_key(subject))
+        else:
+            start = bisect.bisect_left(index, _created_index_key(subject))
+
+    if sort_dir == 'asc':
+        keys = (index[i] for i in six.moves.range(start, len(index)))
+    else:
+        keys = (index[i] for i in six.moves.range(start - 1, -1, -1))
+    subjects = (DATA['subjects'][key[1]] for key in keys)
+    return list(itertools.islice(six.moves.filter(matches, subjects), limit))
+
+
+def _get_sort_params(sort_key, sort_dir):
+    sort_key = ['created_at'] if not sort_key else list(sort_key)
 
     default_sort_dir = 'desc'
 
@@ -375,17 +479,15 @@ def _sort_subjects(subjects, sort_key, sort_dir):
         sort_dir = [default_sort_dir] * len(sort_key)
     elif len(sort_dir) == 1:
         default_sort_dir = sort_dir[0]
-        sort_dir *= len(sort_key)
+        sort_dir = sort_dir * len(sort_key)
+    else:
+        sort_dir = list(sort_dir)
 
     for key in ['created_at', 'id']:
         if key not in sort_key:
             sort_key.append(key)
             sort_dir.append(default_sort_dir)
 
-    for key in sort_key:
-        if subjects and not (key in subjects[0]):
-            raise exception.InvalidSortKey()
-
     if any(dir for dir in sort_dir if dir not in ['asc', 'desc']):
         raise exception.InvalidSortDir()
 
@@ -393,6 +495,16 @@ def _sort_subjects(subjects, sort_key, sort_dir):
         raise exception.Invalid(message='Number of sort dirs does not match '
                                         'the number of sort keys')
 
+    return sort_key, sort_dir
+
+
+def _sort_subjects(subjects, sort_key, sort_dir):
+    sort_key, sort_dir = _get_sort_params(sort_key, sort_dir)
+
+    for key in sort_key:
+        if subjects and not (key in subjects[0]):
+            raise exception.InvalidSortKey()
+
     for key, dir in reversed(list(zip(sort_key, sort_dir))):
         reverse = dir == 'desc'
         subjects.sort(key=lambda x: x[key] or '', reverse=reverse)
@@ -422,30 +534,44 @@ def _subject_get(context, subject_id, force_show_deleted=False, status=None):
 @log_call
 def subject_get(context, subject_id, session=None, force_show_deleted=False):
     subject = _subject_get(context, subject_id, force_show_deleted)
-    return _normalize_locations(context, copy.deepcopy(subject),
+    return _normalize_locations(context, _subject_copy(subject),
                                 force_show_deleted=force_show_deleted)
 
 
+@log_call
+def subject_get_with_tags(context, subject_id, force_show_deleted=False):
+    subject = subject_get(context, subject_id,
+                          force_show_deleted=force_show_deleted)
+    return subject, subject_tag_get_all(context, subject_id)
+
+
 @log_call
 def subject_get_all(context, filters=None, marker=None, limit=None,
                   sort_key=None, sort_dir=None,
                   member_status='accepted', is_public=None,
                   admin_as_user=False, return_tag=False):
     filters = filters or {}
-    subjects = DATA['subjects'].values()
-    subjects = _filter_subjects(subjects, filters, context, member_status,
-                            is_public, admin_as_user)
-    subjects = _sort_subjects(subjects, sort_key, sort_dir)
-    subjects = _do_pagination(context, subjects, marker, limit,
-                            filters.get('deleted'))
+    matches = _subject_filter(filters, context, member_status, is_public,
+                              admin_as_user)
+    sort_key, sort_dir = _get_sort_params(sort_key, sort_dir)
+    if sort_key == ['created_at', 'id'] and sort_dir[0] == sort_dir[1]:
+        subjects = _do_pagination_by_created(context, matches, marker, limit,
+                                             sort_dir[0],
+                                             filters.get('deleted'))
+    else:
+        subjects = [subject for subject in DATA['subjects'].values()
+                    if matches(subject)]
+        subjects = _sort_subjects(subjects, sort_key, sort_dir)
+        subjects = _do_pagination(context, subjects, marker, limit,
+                                  filters.get('deleted'))
 
     force_show_deleted = True if filters.get('deleted') else False
     res = []
     for subject in subjects:
-        img = _normalize_locations(context, copy.deepcopy(subject),
+        img = _normalize_locations(context, _subject_copy(subject),
                                    force_show_deleted=force_show_deleted)
         if return_tag:
-            img['tags'] = subject_tag_get_all(context, img['id'])
+            img['tags'] = list(DATA['tags'].get(img['id'], []))
         res.append(img)
     return res
 
@@ -478,7 +604,6 @@ def subject_member_find(context, subject_id=None, member=None,
                       status=None, include_deleted=False):
     filters = []
     subjects = DATA['subjects']
-    members = DATA['members']
 
     def is_visible(member):
         return (member['member'] == context.owner or
@@ -488,15 +613,23 @@ def subject_member_find(context, subject_id=None, member=None,
         filters.append(is_visible)
 
     if subject_id is not None:
-        filters.append(lambda m: m['subject_id'] == subject_id)
-    if member is not None:
-        filters.append(lambda m: m['member'] == member)
+        by_tenant = DATA['members_by_subject'].get(subject_id, {})
+        if member is not None:
+            members = by_tenant.get(member, [])
+        else:
+            members = itertools.chain.from_iterable(by_tenant.values())
+    elif member is not None:
+        by_subject = DATA['members_by_tenant'].get(member, {})
+        members = itertools.chain.from_iterable(by_subject.values())
+    else:
+        members = DATA['members'].values()
+
     if status is not None:
         filters.append(lambda m: m['status'] == status)
 
     for f in filters:
         members = filter(f, members)
-    return [copy.deepcopy(m) for m in members]
+    return [dict(m) for m in members]
 
 
 @log_call
@@ -509,8 +642,8 @@ def subject_member_count(context, subject_id):
         msg = _("Subject id is required.")
         raise exception.Invalid(msg)
 
-    members = DATA['members']
-    return len([x for x in members if x['subject_id'] == subject_id])
+    by_tenant = DATA['members_by_subject'].get(subject_id, {})
+    return sum(len(members) for members in by_tenant.values())
 
 
 @log_call
@@ -521,31 +654,33 @@ def subject_member_create(context, values):
                                   values.get('status', 'pending'),
                                   values.get('deleted', False))
     global DATA
-    DATA['members'].append(member)
-    return copy.deepcopy(member)
+    DATA['members'][member['id']] = member
+    _member_index_add(member)
+    return dict(member)
 
 
 @log_call
 def subject_member_update(context, member_id, values):
     global DATA
-    for member in DATA['members']:
-        if member['id'] == member_id:
-            member.update(values)
-            member['updated_at'] = timeutils.utcnow()
-            return copy.deepcopy(member)
-    else:
+    try:
+        member = DATA['members'][member_id]
+    except KeyError:
         raise exception.NotFound()
+    _member_index_remove(member)
+    member.update(values)
+    member['updated_at'] = timeutils.utcnow()
+    _member_index_add(member)
+    return dict(member)
 
 
 @log_call
 def subject_member_delete(context, member_id):
     global DATA
-    for i, member in enumerate(DATA['members']):
-        if member['id'] == member_id:
-            del DATA['members'][i]
-            break
-    else:
+    try:
+        member = DATA['members'].pop(member_id)
+    except KeyError:
         raise exception.NotFound()
+    _member_index_remove(member)
 
 
 @log_call
@@ -577,8 +712,8 @@ def subject_location_update(context, subject_id, location):
     updated = False
     for loc in DATA['locations']:
         if loc['id'] == loc_id and loc['subject_id'] == subject_id:
-            loc.update({"value": location['url'],
-                        "meta_data": location['metadata'],
+            loc.update({"url": location['url'],
+                        "metadata": location['metadata'],
                         "status": location['status'],
                         "deleted": deleted,
                         "updated_at": updated_time,
@@ -619,6 +754,50 @@ def subject_location_delete(context, subject_id, location_id, status,
         raise exception.NotFound(msg)
 
 
+@log_call
+def subject_location_get_pending_delete(context, min_age=0, marker=None,
+                                        limit=None):
+    deleted_before = timeutils.utcnow() - datetime.timedelta(seconds=min_age)
+    locations = sorted((loc for loc in DATA['locations']
+                        if loc['status'] == 'pending_delete' and
+                        loc['deleted_at'] and
+                        loc['deleted_at'] <= deleted_before),
+                       key=lambda loc: loc['id'])
+    if marker is not None:
+        locations = [loc for loc in locations if loc['id'] > marker]
+    if limit is not None:
+        locations = locations[:limit]
+    return [{'id': loc['id'], 'subject_id': loc['subject_id'],
+             'url': loc['url']} for loc in locations]
+
+
+@log_call
+def subject_locations_scrubbed(context, location_ids):
+    location_ids = set(location_ids)
+    delete_time = timeutils.utcnow()
+    subject_ids = set()
+    for loc in DATA['locations']:
+        if loc['id'] in location_ids and loc['status'] == 'pending_delete':
+            loc.update({"deleted": True,
+                        "status": 'deleted',
+                        "updated_at": delete_time,
+                        "deleted_at": delete_time})
+            subject_ids.add(loc['subject_id'])
+
+    scrubbed = []
+    for subject_id in sorted(subject_ids):
+        subject = DATA['subjects'].get(subject_id)
+        if subject is None or subject['status'] != 'pending_delete':
+            continue
+        if any(loc['status'] == 'pending_delete'
+               for loc in subject['locations']):
+            continue
+        subject['status'] = 'deleted'
+        subject['updated_at'] = delete_time
+        scrubbed.append(subject_id)
+    return scrubbed
+
+
 def _subject_locations_set(context, subject_id, locations):
     # NOTE(zhiyan): 1. Remove records from DB for deleted locations
     used_loc_ids = [loc['id'] for loc in locations if loc.get('id')]
@@ -688,10 +867,11 @@ def subject_create(context, subject_values):
         raise exception.Invalid('status is a required attribute')
 
     allowed_keys = set(['id', 'name', 'status', 'min_ram', 'min_disk', 'size',
-                        'virtual_size', 'checksum', 'locations', 'owner',
-                        'protected', 'is_public', 'subject_format',
-                        'disk_format', 'created_at', 'updated_at', 'deleted',
-                        'deleted_at', 'properties', 'tags'])
+                        'virtual_size', 'checksum', 'os_hash_algo',
+                        'os_hash_value', 'locations', 'owner', 'protected',
+                        'is_public', 'subject_format', 'disk_format',
+                        'created_at', 'updated_at', 'deleted', 'deleted_at',
+                        'properties', 'tags'])
 
     incorrect_keys = set(subject_values.keys()) - allowed_keys
     if incorrect_keys:
@@ -701,8 +881,9 @@ def subject_create(context, subject_values):
     subject = _subject_format(subject_id, **subject_values)
     DATA['subjects'][subject_id] = subject
     DATA['tags'][subject_id] = subject.pop('tags', [])
+    bisect.insort(DATA['subjects_by_created'], _created_index_key(subject))
 
-    return _normalize_locations(context, copy.deepcopy(subject))
+    return _normalize_locations(context, _subject_copy(subject))
 
 
 @log_call
@@ -718,19 +899,29 @@ def subject_update(context, subject_id, subject_values, purge_props=False,
     if location_data is not None:
         _subject_locations_set(context, subject_id, location_data)
 
+    tags = subject_values.pop('tags', None)
+    if tags is not None:
+        DATA['tags'][subject_id] = list(tags)
+
     # replace values for properties that already exist
     new_properties = subject_values.pop('properties', {})
     for prop in subject['properties']:
         if prop['name'] in new_properties:
             prop['value'] = new_properties.pop(prop['name'])
+            prop['deleted'] = False
         elif purge_props:
             # this matches weirdness in the sqlalchemy api
             prop['deleted'] = True
 
     subject['updated_at'] = timeutils.utcnow()
+    old_key = _created_index_key(subject)
     _subject_update(subject, subject_values, new_properties)
     DATA['subjects'][subject_id] = subject
-    return _normalize_locations(context, copy.deepcopy(subject))
+    if _created_index_key(subject) != old_key:
+        index = DATA['subjects_by_created']
+        del index[bisect.bisect_left(index, old_key)]
+        bisect.insort(index, _created_index_key(subject))
+    return _normalize_locations(context, _subject_copy(subject))
 
 
 @log_call
@@ -761,15 +952,15 @@ def subject_destroy(context, subject_id):
         for tag in tags:
             subject_tag_delete(context, subject_id, tag)
 
-        return _normalize_locations(context,
-                                    copy.deepcopy(DATA['subjects'][subject_id]))
+        subject = DATA['subjects'][subject_id]
+        return _normalize_locations(context, _subject_copy(subject))
     except KeyError:
         raise exception.SubjectNotFound()
 
 
 @log_call
 def subject_tag_get_all(context, subject_id):
-    return DATA['tags'].get(subject_id, [])
+    return list(DATA['tags'].get(subject_id, []))
 
 
 @log_call
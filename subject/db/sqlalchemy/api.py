@@ -21,8 +21,11 @@
 
 """Defines interface for DB access."""
 
+import collections
+import contextlib
 import datetime
 import threading
+import time
 
 from oslo_config import cfg
 from oslo_db import exception as db_exception
@@ -35,7 +38,7 @@ import six
 from six.moves import range
 import sqlalchemy
 from sqlalchemy.ext.compiler import compiles
-from sqlalchemy import MetaData, Table
+from sqlalchemy import MetaData
 import sqlalchemy.orm as sa_orm
 from sqlalchemy import sql
 import sqlalchemy.sql as sa_sql
@@ -55,10 +58,16 @@ STATUSES = ['active', 'saving', 'queued', 'killed', 'pending_delete',
 
 CONF = cfg.CONF
 CONF.import_group("profiler", "subject.common.wsgi")
+CONF.import_opt('track_user_storage_usage', 'subject.common.config')
 
 _FACADE = None
 _LOCK = threading.Lock()
 
+# The first batch of a purge aiming at a batch duration deletes this many
+# rows at most.
+PURGE_FIRST_BATCH_ROWS = 100
+_PURGE_TABLES = None
+
 
 def _retry_on_deadlock(exc):
     """Decorator to retry a DB API call if Deadlock was received."""
@@ -158,10 +167,12 @@ def subject_destroy(context, subject_id):
         # Perform authorization check
         _check_mutate_authorization(context, subject_ref)
 
-        subject_ref.delete(session=session)
-        delete_time = subject_ref.deleted_at
+        with _subject_storage_usage_tracked(subject_id, session):
+            subject_ref.delete(session=session)
+            delete_time = subject_ref.deleted_at
 
-        _subject_locations_delete_all(context, subject_id, delete_time, session)
+            _subject_locations_delete_all(context, subject_id, delete_time,
+                                          session)
 
         _subject_property_delete_all(context, subject_id, delete_time, session)
 
@@ -211,6 +222,17 @@ def subject_get(context, subject_id, session=None, force_show_deleted=False):
     return subject
 
 
+def subject_get_with_tags(context, subject_id, force_show_deleted=False):
+    """
+    Get an subject and the list of its tags in a single call, sharing one
+    session between both queries.
+    """
+    session = get_session()
+    subject = subject_get(context, subject_id, session=session,
+                          force_show_deleted=force_show_deleted)
+    return subject, subject_tag_get_all(context, subject_id, session=session)
+
+
 def _check_subject_id(subject_id):
     """
     check if the given subject id is valid before executing operations. For
@@ -322,7 +344,7 @@ def _get_default_column_value(column_type):
 
 
 def _paginate_query(query, model, limit, sort_keys, marker=None,
-                    sort_dir=None, sort_dirs=None):
+                    sort_dir=None, sort_dirs=None, marker_values=None):
     """Returns a query with sorting / pagination criteria added.
 
     Pagination works by requiring a unique sort_key, specified by sort_keys.
@@ -348,6 +370,8 @@ def _paginate_query(query, model, limit, sort_keys, marker=None,
                     results after this value.
     :param sort_dir: direction in which results should be sorted (asc, desc)
     :param sort_dirs: per-column array of sort_dirs, corresponding to sort_keys
+    :param marker_values: the values of sort_keys for the last item of the
+                          previous page, which can be passed instead of marker
 
     :rtype: sqlalchemy.orm.query.Query
     :returns: The query with sorting/pagination added.
@@ -387,36 +411,28 @@ def _paginate_query(query, model, limit, sort_keys, marker=None,
             raise exception.InvalidSortKey()
         query = query.order_by(sort_dir_func(sort_key_attr))
 
-    default = ''  # Default to an empty string if NULL
+    if marker is not None:
+        marker_values = [getattr(marker, sort_key) for sort_key in sort_keys]
 
     # Add pagination
-    if marker is not None:
-        marker_values = []
-        for sort_key in sort_keys:
-            v = getattr(marker, sort_key)
-            if v is None:
-                v = default
-            marker_values.append(v)
+    if marker_values is not None:
+        # NULLs are compared as the default value of their column, on both
+        # sides of the comparison.
+        marker_values = [
+            _get_default_column_value(
+                getattr(model, sort_key).property.columns[0].type)
+            if v is None else v
+            for sort_key, v in zip(sort_keys, marker_values)]
 
         # Build up an array of sort criteria as in the docstring
         criteria_list = []
         for i in range(len(sort_keys)):
             crit_attrs = []
             for j in range(i):
-                model_attr = getattr(model, sort_keys[j])
-                default = _get_default_column_value(
-                    model_attr.property.columns[0].type)
-                attr = sa_sql.expression.case([(model_attr != None,
-                                                model_attr), ],
-                                              else_=default)
+                attr = _paginate_attr(getattr(model, sort_keys[j]))
                 crit_attrs.append((attr == marker_values[j]))
 
-            model_attr = getattr(model, sort_keys[i])
-            default = _get_default_column_value(
-                model_attr.property.columns[0].type)
-            attr = sa_sql.expression.case([(model_attr != None,
-                                            model_attr), ],
-                                          else_=default)
+            attr = _paginate_attr(getattr(model, sort_keys[i]))
             if sort_dirs[i] == 'desc':
                 crit_attrs.append((attr < marker_values[i]))
             elif sort_dirs[i] == 'asc':
@@ -437,6 +453,21 @@ def _paginate_query(query, model, limit, sort_keys, marker=None,
     return query
 
 
+def _paginate_attr(model_attr):
+    """
+    Returns the expression to compare a sort key against the marker value
+    with. NULLs are compared as the default value of the column, which needs
+    a CASE expression that keeps the database from using an index on the
+    column, so columns that cannot be NULL are compared directly.
+    """
+    column = model_attr.property.columns[0]
+    if not column.nullable:
+        return model_attr
+    default = _get_default_column_value(column.type)
+    return sa_sql.expression.case([(model_attr != None, model_attr), ],
+                                  else_=default)
+
+
 def _make_conditions_from_filters(filters, is_public=None):
     # NOTE(venkatesh) make copy of the filters are to be altered in this
     # method.
@@ -660,31 +691,50 @@ def subject_get_all(context, filters=None, marker=None, limit=None,
             query = query.join(models.SubjectTag, aliased=True).filter(
                 sa_sql.and_(*tag_condition))
 
-    marker_subject = None
-    if marker is not None:
-        marker_subject = _subject_get(context,
-                                      marker,
-                                      force_show_deleted=showing_deleted)
-
     for key in ['created_at', 'id']:
         if key not in sort_key:
             sort_key.append(key)
             sort_dir.append(default_sort_dir)
 
+    marker_subject = None
+    marker_values = None
+    if utils.is_keyset_marker(marker):
+        marker_keys, marker_values = utils.decode_keyset_marker(marker)
+        if marker_keys != sort_key:
+            msg = _('The marker does not match the sort keys')
+            raise exception.InvalidParameterValue(value=marker,
+                                                  param='marker',
+                                                  extra_msg=msg)
+    elif marker is not None:
+        marker_subject = _subject_get(context,
+                                      marker,
+                                      force_show_deleted=showing_deleted)
+
     query = _paginate_query(query, models.Subject, limit,
                             sort_key,
                             marker=marker_subject,
                             sort_dir=None,
-                            sort_dirs=sort_dir)
-
+                            sort_dirs=sort_dir,
+                            marker_values=marker_values)
+
+    # NOTE: Only the IDs of the page are selected at first. Eager loading
+    # the children in the same query would join them in before the LIMIT
+    # and sort every row of every matching subject.
+    subject_ids = [row.id for row in query.with_entities(models.Subject.id)]
+    if not subject_ids:
+        return []
+
+    query = query.session.query(models.Subject).filter(
+        models.Subject.id.in_(subject_ids))
     query = query.options(sa_orm.joinedload(
         models.Subject.properties)).options(
         sa_orm.joinedload(models.Subject.locations))
     if return_tag:
         query = query.options(sa_orm.joinedload(models.Subject.tags))
+    subject_refs = {subject.id: subject for subject in query.all()}
 
     subjects = []
-    for subject in query.all():
+    for subject in (subject_refs[subject_id] for subject_id in subject_ids):
         subject_dict = subject.to_dict()
         subject_dict = _normalize_locations(context, subject_dict,
                                             force_show_deleted=showing_deleted)
@@ -704,20 +754,120 @@ def _drop_protected_attrs(model_class, values):
             del values[attr]
 
 
+def _subject_disk_usage_query(session):
+    """
+    Returns a query summing the size of subjects once for each of their
+    locations that has not been deleted.
+    """
+    query = session.query(sa_sql.func.sum(models.Subject.size))
+    query = query.select_from(models.Subject).join(
+        models.SubjectLocation,
+        models.SubjectLocation.subject_id == models.Subject.id)
+    query = query.filter(models.Subject.size > 0)
+    query = query.filter(~models.Subject.status.in_(['killed', 'deleted']))
+    query = query.filter(models.SubjectLocation.status != 'deleted')
+    return query
+
+
 def _subject_get_disk_usage_by_owner(owner, session, subject_id=None):
-    query = session.query(models.Subject)
+    query = _subject_disk_usage_query(session)
     query = query.filter(models.Subject.owner == owner)
     if subject_id is not None:
         query = query.filter(models.Subject.id != subject_id)
-    query = query.filter(models.Subject.size > 0)
-    query = query.filter(~models.Subject.status.in_(['killed', 'deleted']))
-    subjects = query.all()
+    return query.scalar() or 0
 
-    total = 0
-    for i in subjects:
-        locations = [l for l in i.locations if l['status'] != 'deleted']
-        total += (i.size * len(locations))
-    return total
+
+def _subject_get_disk_usage(subject_id, session):
+    """
+    Returns a tuple of the owner of an subject and the storage its
+    locations consume, as counted towards the owner's storage usage.
+    """
+    row = session.query(models.Subject.owner).filter_by(id=subject_id).first()
+    if row is None:
+        return None, 0
+    query = _subject_disk_usage_query(session)
+    query = query.filter(models.Subject.id == subject_id)
+    return row.owner, query.scalar() or 0
+
+
+def _owner_storage_usage_get(owner, session):
+    usage_ref = session.query(models.SubjectStorageUsage).filter_by(
+        owner=owner).first()
+    if usage_ref is not None:
+        return usage_ref.size
+
+    # NOTE: The running total of an owner is created the first time it is
+    # needed, and kept up to date by _owner_storage_usage_adjust from then on.
+    size = _subject_get_disk_usage_by_owner(owner, session)
+    usage_ref = models.SubjectStorageUsage(owner=owner, size=size)
+    try:
+        usage_ref.save(session=session)
+    except db_exception.DBDuplicateEntry:
+        # Created by someone else in the meantime
+        pass
+    return size
+
+
+def _owner_storage_usage_adjust(usage_before, usage_after, session):
+    """
+    Applies the change in the storage consumed by an subject to the running
+    totals of its owners, in the transaction the change was made in.
+
+    :param usage_before: (owner, size) tuple for the subject before the change,
+                         as returned by _subject_get_disk_usage
+    :param usage_after: (owner, size) tuple for the subject after the change
+    """
+    (owner_before, size_before), (owner_after, size_after) = (usage_before,
+                                                              usage_after)
+    if owner_before == owner_after:
+        deltas = [(owner_after, size_after - size_before)]
+    else:
+        deltas = [(owner_before, -size_before), (owner_after, size_after)]
+
+    for owner, delta in deltas:
+        if owner is None or not delta:
+            continue
+        # NOTE: Owners whose total has not been created yet are skipped;
+        # their total is computed from their subjects when it is created.
+        query = session.query(models.SubjectStorageUsage).filter_by(
+            owner=owner)
+        query.update({'size': models.SubjectStorageUsage.size + delta},
+                     synchronize_session=False)
+
+
+@contextlib.contextmanager
+def _subject_storage_usage_tracked(subject_id, session):
+    """
+    Applies the change the block makes to the storage consumed by an
+    existing subject to the running total of its owner, if those are kept.
+    """
+    if not CONF.track_user_storage_usage:
+        yield
+        return
+
+    usage_before = _subject_get_disk_usage(subject_id, session)
+    yield
+    _owner_storage_usage_adjust(usage_before,
+                                _subject_get_disk_usage(subject_id, session),
+                                session)
+
+
+@contextlib.contextmanager
+def _subject_location_session(subject_id, session=None):
+    """
+    Yields the session to change the locations of an subject with. When no
+    session is supplied, the change is made in a transaction of its own
+    that also keeps the storage usage of the subject owner up to date;
+    otherwise the caller takes care of both.
+    """
+    if session is not None:
+        yield session
+        return
+
+    session = get_session()
+    with session.begin():
+        with _subject_storage_usage_tracked(subject_id, session):
+            yield session
 
 
 def _validate_subject(values, mandatory_status=True):
@@ -761,7 +911,9 @@ def _subject_update(context, values, subject_id, purge_props=False,
     Used internally by subject_create and subject_update
 
     :param context: Request context
-    :param values: A dict of attributes to set
+    :param values: A dict of attributes to set. The properties, locations
+                   and tags of the subject are set in the same transaction
+                   if it contains them.
     :param subject_id: If None, create the subject, otherwise, find and update it
     """
 
@@ -781,10 +933,15 @@ def _subject_update(context, values, subject_id, purge_props=False,
 
         location_data = values.pop('locations', None)
 
+        tags = values.pop('tags', None)
+
         new_status = values.get('status', None)
+        usage_before = None, 0
         if subject_id:
             subject_ref = _subject_get(context, subject_id, session=session)
             current = subject_ref.status
+            if CONF.track_user_storage_usage:
+                usage_before = _subject_get_disk_usage(subject_id, session)
             # Perform authorization check
             _check_mutate_authorization(context, subject_ref)
         else:
@@ -859,21 +1016,35 @@ def _subject_update(context, values, subject_id, purge_props=False,
             _subject_locations_set(context, subject_ref.id, location_data,
                                    session=session)
 
+        if tags is not None:
+            _subject_tags_set(context, subject_ref.id, tags, session)
+
+        if CONF.track_user_storage_usage:
+            _owner_storage_usage_adjust(
+                usage_before, _subject_get_disk_usage(subject_ref.id, session),
+                session)
+
     return subject_get(context, subject_ref.id)
 
 
 @utils.no_4byte_params
-def subject_location_add(context, subject_id, location, session=None):
+def _subject_location_values(location):
+    """Returns the column values of a location to write."""
     deleted = location['status'] in ('deleted', 'pending_delete')
     delete_time = timeutils.utcnow() if deleted else None
+    return {"value": location['url'],
+            "meta_data": location['metadata'],
+            "status": location['status'],
+            "deleted": deleted,
+            "deleted_at": delete_time}
+
+
+@utils.no_4byte_params
+def subject_location_add(context, subject_id, location, session=None):
     location_ref = models.SubjectLocation(subject_id=subject_id,
-                                          value=location['url'],
-                                          meta_data=location['metadata'],
-                                          status=location['status'],
-                                          deleted=deleted,
-                                          deleted_at=delete_time)
-    session = session or get_session()
-    location_ref.save(session=session)
+                                          **_subject_location_values(location))
+    with _subject_location_session(subject_id, session) as session:
+        location_ref.save(session=session)
 
 
 @utils.no_4byte_params
@@ -884,26 +1055,23 @@ def subject_location_update(context, subject_id, location, session=None):
         raise exception.Invalid(msg)
 
     try:
-        session = session or get_session()
-        location_ref = session.query(models.SubjectLocation).filter_by(
-            id=loc_id).filter_by(subject_id=subject_id).one()
-
-        deleted = location['status'] in ('deleted', 'pending_delete')
-        updated_time = timeutils.utcnow()
-        delete_time = updated_time if deleted else None
-
-        location_ref.update({"value": location['url'],
-                             "meta_data": location['metadata'],
-                             "status": location['status'],
-                             "deleted": deleted,
-                             "updated_at": updated_time,
-                             "deleted_at": delete_time})
-        location_ref.save(session=session)
+        with _subject_location_session(subject_id, session) as session:
+            location_ref = session.query(models.SubjectLocation).filter_by(
+                id=loc_id).filter_by(subject_id=subject_id).one()
+
+            values = _subject_location_values(location)
+            values['updated_at'] = timeutils.utcnow()
+            location_ref.update(values)
+            location_ref.save(session=session)
     except sa_orm.exc.NoResultFound:
-        msg = (_("No location found with ID %(loc)s from subject %(img)s") %
-               dict(loc=loc_id, img=subject_id))
-        LOG.warn(msg)
-        raise exception.NotFound(msg)
+        _raise_location_not_found(subject_id, loc_id)
+
+
+def _raise_location_not_found(subject_id, location_id):
+    msg = (_("No location found with ID %(loc)s from subject %(img)s") %
+           dict(loc=location_id, img=subject_id))
+    LOG.warn(msg)
+    raise exception.NotFound(msg)
 
 
 def subject_location_delete(context, subject_id, location_id, status,
@@ -914,44 +1082,155 @@ def subject_location_delete(context, subject_id, location_id, status,
         raise exception.Invalid(msg)
 
     try:
-        session = session or get_session()
-        location_ref = session.query(models.SubjectLocation).filter_by(
-            id=location_id).filter_by(subject_id=subject_id).one()
+        with _subject_location_session(subject_id, session) as session:
+            location_ref = session.query(models.SubjectLocation).filter_by(
+                id=location_id).filter_by(subject_id=subject_id).one()
 
-        delete_time = delete_time or timeutils.utcnow()
+            delete_time = delete_time or timeutils.utcnow()
 
-        location_ref.update({"deleted": True,
-                             "status": status,
-                             "updated_at": delete_time,
-                             "deleted_at": delete_time})
-        location_ref.save(session=session)
+            location_ref.update({"deleted": True,
+                                 "status": status,
+                                 "updated_at": delete_time,
+                                 "deleted_at": delete_time})
+            location_ref.save(session=session)
     except sa_orm.exc.NoResultFound:
-        msg = (_("No location found with ID %(loc)s from subject %(img)s") %
-               dict(loc=location_id, img=subject_id))
-        LOG.warn(msg)
-        raise exception.NotFound(msg)
+        _raise_location_not_found(subject_id, location_id)
+
+
+def subject_location_get_pending_delete(context, min_age=0, marker=None,
+                                        limit=None, session=None):
+    """
+    Returns the locations waiting for the scrubber that were deleted at
+    least min_age seconds ago, in order of their id, as dicts of their id,
+    subject id and url. The query is answered by the index on the status
+    and deletion time of the locations.
+
+    :param min_age: Number of seconds a location must have been deleted for
+    :param marker: Only locations with a higher id than this are returned
+    :param limit: Maximum number of locations to return
+    """
+    session = session or get_session()
+    deleted_before = timeutils.utcnow() - datetime.timedelta(seconds=min_age)
+    query = session.query(models.SubjectLocation.id,
+                          models.SubjectLocation.subject_id,
+                          models.SubjectLocation.value)
+    query = query.filter(models.SubjectLocation.status == 'pending_delete')
+    query = query.filter(models.SubjectLocation.deleted_at <= deleted_before)
+    if marker is not None:
+        query = query.filter(models.SubjectLocation.id > marker)
+    query = query.order_by(models.SubjectLocation.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return [{'id': loc_id, 'subject_id': subject_id, 'url': url}
+            for loc_id, subject_id, url in query]
+
+
+def subject_locations_scrubbed(context, location_ids, session=None):
+    """
+    Marks the supplied pending_delete locations deleted once the scrubber
+    has removed their data, and moves the subjects that have no location
+    left to scrub from pending_delete to deleted, in a single transaction.
+
+    :param location_ids: Ids of the scrubbed locations
+    :returns: The ids of the subjects moved to deleted
+    """
+    if not location_ids:
+        return []
+
+    session = session or get_session()
+    with session.begin():
+        query = session.query(models.SubjectLocation).filter(
+            models.SubjectLocation.id.in_(location_ids)).filter_by(
+            status='pending_delete')
+        subject_ids = set(row.subject_id for row in query.with_entities(
+            models.SubjectLocation.subject_id))
+        if not subject_ids:
+            return []
+
+        usages = {}
+        if CONF.track_user_storage_usage:
+            usages = {subject_id: _subject_get_disk_usage(subject_id, session)
+                      for subject_id in subject_ids}
+
+        delete_time = timeutils.utcnow()
+        query.update({"deleted": True,
+                      "status": 'deleted',
+                      "updated_at": delete_time,
+                      "deleted_at": delete_time},
+                     synchronize_session=False)
+
+        pending = set(row.subject_id for row in session.query(
+            models.SubjectLocation.subject_id).filter(
+            models.SubjectLocation.subject_id.in_(subject_ids)).filter_by(
+            status='pending_delete'))
+        scrubbed = []
+        if subject_ids - pending:
+            query = session.query(models.Subject.id).filter(
+                models.Subject.id.in_(subject_ids - pending)).filter_by(
+                status='pending_delete')
+            scrubbed = [row.id for row in query]
+        if scrubbed:
+            query = session.query(models.Subject).filter(
+                models.Subject.id.in_(scrubbed))
+            query.update({"status": 'deleted',
+                          "updated_at": delete_time},
+                         synchronize_session=False)
+
+        for subject_id, usage_before in six.iteritems(usages):
+            _owner_storage_usage_adjust(
+                usage_before, _subject_get_disk_usage(subject_id, session),
+                session)
+    return scrubbed
 
 
 def _subject_locations_set(context, subject_id, locations, session=None):
-    # NOTE(zhiyan): 1. Remove records from DB for deleted locations
+    """
+    Replace the locations of an subject with the given ones. The current
+    locations are read at once and only those added, changed or removed
+    are written, with a single statement for the additions and another
+    one for the removals.
+    """
     session = session or get_session()
     query = session.query(models.SubjectLocation).filter_by(
-        subject_id=subject_id).filter_by(deleted=False)
-
-    loc_ids = [loc['id'] for loc in locations if loc.get('id')]
-    if loc_ids:
-        query = query.filter(~models.SubjectLocation.id.in_(loc_ids))
+        subject_id=subject_id)
+    location_refs = {loc_ref.id: loc_ref for loc_ref in query}
+    loc_ids = set(loc['id'] for loc in locations if loc.get('id'))
 
-    for loc_id in [loc_ref.id for loc_ref in query.all()]:
-        subject_location_delete(context, subject_id, loc_id, 'deleted',
-                                session=session)
+    # NOTE(zhiyan): 1. Remove records from DB for deleted locations
+    removed = [loc_id for loc_id, loc_ref in six.iteritems(location_refs)
+               if not loc_ref.deleted and loc_id not in loc_ids]
+    if removed:
+        delete_time = timeutils.utcnow()
+        query = session.query(models.SubjectLocation).filter(
+            models.SubjectLocation.id.in_(removed))
+        query.update({"deleted": True,
+                      "status": 'deleted',
+                      "updated_at": delete_time,
+                      "deleted_at": delete_time},
+                     synchronize_session=False)
 
     # NOTE(zhiyan): 2. Adding or update locations
+    created = []
     for loc in locations:
+        values = _subject_location_values(loc)
         if loc.get('id') is None:
-            subject_location_add(context, subject_id, loc, session=session)
-        else:
-            subject_location_update(context, subject_id, loc, session=session)
+            values['subject_id'] = subject_id
+            created.append(values)
+            continue
+
+        loc_ref = location_refs.get(loc['id'])
+        if loc_ref is None:
+            _raise_location_not_found(subject_id, loc['id'])
+        # NOTE: deleted_at is freshly computed for deleted locations, so
+        # it is left out of the comparison to not rewrite them every time.
+        if any(loc_ref[key] != values[key] for key in values
+               if key != 'deleted_at'):
+            query = session.query(models.SubjectLocation).filter_by(
+                id=loc_ref.id)
+            query.update(values, synchronize_session=False)
+
+    if created:
+        session.execute(models.SubjectLocation.__table__.insert(), created)
 
 
 def _subject_locations_delete_all(context, subject_id,
@@ -972,32 +1251,51 @@ def _set_properties_for_subject(context, subject_ref, properties,
     """
     Create or update a set of subject_properties for a given subject
 
+    Only the properties that are added, changed or removed are written,
+    with a single statement for each of those three kinds of change.
+
     :param context: Request context
     :param subject_ref: An Subject object
     :param properties: A dict of properties to set
     :param session: A SQLAlchemy session to use (if present)
     """
+    session = session or get_session()
     orig_properties = {}
     for prop_ref in subject_ref.properties:
         orig_properties[prop_ref.name] = prop_ref
 
+    created = []
+    changed = {}
     for name, value in six.iteritems(properties):
-        prop_values = {'subject_id': subject_ref.id,
-                       'name': name,
-                       'value': value}
-        if name in orig_properties:
-            prop_ref = orig_properties[name]
-            _subject_property_update(context, prop_ref, prop_values,
-                                     session=session)
-        else:
-            subject_property_create(context, prop_values, session=session)
+        prop_ref = orig_properties.get(name)
+        if prop_ref is None:
+            created.append({'subject_id': subject_ref.id,
+                            'name': name,
+                            'value': value})
+        elif prop_ref.deleted or prop_ref.value != value:
+            changed[prop_ref.id] = value
+
+    if changed:
+        query = session.query(models.SubjectProperty).filter(
+            models.SubjectProperty.id.in_(list(changed)))
+        value = sa_sql.expression.case(changed,
+                                       value=models.SubjectProperty.id)
+        query.update({'value': value, 'deleted': False},
+                     synchronize_session=False)
+
+    if created:
+        session.execute(models.SubjectProperty.__table__.insert(), created)
 
     if purge_props:
-        for key in orig_properties.keys():
-            if key not in properties:
-                prop_ref = orig_properties[key]
-                subject_property_delete(context, prop_ref.name,
-                                        subject_ref.id, session=session)
+        removed = [prop_ref.id for name, prop_ref in
+                   six.iteritems(orig_properties)
+                   if name not in properties and not prop_ref.deleted]
+        if removed:
+            query = session.query(models.SubjectProperty).filter(
+                models.SubjectProperty.id.in_(removed))
+            query.update({'deleted': True,
+                          'deleted_at': timeutils.utcnow()},
+                         synchronize_session=False)
 
 
 def _subject_child_entry_delete_all(child_model_cls, subject_id,
@@ -1204,21 +1502,43 @@ def subject_member_count(context, subject_id):
 
 
 def subject_tag_set_all(context, subject_id, tags):
+    session = get_session()
+    with session.begin():
+        _subject_tags_set(context, subject_id, tags, session)
+
+
+def _subject_tags_set(context, subject_id, tags, session):
+    """
+    Replace the tags of an subject with the given ones, with a single
+    statement for the tags added and another one for the tags removed.
+    """
     # NOTE(kragniz): tag ordering should match exactly what was provided, so a
     # subsequent call to subject_tag_get_all returns them in the correct order
-
-    session = get_session()
     existing_tags = subject_tag_get_all(context, subject_id, session)
 
     tags_created = []
     for tag in tags:
         if tag not in tags_created and tag not in existing_tags:
             tags_created.append(tag)
-            subject_tag_create(context, subject_id, tag, session)
 
-    for tag in existing_tags:
-        if tag not in tags:
-            subject_tag_delete(context, subject_id, tag, session)
+    if tags_created:
+        session.execute(models.SubjectTag.__table__.insert(),
+                        [_subject_tag_values(subject_id, tag)
+                         for tag in tags_created])
+
+    tags_deleted = [tag for tag in existing_tags if tag not in tags]
+    if tags_deleted:
+        query = session.query(models.SubjectTag).filter_by(
+            subject_id=subject_id).filter_by(deleted=False).filter(
+            models.SubjectTag.value.in_(tags_deleted))
+        query.update({'deleted': True, 'deleted_at': timeutils.utcnow()},
+                     synchronize_session=False)
+
+
+@utils.no_4byte_params
+def _subject_tag_values(subject_id, value):
+    """Returns the column values of a tag to write."""
+    return {'subject_id': subject_id, 'value': value}
 
 
 @utils.no_4byte_params
@@ -1282,62 +1602,133 @@ def visit_delete_from_select(element, compiler, **kw):
         compiler.process(element.select))
 
 
-def purge_deleted_rows(context, age_in_days, max_rows, session=None):
-    """Purges soft deleted rows
-
-    Deletes rows of table subjects, table tasks and all dependent tables
-    according to given age for relevant models.
+def _get_purge_tables(engine):
     """
-    # check max_rows for its maximum limit
-    _validate_db_int(max_rows=max_rows)
-
-    session = session or get_session()
-    metadata = MetaData(get_engine())
-    deleted_age = timeutils.utcnow() - datetime.timedelta(days=age_in_days)
+    Returns the tables of the models with soft deleted rows, reflected from
+    the database once per engine and ordered so that every table comes
+    before the tables it refers to.
+    """
+    global _PURGE_TABLES
+    if _PURGE_TABLES is not None and _PURGE_TABLES[0] is engine:
+        return _PURGE_TABLES[1]
 
-    tables = []
+    names = set()
     for model_class in models.__dict__.values():
         if not hasattr(model_class, '__tablename__'):
             continue
         if hasattr(model_class, 'deleted'):
-            tables.append(model_class.__tablename__)
-    # get rid of FX constraints
+            names.add(model_class.__tablename__)
+
+    metadata = MetaData()
+    metadata.reflect(bind=engine, only=lambda name, meta: name in names)
     for tbl in ('subjects', 'tasks'):
-        try:
-            tables.remove(tbl)
-        except ValueError:
+        if tbl not in metadata.tables:
             LOG.warning(_LW('Expected table %(tbl)s was not found in DB.'),
                         {'tbl': tbl})
-        else:
-            tables.append(tbl)
 
-    for tbl in tables:
-        tab = Table(tbl, metadata, autoload=True)
-        LOG.info(
-            _LI('Purging deleted rows older than %(age_in_days)d day(s) '
-                'from table %(tbl)s'),
-            {'age_in_days': age_in_days, 'tbl': tbl})
+    tables = [tab for tab in reversed(metadata.sorted_tables)
+              if tab.name in names]
+    _PURGE_TABLES = (engine, tables)
+    return tables
 
-        column = tab.c.id
-        deleted_at_column = tab.c.deleted_at
 
+def _purge_table(session, tab, deleted_age, max_rows, batch_sleep,
+                 batch_duration):
+    """
+    Deletes the rows of a table soft deleted before deleted_age, oldest
+    first, in batches of at most max_rows rows committed one at a time.
+    Returns the number of rows deleted.
+    """
+    column = tab.c.id
+    deleted_at_column = tab.c.deleted_at
+    limit = min(max_rows, PURGE_FIRST_BATCH_ROWS) if batch_duration else (
+        max_rows)
+    total = 0
+    while True:
         query_delete = sql.select(
             [column], deleted_at_column < deleted_age).order_by(
-            deleted_at_column).limit(max_rows)
-
+            deleted_at_column).limit(limit)
         delete_statement = DeleteFromSelect(tab, query_delete, column)
 
+        started = time.time()
         with session.begin():
             result = session.execute(delete_statement)
+        elapsed = time.time() - started
 
         rows = result.rowcount
-        LOG.info(_LI('Deleted %(rows)d row(s) from table %(tbl)s'),
-                 {'rows': rows, 'tbl': tbl})
+        total += rows
+        LOG.info(_LI('Deleted %(rows)d row(s) from table %(tbl)s, '
+                     '%(total)d so far'),
+                 {'rows': rows, 'tbl': tab.name, 'total': total})
+        if rows < limit:
+            return total
+
+        if batch_duration:
+            # Size the next batch so that it takes about batch_duration
+            # seconds, going by how long this one took.
+            limit = int(limit * batch_duration / max(elapsed, 0.001))
+            limit = max(1, min(limit, max_rows))
+        if batch_sleep:
+            time.sleep(batch_sleep)
+
+
+def purge_deleted_rows(context, age_in_days, max_rows, session=None,
+                       batch_sleep=0, batch_duration=None, dry_run=False):
+    """Purges soft deleted rows
+
+    Deletes rows of table subjects, table tasks and all dependent tables
+    according to given age for relevant models. The rows are deleted in
+    batches of at most max_rows rows per table, each committed on its own,
+    until no row older than the given age is left, so an interrupted purge
+    is resumed by running it again.
+
+    :param batch_sleep: Seconds to sleep between two batches
+    :param batch_duration: Seconds each batch should take. When given, the
+                           size of each batch is adapted to how long the
+                           previous batch of the table took, up to max_rows
+    :param dry_run: Only count the rows that would be deleted
+    :returns: An ordered dict of the number of rows deleted, or that would
+              be deleted, from each table
+    """
+    # check max_rows for its maximum limit
+    _validate_db_int(max_rows=max_rows)
+
+    session = session or get_session()
+    deleted_age = timeutils.utcnow() - datetime.timedelta(days=age_in_days)
+
+    purged = collections.OrderedDict()
+    for tab in _get_purge_tables(get_engine()):
+        tbl = tab.name
+        if dry_run:
+            query_count = sql.select(
+                [sa_sql.func.count()]).select_from(tab).where(
+                tab.c.deleted_at < deleted_age)
+            rows = session.execute(query_count).scalar()
+            LOG.info(_LI('Would delete %(rows)d row(s) older than '
+                         '%(age_in_days)d day(s) from table %(tbl)s'),
+                     {'rows': rows, 'age_in_days': age_in_days, 'tbl': tbl})
+        else:
+            LOG.info(
+                _LI('Purging deleted rows older than %(age_in_days)d day(s) '
+                    'from table %(tbl)s'),
+                {'age_in_days': age_in_days, 'tbl': tbl})
+            rows = _purge_table(session, tab, deleted_age, max_rows,
+                                batch_sleep, batch_duration)
+        purged[tbl] = rows
+    return purged
 
 
 def user_get_storage_usage(context, owner_id, subject_id=None, session=None):
     _check_subject_id(subject_id)
     session = session or get_session()
+    if CONF.track_user_storage_usage and owner_id is not None:
+        total_size = _owner_storage_usage_get(owner_id, session)
+        if subject_id is not None:
+            owner, size = _subject_get_disk_usage(subject_id, session)
+            if owner == owner_id:
+                total_size -= size
+        return total_size
+
     total_size = _subject_get_disk_usage_by_owner(
         owner_id, session, subject_id=subject_id)
     return total_size
@@ -0,0 +1,39 @@
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy import BigInteger, Column, MetaData, String, Table
+
+
+def define_subject_storage_usage_table(meta):
+    subject_storage_usage = Table('subject_storage_usage',
+                                  meta,
+                                  Column('owner',
+                                         String(255),
+                                         primary_key=True,
+                                         nullable=False),
+                                  Column('size',
+                                         BigInteger,
+                                         nullable=False,
+                                         default=0),
+                                  mysql_engine='InnoDB',
+                                  mysql_charset='utf8')
+
+    return subject_storage_usage
+
+
+def upgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+    subject_storage_usage = define_subject_storage_usage_table(meta)
+    subject_storage_usage.create()
@@ -0,0 +1,28 @@
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from migrate.changeset import *  # noqa
+from sqlalchemy import Column, Index, MetaData, String, Table
+
+INDEX_NAME = 'os_hash_value_subject_idx'
+
+
+def upgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+    subjects = Table('subjects', meta, autoload=True)
+    Column('os_hash_algo', String(64)).create(subjects)
+    Column('os_hash_value', String(128)).create(subjects)
+    index = Index(INDEX_NAME, subjects.c.os_hash_value)
+    index.create(migrate_engine)
@@ -118,7 +118,9 @@ class Subject(BASE, GlanceBase):
                       Index('ix_subjects_deleted', 'deleted'),
                       Index('owner_subject_idx', 'owner'),
                       Index('created_at_subject_idx', 'created_at'),
-                      Index('updated_at_subject_idx', 'updated_at'))
+                      Index('created_at_id_subject_idx', 'created_at', 'id'),
+                      Index('updated_at_subject_idx', 'updated_at'),
+                      Index('os_hash_value_subject_idx', 'os_hash_value'))
 
     id = Column(String(36), primary_key=True,
                 default=lambda: str(uuid.uuid4()))
@@ -130,6 +132,8 @@ class Subject(BASE, GlanceBase):
     tar_format = Column(String(20))
     owner = Column(String(255))
     checksum = Column(String(32))
+    os_hash_algo = Column(String(64))
+    os_hash_value = Column(String(128))
     contributor = Column(String(32))
     phase = Column(String(32))
     language = Column(String(32))
@@ -178,7 +182,9 @@ class SubjectLocation(BASE, GlanceBase):
     """Represents an subject location in the datastore."""
     __tablename__ = 'subject_locations'
     __table_args__ = (Index('ix_subject_locations_subject_id', 'subject_id'),
-                      Index('ix_subject_locations_deleted', 'deleted'),)
+                      Index('ix_subject_locations_deleted', 'deleted'),
+                      Index('ix_subject_locations_status_deleted_at',
+                            'status', 'deleted_at'),)
 
     id = Column(Integer, primary_key=True, nullable=False)
     subject_id = Column(String(36), ForeignKey('subjects.id'), nullable=False)
@@ -188,6 +194,15 @@ class SubjectLocation(BASE, GlanceBase):
     status = Column(String(30), server_default='active', nullable=False)
 
 
+class SubjectStorageUsage(BASE, models.ModelBase):
+    """Represents the storage consumed by the subjects of an owner."""
+    __tablename__ = 'subject_storage_usage'
+
+    owner = Column(String(255), primary_key=True, nullable=False)
+    size = Column(BigInteger().with_variant(Integer, "sqlite"),
+                  nullable=False, default=0)
+
+
 class SubjectMember(BASE, GlanceBase):
     """Represents an subject members in the datastore."""
     __tablename__ = 'subject_members'
@@ -48,7 +48,7 @@ def _import_delayed_delete():
 
 class SubjectFactory(object):
     _readonly_properties = ['created_at', 'updated_at', 'status', 'checksum',
-                            'size']
+                            'os_hash_algo', 'os_hash_value', 'size']
     _reserved_properties = ['owner', 'locations', 'deleted', 'deleted_at',
                             'direct_url', 'self', 'file', 'schema']
 
@@ -128,6 +128,8 @@ class Subject(object):
         self.protected = kwargs.pop('protected', False)
         self.locations = kwargs.pop('locations', [])
         self.checksum = kwargs.pop('checksum', None)
+        self.os_hash_algo = kwargs.pop('os_hash_algo', None)
+        self.os_hash_value = kwargs.pop('os_hash_value', None)
         self.owner = kwargs.pop('owner', None)
         self.tar_format = kwargs.pop('tar_format', None)
         self.contributor = kwargs.pop('contributor', None)
@@ -70,7 +70,8 @@ class Gateway(object):
     def get_repo(self, context):
         subject_repo = subject.db.SubjectRepo(context, self.db_api)
         store_subject_repo = subject.location.SubjectRepoProxy(
-            subject_repo, context, self.store_api, self.store_utils)
+            subject_repo, context, self.store_api, self.store_utils,
+            self.db_api)
         quota_subject_repo = subject.quota.SubjectRepoProxy(
             store_subject_repo, context, self.db_api, self.store_utils)
         policy_subject_repo = policy.SubjectRepoProxy(
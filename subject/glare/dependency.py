@@ -18,11 +18,92 @@ from subject.glare.domain import proxy
 from subject.i18n import _
 
 
+def _unproxy(artifact):
+    """Returns the base declarative artifact of a proxy of any level."""
+    while not isinstance(artifact, definitions.ArtifactType):
+        artifact = artifact.base
+    return artifact
+
+
+def _iter_dependencies(artifact):
+    """Yields the artifacts the dependency properties of artifact refer to."""
+    for param in artifact.metadata.attributes.dependencies:
+        dependency = getattr(artifact, param)
+        if isinstance(dependency, list):
+            for dep in dependency:
+                yield dep
+        elif dependency:
+            yield dependency
+
+
+class DependencyResolver(object):
+    """
+    Resolves dependency ids into the artifacts they refer to.
+
+    The whole dependency graph under the requested ids is fetched level by
+    level, with one get_many() per level, so that the number of round trips
+    depends on the depth of the graph rather than on the number of
+    dependencies. Fetched artifacts are kept in an identity map for the
+    lifetime of the resolver, which is a single request.
+
+    Only dep_ids themselves have to be visible to the caller. The levels
+    below them are walked for cycle detection only, and the artifacts of
+    those levels the caller cannot see are skipped.
+    """
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.artifacts = {}
+        # Ids below the first level which the repo did not return
+        self.hidden = set()
+
+    def resolve(self, artifact_id, dep_ids):
+        """
+        Returns the artifacts with ids dep_ids, in the same order.
+
+        :param artifact_id: Id of the artifact depending on dep_ids
+        :param dep_ids: Ids of the dependencies
+        :raises ArtifactNotFound: if any of dep_ids is not found
+        :raises ArtifactCircularDependency: if artifact_id is reachable from
+                                            any of dep_ids
+        """
+        seen = set()
+        level = list(dep_ids)
+        first_level = True
+        while level:
+            level = [dep_id for dep_id in set(level) if dep_id not in seen]
+            if artifact_id in level:
+                raise exc.ArtifactCircularDependency()
+            seen.update(level)
+            missing = [dep_id for dep_id in level
+                       if dep_id not in self.artifacts and
+                       (first_level or dep_id not in self.hidden)]
+            if missing:
+                for art in self.repo.get_many(missing):
+                    art = _unproxy(art)
+                    self.artifacts[art.id] = art
+                for dep_id in missing:
+                    if dep_id in self.artifacts:
+                        continue
+                    if first_level:
+                        raise exc.ArtifactNotFound(id=dep_id)
+                    self.hidden.add(dep_id)
+            level = [dep.id for dep_id in level if dep_id in self.artifacts
+                     for dep in _iter_dependencies(self.artifacts[dep_id])]
+            first_level = False
+        return [self.artifacts[dep_id] for dep_id in dep_ids]
+
+    def forget(self, artifact_id):
+        """Drops an artifact which is changed from the identity map."""
+        self.artifacts.pop(artifact_id, None)
+        self.hidden.discard(artifact_id)
+
+
 class ArtifactProxy(proxy.Artifact):
-    def __init__(self, artifact, repo):
+    def __init__(self, artifact, resolver):
         super(ArtifactProxy, self).__init__(artifact)
         self.artifact = artifact
-        self.repo = repo
+        self.resolver = resolver
 
     def set_type_specific_property(self, prop_name, value):
         if prop_name not in self.metadata.attributes.dependencies:
@@ -34,31 +115,21 @@ class ArtifactProxy(proxy.Artifact):
         else:
             if not isinstance(value, list):
                 setattr(self.artifact, prop_name,
-                        self._fetch_dependency(value))
+                        self.resolver.resolve(self.id, [value])[0])
             else:
                 setattr(self.artifact, prop_name,
-                        [self._fetch_dependency(dep_id) for dep_id in value])
-
-    def _fetch_dependency(self, dep_id):
-        # check for circular dependency id -> id
-        if self.id == dep_id:
-            raise exc.ArtifactCircularDependency()
-        art = self.repo.get(artifact_id=dep_id)
-
-        # repo returns a proxy of some level.
-        # Need to find the base declarative artifact
-        while not isinstance(art, definitions.ArtifactType):
-            art = art.base
-        return art
+                        self.resolver.resolve(self.id, value))
 
 
 class ArtifactRepo(proxy.ArtifactRepo):
     def __init__(self, repo, plugins,
                  item_proxy_class=None, item_proxy_kwargs=None):
         self.plugins = plugins
-        super(ArtifactRepo, self).__init__(repo,
-                                           item_proxy_class=ArtifactProxy,
-                                           item_proxy_kwargs={'repo': self})
+        self.resolver = DependencyResolver(self)
+        super(ArtifactRepo, self).__init__(
+            repo,
+            item_proxy_class=ArtifactProxy,
+            item_proxy_kwargs={'resolver': self.resolver})
 
     def _check_dep_state(self, dep, state):
         """Raises an exception if dependency 'dep' is not in state 'state'"""
@@ -66,6 +137,10 @@ class ArtifactRepo(proxy.ArtifactRepo):
             raise exc.Invalid(_(
                 "Not all dependencies are in '%s' state") % state)
 
+    def save(self, artifact):
+        self.resolver.forget(artifact.id)
+        return super(ArtifactRepo, self).save(artifact)
+
     def publish(self, artifact, *args, **kwargs):
         """
         Creates transitive dependencies,
@@ -75,13 +150,9 @@ class ArtifactRepo(proxy.ArtifactRepo):
         # make sure that all required dependencies exist
         artifact.__pre_publish__(*args, **kwargs)
         # make sure that all dependencies are active
-        for param in artifact.metadata.attributes.dependencies:
-            dependency = getattr(artifact, param)
-            if isinstance(dependency, list):
-                for dep in dependency:
-                    self._check_dep_state(dep, 'active')
-            elif dependency:
-                self._check_dep_state(dependency, 'active')
+        for dep in _iter_dependencies(artifact):
+            self._check_dep_state(dep, 'active')
+        self.resolver.forget(artifact.id)
         # as state is changed on db save, have to retrieve the freshly changed
         # artifact (the one passed into the func will have old state value)
         artifact = self.base.publish(self.helper.unproxy(artifact))
@@ -98,6 +169,7 @@ class ArtifactRepo(proxy.ArtifactRepo):
                 raise exc.Invalid(_(
                     "Dependency property '%s' has to be deleted first") %
                     param)
+        self.resolver.forget(artifact.id)
         return self.base.remove(self.helper.unproxy(artifact))
 
 
@@ -105,9 +177,10 @@ class ArtifactFactory(proxy.ArtifactFactory):
     def __init__(self, base, klass, repo):
         self.klass = klass
         self.repo = repo
+        self.resolver = DependencyResolver(repo)
         super(ArtifactFactory, self).__init__(
             base, artifact_proxy_class=ArtifactProxy,
-            artifact_proxy_kwargs={'repo': self.repo})
+            artifact_proxy_kwargs={'resolver': self.resolver})
 
     def new_artifact(self, *args, **kwargs):
         """
@@ -120,6 +193,15 @@ class ArtifactFactory(proxy.ArtifactFactory):
         deps = {p: kwargs[p] for p in kwargs
                 if p in self.klass.metadata.attributes.dependencies}
         artifact = super(ArtifactFactory, self).new_artifact(*args, **no_deps)
+        # fetch the dependencies of all the properties at once
+        dep_ids = []
+        for dep_value in deps.values():
+            if isinstance(dep_value, list):
+                dep_ids.extend(dep_value)
+            elif dep_value is not None:
+                dep_ids.append(dep_value)
+        if dep_ids:
+            self.resolver.resolve(artifact.id, dep_ids)
         # now set dependencies
         for dep_param, dep_value in deps.items():
             setattr(artifact, dep_param, dep_value)
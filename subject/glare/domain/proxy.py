@@ -60,6 +60,15 @@ class ArtifactRepo(object):
     def get(self, *args, **kwargs):
         return self.helper.proxy(self.base.get(*args, **kwargs))
 
+    def get_many(self, artifact_ids, **kwargs):
+        get_many = getattr(self.base, 'get_many', None)
+        if get_many is not None:
+            items = get_many(artifact_ids, **kwargs)
+        else:
+            items = [self.base.get(artifact_id=artifact_id, **kwargs)
+                     for artifact_id in artifact_ids]
+        return [self.helper.proxy(item) for item in items]
+
     def list(self, *args, **kwargs):
         items = self.base.list(*args, **kwargs)
         return [self.helper.proxy(item) for item in items]
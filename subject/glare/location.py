@@ -137,8 +137,7 @@ class ArtifactBlobProxy(proxy.ArtifactBlob):
         location, ret_size, checksum, loc_meta = self.store_api.add_to_backend(
             CONF,
             self.blob.item_key,
-            utils.LimitingReader(utils.CooperativeReader(data),
-                                 CONF.subject_size_cap),
+            utils.CooperativeReader(data, limit=CONF.subject_size_cap),
             size,
             context=self.context)
         self.blob.size = ret_size
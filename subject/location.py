@@ -25,6 +25,7 @@ from oslo_log import log as logging
 from oslo_utils import encodeutils
 from oslo_utils import excutils
 
+from subject.common import digest
 from subject.common import exception
 from subject.common import utils
 import subject.domain.proxy
@@ -37,7 +38,8 @@ LOG = logging.getLogger(__name__)
 
 class SubjectRepoProxy(subject.domain.proxy.Repo):
 
-    def __init__(self, subject_repo, context, store_api, store_utils):
+    def __init__(self, subject_repo, context, store_api, store_utils,
+                 db_api=None):
         self.context = context
         self.store_api = store_api
         proxy_kwargs = {'context': context, 'store_api': store_api,
@@ -46,7 +48,7 @@ class SubjectRepoProxy(subject.domain.proxy.Repo):
                                                item_proxy_class=SubjectProxy,
                                                item_proxy_kwargs=proxy_kwargs)
 
-        self.db_api = subject.db.get_api()
+        self.db_api = db_api or subject.db.get_api()
 
     def _set_acls(self, subject):
         public = subject.visibility == 'public'
@@ -430,14 +432,17 @@ class SubjectProxy(subject.domain.proxy.Subject):
         else:
             verifier = None
 
+        # The verifier is updated in the same pass over the data as the
+        # secure hash, rather than by the store.
+        subject_digest = digest.get_upload_digest(verifier)
         location, size, checksum, loc_meta = self.store_api.add_to_backend(
             CONF,
             self.subject.subject_id,
-            utils.LimitingReader(utils.CooperativeReader(data),
-                                 CONF.subject_size_cap),
+            utils.CooperativeReader(data, limit=CONF.subject_size_cap,
+                                    digest=subject_digest),
             size,
-            context=self.context,
-            verifier=verifier)
+            context=self.context)
+        subject_digest.wait()
 
         # NOTE(bpoulos): if verification fails, exception will be raised
         if verifier:
@@ -454,6 +459,9 @@ class SubjectProxy(subject.domain.proxy.Subject):
                                  'status': 'active'}]
         self.subject.size = size
         self.subject.checksum = checksum
+        self.subject.os_hash_algo = CONF.hashing_algorithm
+        self.subject.os_hash_value = subject_digest.hexdigest(
+            CONF.hashing_algorithm)
         self.subject.status = 'active'
 
     def get_data(self, offset=0, chunk_size=None):
@@ -15,11 +15,19 @@
 #    under the License.
 
 import abc
-
+import atexit
+import errno
+import os
+import re
+import time
+
+import eventlet
+from eventlet import queue
 import subject_store
 from oslo_config import cfg
 from oslo_log import log as logging
 import oslo_messaging
+from oslo_serialization import jsonutils
 from oslo_utils import encodeutils
 from oslo_utils import excutils
 import six
@@ -28,7 +36,7 @@ import webob
 from subject.common import exception
 from subject.common import timeutils
 from subject.domain import proxy as domain_proxy
-from subject.i18n import _, _LE
+from subject.i18n import _, _LE, _LI, _LW
 
 
 notifier_opts = [
@@ -78,6 +86,102 @@ Possible values:
 Related options:
     * None
 
+""")),
+    cfg.IntOpt('notification_queue_size',
+               default=0,
+               min=0,
+               help=_("""
+The number of notifications each process queues for sending.
+
+Provide the maximum number of notifications each process holds in memory
+while they are sent, one batch after another, from a thread of their own.
+Requests then return without waiting for the notifications they emit to
+reach the messaging broker, so that a slow or unavailable broker does not
+hold them up. Once the queue is full, further notifications are handled
+as set by ``notification_overflow_policy``. Queued notifications are sent
+before the process exits, or before an API worker stopped with SIGTERM
+does, for up to ``notification_flush_timeout`` seconds. Setting this to 0
+sends every notification from the request that emits it.
+
+Possible values:
+    * Zero
+    * Positive integer
+
+Related options:
+    * notification_batch_size
+    * notification_overflow_policy
+    * notification_flush_timeout
+
+""")),
+    cfg.IntOpt('notification_batch_size',
+               default=100,
+               min=1,
+               help=_("""
+The number of queued notifications sent in a row.
+
+Provide the maximum number of queued notifications sent one after
+another before the thread sending them lets requests run again.
+
+Possible values:
+    * Positive integer
+
+Related options:
+    * notification_queue_size
+
+""")),
+    cfg.StrOpt('notification_overflow_policy',
+               default='drop',
+               choices=('drop', 'spill'),
+               help=_("""
+What to do with notifications emitted while the queue is full.
+
+With ``drop``, they are dropped and counted. With ``spill``, they are
+appended to a file in ``notification_spill_dir``, and sent once the queue
+has been emptied or when the process exits. Notifications that cannot be
+written to the file are dropped.
+
+Possible values:
+    * drop
+    * spill
+
+Related options:
+    * notification_queue_size
+    * notification_spill_dir
+
+""")),
+    cfg.StrOpt('notification_spill_dir',
+               help=_("""
+Directory to spill notifications to when the queue is full.
+
+Each process appends the notifications it cannot queue to a file of its
+own in this directory. The directory must exist and be writable by the
+service.
+
+Possible values:
+    * A valid path to a directory
+
+Related options:
+    * notification_overflow_policy
+
+""")),
+    cfg.IntOpt('notification_flush_timeout',
+               default=10,
+               min=0,
+               help=_("""
+The number of seconds to wait for queued notifications at exit.
+
+Provide the longest time a process exiting, or an API worker stopped
+with SIGTERM, waits for its queued and spilled notifications to be sent.
+Notifications still queued once it has passed are spilled, if
+``notification_overflow_policy`` is ``spill``, or dropped.
+
+Possible values:
+    * Zero
+    * Positive integer
+
+Related options:
+    * notification_queue_size
+
 """)),
 ]
 
@@ -86,6 +190,8 @@ CONF.register_opts(notifier_opts)
 
 LOG = logging.getLogger(__name__)
 
+SPILL_FILE_PATTERN = re.compile(r'^notifications-(\d+)\.spill(\.\w+)?$')
+
 
 def set_defaults(control_exchange='subject'):
     oslo_messaging.set_transport_defaults(control_exchange)
@@ -95,6 +201,245 @@ def get_transport():
     return oslo_messaging.get_notification_transport(CONF)
 
 
+class NotificationDispatcher(object):
+
+    """
+    Sends notifications from a greenthread of its own.
+
+    Notifications are queued up to a bounded number, and sent in batches
+    from the dispatching greenthread, which lets other greenthreads run
+    between batches. Notifications that do not fit in the queue are either
+    dropped or spilled to a file, to be sent once the queue is empty.
+    """
+
+    def __init__(self, queue_size, batch_size, overflow_policy='drop',
+                 spill_dir=None):
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.overflow_policy = overflow_policy
+        self.spill_dir = None
+        self.spill_path = None
+        if overflow_policy == 'spill' and spill_dir:
+            self.spill_dir = spill_dir
+            self.spill_path = os.path.join(
+                spill_dir, 'notifications-%d.spill' % os.getpid())
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.spilled = 0
+        self._queue = queue.LightQueue(queue_size)
+        self._notifiers = {}
+        self._busy = False
+        self._thread = None
+        if self._adopt_spilled():
+            self._start()
+
+    def _adopt_spilled(self):
+        """
+        Takes over the notifications spilled by processes that exited
+        before sending them. Returns whether there were any.
+        """
+        if self.spill_path is None:
+            return False
+        try:
+            names = os.listdir(self.spill_dir)
+        except OSError as e:
+            LOG.warn(_LW("Cannot read notification spill directory "
+                         "%(dir)s: %(error)s") %
+                     {'dir': self.spill_dir,
+                      'error': encodeutils.exception_to_unicode(e)})
+            return False
+
+        adopted = False
+        for name in names:
+            match = SPILL_FILE_PATTERN.match(name)
+            if match is None or int(match.group(1)) == os.getpid():
+                continue
+            try:
+                os.kill(int(match.group(1)), 0)
+                continue
+            except OSError as e:
+                if e.errno != errno.ESRCH:
+                    continue
+            adopting_path = self.spill_path + '.adopting'
+            try:
+                os.rename(os.path.join(self.spill_dir, name), adopting_path)
+                with open(adopting_path) as adopted_file:
+                    with open(self.spill_path, 'a') as spill_file:
+                        for line in adopted_file:
+                            spill_file.write(line)
+                os.unlink(adopting_path)
+            except (IOError, OSError):
+                # Another process took it over first.
+                continue
+            adopted = True
+        return adopted
+
+    def _start(self):
+        if self._thread is None:
+            self._busy = True
+            self._thread = eventlet.spawn(self._run)
+
+    @property
+    def depth(self):
+        """The number of notifications queued."""
+        return self._queue.qsize()
+
+    def get_stats(self):
+        return {'depth': self.depth, 'sent': self.sent,
+                'failed': self.failed, 'dropped': self.dropped,
+                'spilled': self.spilled}
+
+    def put(self, notifier, priority, event_type, payload):
+        """Queues a notification to be sent by the given oslo notifier."""
+        event = (notifier, priority, event_type, payload)
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self._overflow([event])
+        self._start()
+
+    def _overflow(self, events):
+        if self.spill_path is not None:
+            try:
+                with open(self.spill_path, 'a') as spill_file:
+                    for notifier, priority, event_type, payload in events:
+                        spill_file.write(jsonutils.dumps({
+                            'publisher_id': notifier.publisher_id,
+                            'priority': priority,
+                            'event_type': event_type,
+                            'payload': payload}) + '\n')
+                self.spilled += len(events)
+                return
+            except (IOError, OSError, TypeError, ValueError) as e:
+                LOG.warn(_LW("Failed to spill notifications to %(path)s: "
+                             "%(error)s") %
+                         {'path': self.spill_path,
+                          'error': encodeutils.exception_to_unicode(e)})
+
+        dropped = self.dropped
+        self.dropped += len(events)
+        # Warn on the first drop, then once per thousand drops.
+        if dropped == 0 or dropped // 1000 != self.dropped // 1000:
+            LOG.warn(_LW("Notification queue is full, %d notifications "
+                         "dropped so far"), self.dropped)
+
+    def _send(self, events):
+        for notifier, priority, event_type, payload in events:
+            try:
+                getattr(notifier, priority)({}, event_type, payload)
+                self.sent += 1
+            except Exception as e:
+                self.failed += 1
+                LOG.error(_LE("Failed to send %(event_type)s notification: "
+                              "%(error)s") %
+                          {'event_type': event_type,
+                           'error': encodeutils.exception_to_unicode(e)})
+
+    def _get_notifier(self, publisher_id):
+        notifier = self._notifiers.get(publisher_id)
+        if notifier is None:
+            notifier = oslo_messaging.Notifier(get_transport(),
+                                               publisher_id=publisher_id)
+            self._notifiers[publisher_id] = notifier
+        return notifier
+
+    def _get_batch(self, block):
+        batch = []
+        try:
+            if block:
+                batch.append(self._queue.get())
+            while len(batch) < self.batch_size:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _send_spilled(self):
+        """Sends the notifications spilled to the file so far."""
+        if self.spill_path is None or not os.path.exists(self.spill_path):
+            return
+        # Notifications spilled while these are sent go to a new file.
+        sending_path = self.spill_path + '.sending'
+        os.rename(self.spill_path, sending_path)
+        batch = []
+        with open(sending_path) as spill_file:
+            for line in spill_file:
+                try:
+                    event = jsonutils.loads(line)
+                    batch.append((self._get_notifier(event['publisher_id']),
+                                  event['priority'], event['event_type'],
+                                  event['payload']))
+                except (ValueError, KeyError):
+                    self.failed += 1
+                    continue
+                if len(batch) == self.batch_size:
+                    self._send(batch)
+                    batch = []
+                    eventlet.sleep(0)
+        self._send(batch)
+        os.unlink(sending_path)
+
+    def _run(self):
+        while True:
+            self._busy = True
+            try:
+                if not self.depth:
+                    self._send_spilled()
+                self._busy = False
+                batch = self._get_batch(block=True)
+                self._busy = True
+                self._send(batch)
+            except Exception as e:
+                LOG.error(_LE("Failed to send notifications: %s") %
+                          encodeutils.exception_to_unicode(e))
+            finally:
+                self._busy = False
+            eventlet.sleep(0)
+
+    def flush(self, timeout):
+        """
+        Waits up to timeout seconds for the queued and spilled
+        notifications to be sent, then spills or drops those left.
+        """
+        deadline = time.time() + timeout
+        if self._thread is not None:
+            while (self.depth or self._busy) and time.time() < deadline:
+                eventlet.sleep(0.1)
+        left = self._get_batch(block=False)
+        while left:
+            self._overflow(left)
+            left = self._get_batch(block=False)
+        LOG.info(_LI("Notification dispatcher stopping: %s"),
+                 self.get_stats())
+
+
+_DISPATCHER = None
+
+
+def get_dispatcher():
+    """
+    Returns the notification dispatcher of this process, or None if
+    notifications are sent by the requests emitting them.
+    """
+    global _DISPATCHER
+    if not CONF.notification_queue_size:
+        return None
+    if _DISPATCHER is None:
+        _DISPATCHER = NotificationDispatcher(
+            CONF.notification_queue_size, CONF.notification_batch_size,
+            overflow_policy=CONF.notification_overflow_policy,
+            spill_dir=CONF.notification_spill_dir)
+        atexit.register(flush)
+    return _DISPATCHER
+
+
+def flush():
+    """Sends or spills the notifications queued by this process."""
+    if _DISPATCHER is not None:
+        _DISPATCHER.flush(CONF.notification_flush_timeout)
+
+
 class Notifier(object):
     """Uses a notification strategy to send out messages about events."""
 
@@ -104,14 +449,21 @@ class Notifier(object):
         self._notifier = oslo_messaging.Notifier(self._transport,
                                                  publisher_id=publisher_id)
 
+    def _notify(self, priority, event_type, payload):
+        dispatcher = get_dispatcher()
+        if dispatcher is None:
+            getattr(self._notifier, priority)({}, event_type, payload)
+        else:
+            dispatcher.put(self._notifier, priority, event_type, payload)
+
     def warn(self, event_type, payload):
-        self._notifier.warn({}, event_type, payload)
+        self._notify('warn', event_type, payload)
 
     def info(self, event_type, payload):
-        self._notifier.info({}, event_type, payload)
+        self._notify('info', event_type, payload)
 
     def error(self, event_type, payload):
-        self._notifier.error({}, event_type, payload)
+        self._notify('error', event_type, payload)
 
 
 def _get_notification_group(notification):
@@ -151,6 +503,8 @@ def format_subject_notification(subject):
         'subject_format': subject.subject_format,
         'protected': subject.protected,
         'checksum': subject.checksum,
+        'os_hash_algo': subject.os_hash_algo,
+        'os_hash_value': subject.os_hash_value,
         'owner': subject.owner,
         'tar_format': subject.tar_format,
         'contributor': subject.contributor,
@@ -27,12 +27,15 @@ import itertools
 from osprofiler import opts as profiler
 
 import subject.api.middleware.context
+import subject.api.policy
 import subject.api.versions
 import subject.async.flows.convert
 import subject.async.taskflow_executor
 import subject.common.config
+import subject.common.digest
 import subject.common.location_strategy
 import subject.common.location_strategy.store_type
+import subject.common.metadata_cache
 import subject.common.property_utils
 import subject.common.rpc
 import subject.common.wsgi
@@ -48,9 +51,12 @@ import subject.scrubber
 _api_opts = [
     (None, list(itertools.chain(
         subject.api.middleware.context.context_opts,
+        subject.api.policy.policy_opts,
         subject.api.versions.versions_opts,
         subject.common.config.common_opts,
+        subject.common.digest.digest_opts,
         subject.common.location_strategy.location_strategy_opts,
+        subject.common.metadata_cache.metadata_cache_opts,
         subject.common.property_utils.property_opts,
         subject.common.rpc.rpc_opts,
         subject.common.wsgi.bind_opts,
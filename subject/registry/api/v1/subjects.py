@@ -297,7 +297,8 @@ class Controller(object):
         """Parse a marker query param into something usable."""
         marker = req.params.get('marker', None)
 
-        if marker and not uuidutils.is_uuid_like(marker):
+        if (marker and not uuidutils.is_uuid_like(marker) and
+                not utils.is_keyset_marker(marker)):
             msg = _('Invalid marker format')
             raise exc.HTTPBadRequest(explanation=msg)
 
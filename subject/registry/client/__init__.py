@@ -156,6 +156,49 @@ Possible values:
 Related options:
     * None
 
+""")),
+    cfg.IntOpt('registry_client_pool_size',
+               default=10,
+               min=0,
+               help=_("""
+Maximum number of idle connections to the registry kept open per process.
+
+Provide an integer value representing the number of connections to the
+registry server that each API worker keeps open after a registry request
+has completed, so that later registry requests are sent on them instead
+of connecting (and negotiating SSL) again. Connections beyond this number
+are closed once their request has completed.
+
+A value of 0 implies that a new connection is made for every registry
+request.
+
+Possible values:
+    * Zero
+    * Positive integer
+
+Related options:
+    * registry_client_pool_idle_timeout
+
+""")),
+    cfg.IntOpt('registry_client_pool_idle_timeout',
+               default=60,
+               min=0,
+               help=_("""
+Number of seconds idle connections to the registry are kept open.
+
+Provide an integer value representing the period of time in seconds after
+which an idle connection to the registry server is closed instead of
+being reused for a registry request. This should be lower than the
+``client_socket_timeout`` of the registry server, after which the server
+closes idle connections itself.
+
+Possible values:
+    * Zero
+    * Positive integer
+
+Related options:
+    * registry_client_pool_size
+
 """)),
 ]
 
@@ -24,6 +24,7 @@ from oslo_log import log as logging
 from oslo_serialization import jsonutils
 
 from subject.common import exception
+from subject.common import metadata_cache
 from subject.i18n import _
 from subject.registry.client.v1 import client
 
@@ -117,6 +118,8 @@ def configure_registry_client():
         'ca_file': CONF.registry_client_ca_file,
         'insecure': CONF.registry_client_insecure,
         'timeout': CONF.registry_client_timeout,
+        'pool_size': CONF.registry_client_pool_size,
+        'pool_idle_timeout': CONF.registry_client_pool_idle_timeout,
     }
 
     if not CONF.use_user_token:
@@ -178,8 +181,10 @@ def get_subjects_detail(context, **kwargs):
 
 
 def get_subject_metadata(context, subject_id):
-    c = get_registry_client(context)
-    return c.get_subject(subject_id)
+    def fetch():
+        c = get_registry_client(context)
+        return c.get_subject(subject_id)
+    return metadata_cache.get('registry_v1', context, subject_id, fetch)
 
 
 def add_subject_metadata(context, subject_meta):
@@ -192,14 +197,20 @@ def update_subject_metadata(context, subject_id, subject_meta,
                           purge_props=False, from_state=None):
     LOG.debug("Updating subject metadata for subject %s...", subject_id)
     c = get_registry_client(context)
-    return c.update_subject(subject_id, subject_meta, purge_props=purge_props,
-                          from_state=from_state)
+    try:
+        return c.update_subject(subject_id, subject_meta,
+                                purge_props=purge_props, from_state=from_state)
+    finally:
+        metadata_cache.invalidate(subject_id)
 
 
 def delete_subject_metadata(context, subject_id):
     LOG.debug("Deleting subject metadata for subject %s...", subject_id)
     c = get_registry_client(context)
-    return c.delete_subject(subject_id)
+    try:
+        return c.delete_subject(subject_id)
+    finally:
+        metadata_cache.invalidate(subject_id)
 
 
 def get_subject_members(context, subject_id):
@@ -214,14 +225,23 @@ def get_member_subjects(context, member_id):
 
 def replace_members(context, subject_id, member_data):
     c = get_registry_client(context)
-    return c.replace_members(subject_id, member_data)
+    try:
+        return c.replace_members(subject_id, member_data)
+    finally:
+        metadata_cache.invalidate(subject_id)
 
 
 def add_member(context, subject_id, member_id, can_share=None):
     c = get_registry_client(context)
-    return c.add_member(subject_id, member_id, can_share=can_share)
+    try:
+        return c.add_member(subject_id, member_id, can_share=can_share)
+    finally:
+        metadata_cache.invalidate(subject_id)
 
 
 def delete_member(context, subject_id, member_id):
     c = get_registry_client(context)
-    return c.delete_member(subject_id, member_id)
+    try:
+        return c.delete_member(subject_id, member_id)
+    finally:
+        metadata_cache.invalidate(subject_id)
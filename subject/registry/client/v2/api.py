@@ -75,6 +75,8 @@ def configure_registry_client():
         'ca_file': CONF.registry_client_ca_file,
         'insecure': CONF.registry_client_insecure,
         'timeout': CONF.registry_client_timeout,
+        'pool_size': CONF.registry_client_pool_size,
+        'pool_idle_timeout': CONF.registry_client_pool_idle_timeout,
     }
 
     if not CONF.use_user_token:
@@ -23,6 +23,11 @@ from subject.i18n import _
 
 class Schema(object):
 
+    # Keep keys that are not schema properties when filtering
+    _filter_all = False
+    _validator = None
+    _filter_keys = None
+
     def __init__(self, name, properties=None, links=None, required=None,
                  definitions=None):
         self.name = name
@@ -33,40 +38,59 @@ class Schema(object):
         self.required = required
         self.definitions = definitions
 
+    def _get_validator(self):
+        """
+        Returns a validator compiled from raw(), checking the schema against
+        its meta-schema only the first time.
+        """
+        if self._validator is None:
+            raw = self.raw()
+            cls = jsonschema.validators.validator_for(raw)
+            cls.check_schema(raw)
+            self._validator = cls(raw)
+        return self._validator
+
     def validate(self, obj):
         try:
-            jsonschema.validate(obj, self.raw())
+            self._get_validator().validate(obj)
         except jsonschema.ValidationError as e:
             reason = encodeutils.exception_to_unicode(e)
             raise exception.InvalidObject(schema=self.name, reason=reason)
 
+    def _get_filter_keys(self):
+        """Returns the set of schema properties filter() always keeps."""
+        if self._filter_keys is None:
+            self._filter_keys = frozenset(self.properties)
+        return self._filter_keys
+
     def filter(self, obj):
+        keys = self._get_filter_keys()
+        keep_all = self._filter_all
         filtered = {}
         for key, value in six.iteritems(obj):
-            if self._filter_func(self.properties, key):
+            if key in keys:
                 filtered[key] = value
-
-            # NOTE(flaper87): This exists to allow for v1, null properties,
-            # to be used with the V2 API. During Kilo, it was allowed for the
-            # later to return None values without considering that V1 allowed
-            # for custom properties to be None, which is something V2 doesn't
-            # allow for. This small hack here will set V1 custom `None` pro-
-            # perties to an empty string so that they will be updated along
-            # with the subject (if an update happens).
-            #
-            # We could skip the properties that are `None` but that would bring
-            # back the behavior we moved away from. Note that we can't consider
-            # doing a schema migration because we don't know which properties
-            # are "custom" and which came from `schema-subject` if those custom
-            # properties were created with v1.
-            if key not in self.properties and value is None:
+            elif value is None:
+                # NOTE(flaper87): This exists to allow for v1, null
+                # properties, to be used with the V2 API. During Kilo, it was
+                # allowed for the later to return None values without
+                # considering that V1 allowed for custom properties to be
+                # None, which is something V2 doesn't allow for. This small
+                # hack here will set V1 custom `None` properties to an empty
+                # string so that they will be updated along with the subject
+                # (if an update happens).
+                #
+                # We could skip the properties that are `None` but that would
+                # bring back the behavior we moved away from. Note that we
+                # can't consider doing a schema migration because we don't
+                # know which properties are "custom" and which came from
+                # `schema-subject` if those custom properties were created
+                # with v1.
                 filtered[key] = ''
+            elif keep_all:
+                filtered[key] = value
         return filtered
 
-    @staticmethod
-    def _filter_func(properties, key):
-        return key in properties
-
     def merge_properties(self, properties):
         # Ensure custom props aren't attempting to override base props
         original_keys = set(self.properties.keys())
@@ -81,6 +105,8 @@ class Schema(object):
             raise exception.SchemaLoadError(reason=reason % {'props': props})
 
         self.properties.update(properties)
+        self._validator = None
+        self._filter_keys = None
 
     def raw(self):
         raw = {
@@ -109,9 +135,8 @@ class Schema(object):
 
 
 class PermissiveSchema(Schema):
-    @staticmethod
-    def _filter_func(properties, key):
-        return True
+
+    _filter_all = True
 
     def raw(self):
         raw = super(PermissiveSchema, self).raw()
@@ -13,8 +13,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-import calendar
-import time
+import collections
 
 import eventlet
 from subject_store import exceptions as store_exceptions
@@ -57,20 +56,71 @@ Related options:
 """)),
     cfg.IntOpt('scrub_pool_size', default=1, min=1,
                help=_("""
-The size of thread pool to be used for scrubbing subjects.
+The size of thread pool to be used for scrubbing subject locations.
 
 When there are a large number of subjects to scrub, it is beneficial to scrub
-subjects in parallel so that the scrub queue stays in control and the backend
+them in parallel so that the scrub queue stays in control and the backend
 storage is reclaimed in a timely fashion. This configuration option denotes
-the maximum number of subjects to be scrubbed in parallel. The default value is
-one, which signifies serial scrubbing. Any value above one indicates parallel
-scrubbing.
+the maximum number of subject locations to be deleted from the backend
+storage in parallel. The default value is one, which signifies serial
+scrubbing. Any value above one indicates parallel scrubbing.
 
 Possible values:
     * Any non-zero positive integer
 
 Related options:
     * ``delayed_delete``
+    * ``scrub_store_concurrency``
+
+""")),
+    cfg.IntOpt('scrub_store_concurrency', default=10, min=1,
+               help=_("""
+The maximum number of parallel deletes the scrubber sends to each store.
+
+When ``scrub_pool_size`` allows many subject locations to be scrubbed in
+parallel, this configuration option keeps the scrubber from sending more
+than this many deletes at a time to the backend storage of any one kind,
+as told apart by the scheme of the location URIs, so that a backlog of
+deleted subjects does not overload a single store.
+
+Possible values:
+    * Any non-zero positive integer
+
+Related options:
+    * ``scrub_pool_size``
+
+""")),
+    cfg.IntOpt('scrub_retries', default=3, min=0,
+               help=_("""
+The number of times the scrubber retries deleting an subject location.
+
+When the backend storage fails to delete the data of an subject location,
+the scrubber tries again after one second, and then after twice as long
+as the time before, up to this number of times. Locations that could still
+not be deleted are left in ``pending_delete`` state and are tried again on
+the next scrubber run.
+
+Possible values:
+    * Any non-negative integer
+
+Related options:
+    * ``scrub_pool_size``
+
+""")),
+    cfg.IntOpt('scrub_batch_size', default=100, min=1,
+               help=_("""
+The number of subject locations the scrubber reads and records at a time.
+
+The scrubber reads the subject locations waiting to be scrubbed from the
+database in pages of this size, and marks the locations it has deleted, and
+the subjects it has deleted all locations of, in a single transaction once
+this many have been deleted.
+
+Possible values:
+    * Any non-zero positive integer
+
+Related options:
+    * ``scrub_pool_size``
 
 """)),
     cfg.BoolOpt('delayed_delete', default=False,
@@ -99,6 +149,9 @@ Related options:
     * ``scrub_time``
     * ``wakeup_time``
     * ``scrub_pool_size``
+    * ``scrub_store_concurrency``
+    * ``scrub_retries``
+    * ``scrub_batch_size``
 
 """)),
 
@@ -215,6 +268,10 @@ CONF = cfg.CONF
 CONF.register_opts(scrubber_opts)
 CONF.import_opt('metadata_encryption_key', 'subject.common.config')
 
+# Seconds to wait before the first retry of a failed location delete; the
+# wait doubles before every further retry.
+SCRUB_RETRY_INTERVAL = 1
+
 
 class ScrubDBQueue(object):
     """Database-based subject scrub queue class."""
@@ -259,65 +316,34 @@ class ScrubDBQueue(object):
         else:
             return False
 
-    def _get_subjects_page(self, marker):
-        filters = {'deleted': True,
-                   'is_public': 'none',
-                   'status': 'pending_delete'}
-
-        if marker:
-            return self.registry.get_subjects_detailed(filters=filters,
-                                                     marker=marker)
-        else:
-            return self.registry.get_subjects_detailed(filters=filters)
-
-    def _get_all_subjects(self):
-        """Generator to fetch all appropriate subjects, paging as needed."""
-
-        marker = None
-        while True:
-            subjects = self._get_subjects_page(marker)
-            if len(subjects) == 0:
-                break
-            marker = subjects[-1]['id']
-
-            for subject in subjects:
-                yield subject
-
     def get_all_locations(self):
-        """Returns a list of subject id and location tuple from scrub queue.
+        """Returns the subject id, location id and uri tuples in the scrub
+        queue, reading them from the database a page at a time.
 
-        :returns: a list of subject id, location id and uri tuple from
-            scrub queue
+        :returns: a generator of subject id, location id and uri tuples in
+            the scrub queue, in order of location id
 
         """
-        ret = []
-
-        for subject in self._get_all_subjects():
-            deleted_at = subject.get('deleted_at')
-            if not deleted_at:
-                continue
-
-            # NOTE: Strip off microseconds which may occur after the last '.,'
-            # Example: 2012-07-07T19:14:34.974216
-            date_str = deleted_at.rsplit('.', 1)[0].rsplit(',', 1)[0]
-            delete_time = calendar.timegm(time.strptime(date_str,
-                                                        "%Y-%m-%dT%H:%M:%S"))
-
-            if delete_time + self.scrub_time > time.time():
-                continue
-
-            for loc in subject['location_data']:
-                if loc['status'] != 'pending_delete':
-                    continue
+        db = db_api.get_api()
+        batch_size = CONF.scrub_batch_size
+        marker = None
+        while True:
+            locations = db.subject_location_get_pending_delete(
+                self.admin_context, min_age=self.scrub_time, marker=marker,
+                limit=batch_size)
 
+            for loc in locations:
                 if self.metadata_encryption_key:
                     uri = crypt.urlsafe_encrypt(self.metadata_encryption_key,
                                                 loc['url'], 64)
                 else:
                     uri = loc['url']
 
-                ret.append((subject['id'], loc['id'], uri))
-        return ret
+                yield (loc['subject_id'], loc['id'], uri)
+
+            if len(locations) < batch_size:
+                break
+            marker = locations[-1]['id']
 
     def has_subject(self, subject_id):
         """Returns whether the queue contains an subject or not.
@@ -404,73 +430,95 @@ class Scrubber(object):
 
         self.db_queue = get_scrub_queue()
         self.pool = eventlet.greenpool.GreenPool(CONF.scrub_pool_size)
+        self.store_semaphores = collections.defaultdict(
+            lambda: eventlet.semaphore.Semaphore(
+                CONF.scrub_store_concurrency))
+        self.scrubbed = []
 
-    def _get_delete_jobs(self):
+    def run(self, event=None):
+        count = 0
         try:
-            records = self.db_queue.get_all_locations()
+            for subject_id, loc_id, uri in self.db_queue.get_all_locations():
+                # NOTE: Blocks while the pool is full, so that no more of
+                # the queue is read than is being scrubbed.
+                self.pool.spawn_n(self._scrub_location, subject_id, loc_id,
+                                  uri)
+                count += 1
         except Exception as err:
             LOG.error(_LE("Can not get scrub jobs from queue: %s") %
                       encodeutils.exception_to_unicode(err))
-            return {}
 
-        delete_jobs = {}
-        for subject_id, loc_id, loc_uri in records:
-            if subject_id not in delete_jobs:
-                delete_jobs[subject_id] = []
-            delete_jobs[subject_id].append((subject_id, loc_id, loc_uri))
-        return delete_jobs
+        self.pool.waitall()
+        self._record_scrubbed()
+        if count:
+            LOG.info(_LI("Processed %d subject locations from the scrub "
+                         "queue."), count)
 
-    def run(self, event=None):
-        delete_jobs = self._get_delete_jobs()
+    def _scrub_location(self, subject_id, loc_id, uri):
+        try:
+            if CONF.metadata_encryption_key:
+                uri = crypt.urlsafe_decrypt(CONF.metadata_encryption_key, uri)
+        except Exception as e:
+            LOG.error(_LE("Unable to scrub subject %(id)s from a location. "
+                          "Reason: %(exc)s ") %
+                      {'id': subject_id,
+                       'exc': encodeutils.exception_to_unicode(e)})
+            return
 
-        if delete_jobs:
-            list(self.pool.starmap(self._scrub_subject, delete_jobs.items()))
+        semaphore = self.store_semaphores[uri.split(':', 1)[0]]
+        for attempt in range(CONF.scrub_retries + 1):
+            if attempt:
+                # NOTE: The store slot is not held while backing off, so
+                # that other locations of the store are scrubbed meanwhile.
+                eventlet.sleep(SCRUB_RETRY_INTERVAL * 2 ** (attempt - 1))
+            try:
+                with semaphore:
+                    self._delete_subject_location_from_backend(subject_id,
+                                                               uri)
+            except Exception as e:
+                LOG.warn(_LW("Unable to scrub subject %(id)s from a location "
+                             "(attempt %(attempt)d of %(attempts)d). "
+                             "Reason: %(exc)s") %
+                         {'id': subject_id, 'attempt': attempt + 1,
+                          'attempts': CONF.scrub_retries + 1,
+                          'exc': encodeutils.exception_to_unicode(e)})
+                continue
 
-    def _scrub_subject(self, subject_id, delete_jobs):
-        if len(delete_jobs) == 0:
+            self.scrubbed.append(loc_id)
+            if len(self.scrubbed) >= CONF.scrub_batch_size:
+                self._record_scrubbed()
             return
 
-        LOG.info(_LI("Scrubbing subject %(id)s from %(count)d locations."),
-                 {'id': subject_id, 'count': len(delete_jobs)})
+        LOG.error(_LE("Subject location of subject '%s' couldn't be scrubbed "
+                      "from backend. Leaving it in 'pending_delete' "
+                      "status") % subject_id)
 
-        success = True
-        for img_id, loc_id, uri in delete_jobs:
-            try:
-                self._delete_subject_location_from_backend(img_id, loc_id, uri)
-            except Exception:
-                success = False
-
-        if success:
-            subject = self.registry.get_subject(subject_id)
-            if subject['status'] == 'pending_delete':
-                self.registry.update_subject(subject_id, {'status': 'deleted'})
-            LOG.info(_LI("Subject %s has been scrubbed successfully"), subject_id)
-        else:
-            LOG.warn(_LW("One or more subject locations couldn't be scrubbed "
-                         "from backend. Leaving subject '%s' in 'pending_delete'"
-                         " status") % subject_id)
+    def _record_scrubbed(self):
+        """Marks the locations scrubbed so far deleted in the database."""
+        loc_ids, self.scrubbed = self.scrubbed, []
+        if not loc_ids:
+            return
 
-    def _delete_subject_location_from_backend(self, subject_id, loc_id, uri):
-        if CONF.metadata_encryption_key:
-            uri = crypt.urlsafe_decrypt(CONF.metadata_encryption_key, uri)
         try:
-            LOG.debug("Scrubbing subject %s from a location.", subject_id)
-            try:
-                self.store_api.delete_from_backend(uri, self.admin_context)
-            except store_exceptions.NotFound:
-                LOG.info(_LI("Subject location for subject '%s' not found in "
-                             "backend; Marking subject location deleted in "
-                             "db."), subject_id)
-
-            if loc_id != '-':
-                db_api.get_api().subject_location_delete(self.admin_context,
-                                                       subject_id,
-                                                       int(loc_id),
-                                                       'deleted')
-            LOG.info(_LI("Subject %s is scrubbed from a location."), subject_id)
+            subject_ids = db_api.get_api().subject_locations_scrubbed(
+                self.admin_context, loc_ids)
         except Exception as e:
-            LOG.error(_LE("Unable to scrub subject %(id)s from a location. "
-                          "Reason: %(exc)s ") %
-                      {'id': subject_id,
+            LOG.error(_LE("Unable to mark %(count)d scrubbed subject "
+                          "locations deleted. Reason: %(exc)s") %
+                      {'count': len(loc_ids),
                        'exc': encodeutils.exception_to_unicode(e)})
-            raise
+            return
+
+        for subject_id in subject_ids:
+            LOG.info(_LI("Subject %s has been scrubbed successfully"),
+                     subject_id)
+
+    def _delete_subject_location_from_backend(self, subject_id, uri):
+        LOG.debug("Scrubbing subject %s from a location.", subject_id)
+        try:
+            self.store_api.delete_from_backend(uri, self.admin_context)
+        except store_exceptions.NotFound:
+            LOG.info(_LI("Subject location for subject '%s' not found in "
+                         "backend; Marking subject location deleted in "
+                         "db."), subject_id)
+        LOG.debug("Subject %s is scrubbed from a location.", subject_id)
@@ -17,7 +17,8 @@
 LRU Cache for Subject Data
 """
 
-import hashlib
+import threading
+import time
 
 from oslo_config import cfg
 from oslo_log import log as logging
@@ -26,9 +27,11 @@ from oslo_utils import excutils
 from oslo_utils import importutils
 from oslo_utils import units
 
+from subject.common import digest
 from subject.common import exception
 from subject.common import utils
 from subject.i18n import _, _LE, _LI, _LW
+from subject.subject_cache import policy
 
 LOG = logging.getLogger(__name__)
 
@@ -91,6 +94,108 @@ Possible values:
 Related options:
     * None
 
+""")),
+
+    cfg.IntOpt('subject_cache_prune_target_size',
+               min=0,
+               help=_("""
+The size of the subject cache, in bytes, that the cache-pruner prunes down to
+once the cache has grown beyond ``subject_cache_max_size``.
+
+By default, the cache-pruner removes just enough of the least recently
+accessed subjects to bring the cache back to ``subject_cache_max_size``. On a
+busy node, this means the cache is back over its limit shortly after the
+pruner has run. Setting this option to a value lower than
+``subject_cache_max_size`` makes the pruner free more space in one go, so
+that ``subject_cache_max_size`` acts as a high-water mark and this option as
+a low-water mark.
+
+A value greater than ``subject_cache_max_size`` is ignored.
+
+Possible values:
+    * Any non-negative integer
+
+Related options:
+    * ``subject_cache_max_size``
+
+""")),
+
+    cfg.StrOpt('subject_cache_admission_policy', default='always',
+               choices=('always', 'tinylfu'), ignore_case=True,
+               help=_("""
+The policy deciding whether an subject that is not in the subject cache is
+cached when it is downloaded.
+
+By default, every subject downloaded through the API is cached, so a single
+download of a large subject can push a number of frequently used subjects
+out of the cache. With the ``tinylfu`` policy, each API worker keeps an
+estimate of how often every subject was downloaded recently and an subject is
+only cached once it has been downloaded ``subject_cache_admission_min_hits``
+times. Subjects cached by the cache-prefetcher or the cache management API
+are always cached.
+
+Possible values:
+    * always
+    * tinylfu
+
+Related options:
+    * ``subject_cache_admission_min_hits``
+    * ``subject_cache_eviction_policy``
+
+""")),
+
+    cfg.IntOpt('subject_cache_admission_min_hits', default=2,
+               min=1, max=15,
+               help=_("""
+The number of recent downloads of an subject after which the ``tinylfu``
+admission policy caches it.
+
+The estimate of recent downloads is kept separately by each API worker and
+is halved periodically, so this is a threshold on how often an subject is
+being downloaded now rather than on its lifetime downloads.
+
+Possible values:
+    * An integer between 1 and 15
+
+Related options:
+    * ``subject_cache_admission_policy``
+
+""")),
+
+    cfg.StrOpt('subject_cache_eviction_policy', default='lru',
+               choices=('lru', 'gdsf'), ignore_case=True,
+               help=_("""
+The policy deciding which cached subjects the cache-pruner removes when the
+subject cache has grown beyond ``subject_cache_max_size``.
+
+The ``lru`` policy removes the least recently accessed subjects first. The
+``gdsf`` policy removes the subjects with the fewest hits per byte first,
+with hits counting for less the longer ago the subject was last accessed, so
+that one large subject that is rarely used is removed before a number of
+small subjects that are used as often.
+
+Possible values:
+    * lru
+    * gdsf
+
+Related options:
+    * ``subject_cache_gdsf_half_life``
+    * ``subject_cache_max_size``
+
+""")),
+
+    cfg.IntOpt('subject_cache_gdsf_half_life', default=7 * 24 * 3600,
+               min=1,
+               help=_("""
+The time, in seconds, after which the hits of a cached subject count for half
+as much when the ``gdsf`` eviction policy ranks it.
+
+Possible values:
+    * Any positive integer
+
+Related options:
+    * ``subject_cache_eviction_policy``
+
 """)),
 
     cfg.IntOpt('subject_cache_stall_time', default=86400,  # 24 hours
@@ -116,6 +221,68 @@ Possible values:
 Related options:
     * None
 
+""")),
+
+    cfg.BoolOpt('subject_cache_xattr_ledger', default=False,
+                help=_("""
+Track the size and usage of cached subjects in a ledger file when using the
+``xattr`` subject cache driver.
+
+By default, the ``xattr`` driver stats every file in the cache directory to
+compute the size of the cache, to list cached subjects and to find the least
+recently accessed subjects when pruning. With a large number of cached
+subjects this makes the cache-pruner slow. When this option is enabled, the
+driver appends a record to a ledger kept in the ``ledger`` subdirectory of
+the cache directory whenever an subject is cached, read or deleted, and
+answers those queries from the ledger instead.
+
+The ledger is rebuilt from the cache directory when it does not exist. If
+files are added to or removed from the cache directory by other means, the
+ledger can be rebuilt with the cache reconciler.
+
+Possible values:
+    * True
+    * False
+
+Related options:
+    * ``subject_cache_driver``
+    * ``subject_cache_dir``
+
+""")),
+
+    cfg.IntOpt('subject_cache_prefetch_concurrency', default=10, min=1,
+               help=_("""
+The maximum number of subjects the cache-prefetcher fetches at the same time.
+
+The cache-prefetcher works through the queue in the order the subjects were
+queued, fetching up to this many of them concurrently. Each fetch holds a
+connection to the store the subject is kept in, so a high value lets a large
+prefetch saturate the store and starve requests served by the API nodes.
+
+Possible values:
+    * Any positive integer
+
+Related options:
+    * ``subject_cache_prefetch_bandwidth``
+
+""")),
+
+    cfg.IntOpt('subject_cache_prefetch_bandwidth', default=0, min=0,
+               help=_("""
+The maximum rate, in bytes per second, at which the cache-prefetcher reads
+from each store.
+
+The limit applies to all concurrent fetches from the same kind of store
+together, for example all subjects stored in swift, rather than to each
+fetch. The default value of 0 disables the limit.
+
+Possible values:
+    * 0
+    * Any positive integer
+
+Related options:
+    * ``subject_cache_prefetch_concurrency``
+
 """)),
 
     cfg.StrOpt('subject_cache_dir',
@@ -148,12 +315,106 @@ Possible values:
 Related options:
     * ``subject_cache_sqlite_db``
 
+""")),
+
+    cfg.BoolOpt('subject_cache_single_flight', default=False,
+                help=_("""
+Serve concurrent cache misses for an subject from a single cache fill.
+
+When this option is enabled and an subject is being written to the cache,
+other requests for the same subject handled by this process are served by
+following the growing file in the ``incomplete`` directory instead of
+opening their own connection to the backend store. Only one copy of the
+subject data is then pulled from the store per process, which is useful
+when many clients request the same cold subject at the same time.
+
+If the fill fails or is aborted, the requests following it fail as well.
+
+Possible values:
+    * True
+    * False
+
+Related options:
+    * ``subject_cache_dir``
+    * ``subject_cache_fill_wait_timeout``
+
+""")),
+    cfg.IntOpt('subject_cache_fill_wait_timeout', default=60, min=1,
+               help=_("""
+The number of seconds a request waits for new data from a cache fill.
+
+When ``subject_cache_single_flight`` is enabled, a request following the
+cache fill of an subject waits for the fill to write more data. If the
+fill writes nothing for this many seconds, for instance because its read
+from the backend store stalled, the request stops following it and no
+later request follows it either. A request that has not sent any data
+yet then reads the subject from the backend store itself, and one that
+has fails, so that the client can retry.
+
+Possible values:
+    * Positive integer
+
+Related options:
+    * ``subject_cache_single_flight``
+
 """)),
 ]
 
 CONF = cfg.CONF
 CONF.register_opts(subject_cache_opts)
 
+FILL_CHUNKSIZE = 64 * units.Ki
+
+# Cache fills currently in progress in this process, keyed by subject ID.
+_FILLS = {}
+_FILLS_LOCK = threading.Lock()
+
+
+class CacheFill(object):
+
+    """
+    Tracks the progress of an in-flight cache fill so that other
+    readers can follow the incomplete cache file as it grows.
+    """
+
+    def __init__(self, subject_id):
+        self.subject_id = subject_id
+        self.bytes_written = 0
+        self.finished = False
+        self.failed = False
+        self.cond = threading.Condition()
+
+    def advance(self, size):
+        with self.cond:
+            self.bytes_written += size
+            self.cond.notify_all()
+
+    def finish(self, failed=False):
+        with self.cond:
+            if not self.finished:
+                self.finished = True
+                self.failed = failed
+            self.cond.notify_all()
+
+    def wait(self, offset, timeout=None):
+        """
+        Block until more than ``offset`` bytes have been written or the
+        fill has finished, and return a tuple of the number of bytes
+        available, whether the fill is finished and whether it failed.
+        Returns None if neither happens within ``timeout`` seconds.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.cond:
+            while offset >= self.bytes_written and not self.finished:
+                if deadline is None:
+                    self.cond.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self.cond.wait(remaining)
+            return self.bytes_written, self.finished, self.failed
+
 
 class SubjectCache(object):
 
@@ -161,6 +422,8 @@ class SubjectCache(object):
 
     def __init__(self):
         self.init_driver()
+        self.admission_policy = policy.get_admission_policy()
+        self.eviction_policy = policy.get_eviction_policy()
 
     def init_driver(self):
         """
@@ -283,23 +546,25 @@ class SubjectCache(object):
             LOG.debug("Subject cache has free space, skipping prune...")
             return (0, 0)
 
-        overage = current_size - max_size
-        LOG.debug("Subject cache currently %(overage)d bytes over max "
-                  "size. Starting prune to max size of %(max_size)d ",
-                  {'overage': overage, 'max_size': max_size})
+        target_size = CONF.subject_cache_prune_target_size
+        if target_size is None or target_size > max_size:
+            target_size = max_size
+
+        overage = current_size - target_size
+        LOG.debug("Subject cache currently %(overage)d bytes over target "
+                  "size. Starting prune to target size of %(target_size)d ",
+                  {'overage': overage, 'target_size': target_size})
 
-        total_bytes_pruned = 0
-        total_files_pruned = 0
-        entry = self.driver.get_least_recently_accessed()
-        while entry and current_size > max_size:
-            subject_id, size = entry
+        victims = self.eviction_policy.get_prune_candidates(self.driver,
+                                                            overage)
+        for subject_id, size in victims:
             LOG.debug("Pruning '%(subject_id)s' to free %(size)d bytes",
                       {'subject_id': subject_id, 'size': size})
-            self.driver.delete_cached_subject(subject_id)
-            total_bytes_pruned = total_bytes_pruned + size
-            total_files_pruned = total_files_pruned + 1
-            current_size = current_size - size
-            entry = self.driver.get_least_recently_accessed()
+        self.driver.delete_cached_subjects(
+            [subject_id for subject_id, size in victims])
+
+        total_files_pruned = len(victims)
+        total_bytes_pruned = sum(size for subject_id, size in victims)
 
         LOG.debug("Pruning finished pruning. "
                   "Pruned %(total_files_pruned)d and "
@@ -315,6 +580,13 @@ class SubjectCache(object):
         """
         self.driver.clean(stall_time)
 
+    def reconcile(self):
+        """
+        Rebuilds any index the driver keeps about the cached subjects from
+        the cache directory.
+        """
+        self.driver.reconcile()
+
     def queue_subject(self, subject_id):
         """
         This adds a subject to be cache to the queue.
@@ -340,29 +612,76 @@ class SubjectCache(object):
         if not self.driver.is_cacheable(subject_id):
             return subject_iter
 
+        if not self.admission_policy.admit(subject_id):
+            return subject_iter
+
         LOG.debug("Tee'ing subject '%s' into cache", subject_id)
 
         return self.cache_tee_iter(subject_id, subject_iter, subject_checksum)
 
-    def cache_tee_iter(self, subject_id, subject_iter, subject_checksum):
-        try:
-            current_checksum = hashlib.md5()
+    def get_resumable_size(self, subject_id, subject_size):
+        """
+        Returns the number of bytes of an subject left in the cache by an
+        interrupted fetch that can be reused to resume caching it, or 0
+        if the subject has to be fetched from the start.
+
+        :param subject_id: Subject ID
+        :param subject_size: Size of the subject, in bytes
+        """
+        return self.driver.get_resumable_size(subject_id, subject_size)
 
-            with self.driver.open_for_write(subject_id) as cache_file:
+    def cache_tee_iter(self, subject_id, subject_iter, subject_checksum,
+                       offset=0):
+        """
+        Tee an subject iterator into the cache, verifying the checksum of
+        the cached data as it goes.
+
+        :param subject_id: Subject ID
+        :param subject_iter: Iterator retrieving subject chunks
+        :param subject_checksum: Checksum of subject
+        :param offset: Offset ``subject_iter`` starts at, when resuming an
+                       interrupted fetch; see ``get_resumable_size``
+        """
+        fill = None
+        try:
+            current_checksum = digest.get_checksum_digest()
+
+            with self.driver.open_for_write(subject_id,
+                                            offset=offset) as cache_file:
+                if offset:
+                    # The checksum covers the whole subject, so the part
+                    # kept from the earlier fetch has to be hashed first.
+                    cache_file.seek(0)
+                    for chunk in utils.chunkiter(cache_file, FILL_CHUNKSIZE):
+                        current_checksum.update(chunk)
+                    cache_file.seek(offset)
+                if CONF.subject_cache_single_flight:
+                    fill = self._register_fill(subject_id)
+                    if offset:
+                        fill.advance(offset)
                 for chunk in subject_iter:
                     try:
                         cache_file.write(chunk)
+                        if fill is not None:
+                            # Followers read the file directly, so the
+                            # chunk must reach it before it is announced.
+                            cache_file.flush()
+                            fill.advance(len(chunk))
                     finally:
                         current_checksum.update(chunk)
                         yield chunk
                 cache_file.flush()
 
                 if (subject_checksum and
-                        subject_checksum != current_checksum.hexdigest()):
+                        subject_checksum !=
+                        current_checksum.hexdigest('md5')):
                     msg = _("Checksum verification failed. Aborted "
                             "caching of subject '%s'.") % subject_id
                     raise exception.GlanceException(msg)
 
+            if fill is not None:
+                fill.finish()
+
         except exception.GlanceException as e:
             with excutils.save_and_reraise_exception():
                 # subject_iter has given us bad, (size_checked_iter has found a
@@ -375,10 +694,123 @@ class SubjectCache(object):
                           {'subject_id': subject_id,
                            'error': encodeutils.exception_to_unicode(e)})
 
+            if fill is not None:
+                fill.finish(failed=True)
+
             # If no checksum provided continue responding even if
             # caching failed.
             for chunk in subject_iter:
                 yield chunk
+        finally:
+            if fill is not None:
+                # A fill that did not run to completion (the consumer went
+                # away, or the data was bad) must not leave followers
+                # waiting on it.
+                fill.finish(failed=True)
+                self._unregister_fill(subject_id, fill)
+
+    @staticmethod
+    def _register_fill(subject_id):
+        fill = CacheFill(subject_id)
+        with _FILLS_LOCK:
+            _FILLS[subject_id] = fill
+        return fill
+
+    @staticmethod
+    def _unregister_fill(subject_id, fill):
+        with _FILLS_LOCK:
+            if _FILLS.get(subject_id) is fill:
+                del _FILLS[subject_id]
+
+    def get_fill_iter(self, subject_id):
+        """
+        Returns an iterator that follows the in-flight cache fill of an
+        subject in this process, or None if single-flight filling is
+        disabled or the subject is not currently being cached here.
+
+        :param subject_id: Subject ID
+        """
+        if not CONF.subject_cache_single_flight:
+            return None
+
+        with _FILLS_LOCK:
+            fill = _FILLS.get(subject_id)
+        if fill is None:
+            return None
+
+        timeout = CONF.subject_cache_fill_wait_timeout
+        if fill.wait(0, timeout) is None:
+            # Nothing has been sent yet, so the request can still be
+            # served from the backend store instead.
+            self._abandon_fill(subject_id, fill, timeout)
+            return None
+
+        # The file is opened before any response is sent, so that a fill
+        # which has failed in the meantime is served from the backend.
+        cache_file = self._open_fill_file(subject_id, fill)
+        if cache_file is None:
+            return None
+
+        LOG.debug("Following in-flight cache fill of subject '%s'",
+                  subject_id)
+        return self._follow_fill(subject_id, fill, cache_file)
+
+    def _open_fill_file(self, subject_id, fill):
+        """
+        Opens the file a fill is writing to, or returns None if the fill
+        has failed or the file is gone.
+        """
+        if fill.failed:
+            return None
+        incomplete_path = self.driver.get_subject_filepath(subject_id,
+                                                           'incomplete')
+        try:
+            return open(incomplete_path, 'rb')
+        except IOError:
+            pass
+        if fill.failed:
+            return None
+        # The fill may have been committed in the meantime, in which case
+        # the file has been moved to its final location.
+        try:
+            return open(self.driver.get_subject_filepath(subject_id), 'rb')
+        except IOError:
+            return None
+
+    def _abandon_fill(self, subject_id, fill, timeout):
+        """Stops later requests from following a stalled fill."""
+        LOG.warn(_LW("Cache fill of subject '%(subject_id)s' wrote nothing "
+                     "for %(timeout)d seconds, no longer following it."),
+                 {'subject_id': subject_id, 'timeout': timeout})
+        self._unregister_fill(subject_id, fill)
+
+    def _follow_fill(self, subject_id, fill, cache_file):
+        timeout = CONF.subject_cache_fill_wait_timeout
+        with cache_file:
+            offset = 0
+            while True:
+                progress = fill.wait(offset, timeout)
+                if progress is None:
+                    self._abandon_fill(subject_id, fill, timeout)
+                    msg = _("Cache fill of subject '%s' stalled while it "
+                            "was being followed.") % subject_id
+                    raise exception.GlanceException(msg)
+                available, finished, failed = progress
+                if failed:
+                    msg = _("Cache fill of subject '%s' failed while it "
+                            "was being followed.") % subject_id
+                    raise exception.GlanceException(msg)
+
+                while offset < available:
+                    chunk = cache_file.read(min(FILL_CHUNKSIZE,
+                                                available - offset))
+                    if not chunk:
+                        break
+                    offset += len(chunk)
+                    yield chunk
+
+                if finished:
+                    return
 
     def cache_subject_iter(self, subject_id, subject_iter, subject_checksum=None):
         """
@@ -393,8 +825,9 @@ class SubjectCache(object):
         if not self.driver.is_cacheable(subject_id):
             return False
 
-        for chunk in self.get_caching_iter(subject_id, subject_checksum,
-                                           subject_iter):
+        # Subjects cached explicitly bypass the admission policy.
+        for chunk in self.cache_tee_iter(subject_id, subject_iter,
+                                         subject_checksum):
             pass
         return True
 
@@ -17,6 +17,7 @@
 Base attribute driver class
 """
 
+import heapq
 import os.path
 
 from oslo_config import cfg
@@ -163,6 +164,13 @@ class Driver(object):
         """
         raise NotImplementedError
 
+    def reconcile(self):
+        """
+        Rebuild any index the driver keeps about the cached subjects from
+        the cache directory. Drivers that keep no such index need not
+        override this.
+        """
+
     def get_least_recently_accessed(self):
         """
         Return a tuple containing the subject_id and size of the least recently
@@ -170,15 +178,91 @@ class Driver(object):
         """
         raise NotImplementedError
 
-    def open_for_write(self, subject_id):
+    def get_prune_candidates(self, bytes_to_free):
+        """
+        Return a list of (subject_id, size) tuples for the least recently
+        accessed cached files, oldest first, whose combined size is at
+        least the supplied number of bytes (or every cached file, if the
+        cache is smaller than that).
+
+        Drivers should override this with something cheaper than the
+        default, which builds a heap from all the cached subject records.
+
+        :param bytes_to_free: Number of bytes the pruner needs to free
+        """
+        entries = [(entry['last_accessed'], entry['size'], entry['subject_id'])
+                   for entry in self.get_cached_subjects()]
+        return select_lru_victims(entries, bytes_to_free)
+
+    def delete_cached_subjects(self, subject_ids):
+        """
+        Removes the cached subject files and any attributes about the
+        subjects for all the supplied subject identifiers at once.
+
+        :param subject_ids: List of subject IDs
+        """
+        for subject_id in subject_ids:
+            self.delete_cached_subject(subject_id)
+
+    def get_resumable_size(self, subject_id, subject_size):
+        """
+        Return the size of the partial subject file left in the invalid
+        directory by an interrupted fetch, if it can be reused to resume
+        caching the subject, or 0 otherwise.
+
+        :param subject_id: Subject ID
+        :param subject_size: Size of the subject, in bytes
+        """
+        if not subject_size or not self.is_cacheable(subject_id):
+            return 0
+        path = self.get_subject_filepath(subject_id, 'invalid')
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return 0
+        # A file as large as the subject was fetched in full and then
+        # failed verification, so there is nothing in it worth keeping.
+        if size >= subject_size:
+            return 0
+        return size
+
+    def open_for_write(self, subject_id, offset=0):
         """
         Open a file for writing the subject file for an subject
         with supplied identifier.
 
         :param subject_id: Subject ID
+        :param offset: Number of bytes of the partial subject file in the
+                       invalid directory to keep; see ``get_resumable_size``
         """
         raise NotImplementedError
 
+    def open_incomplete_file(self, subject_id, offset=0):
+        """
+        Open the incomplete file for an subject for writing. When an offset
+        is supplied, the partial subject file is moved back from the invalid
+        directory and truncated to the offset, and writing carries on from
+        there.
+
+        :param subject_id: Subject ID
+        :param offset: Number of bytes of the partial subject file to keep
+        """
+        incomplete_path = self.get_subject_filepath(subject_id, 'incomplete')
+        if not offset:
+            return open(incomplete_path, 'wb')
+
+        os.rename(self.get_subject_filepath(subject_id, 'invalid'),
+                  incomplete_path)
+        cache_file = open(incomplete_path, 'r+b')
+        if os.fstat(cache_file.fileno()).st_size < offset:
+            cache_file.close()
+            msg = _("Partial cache file of subject '%s' is shorter than "
+                    "expected.") % subject_id
+            raise exception.GlanceException(msg)
+        cache_file.truncate(offset)
+        cache_file.seek(offset)
+        return cache_file
+
     def open_for_read(self, subject_id):
         """
         Open and yield file for reading the subject file for an subject
@@ -216,3 +300,25 @@ class Driver(object):
         into the queue.
         """
         raise NotImplementedError
+
+
+def select_lru_victims(entries, bytes_to_free):
+    """
+    Pop entries off a heap of (last_accessed, size, subject_id) tuples
+    until their combined size reaches the supplied number of bytes, and
+    return them as a list of (subject_id, size) tuples. Any other sort key
+    can take the place of last_accessed; entries with the lowest key are
+    popped first.
+
+    :param entries: List of (last_accessed, size, subject_id) tuples.
+                    The list is heapified in place.
+    :param bytes_to_free: Number of bytes the pruner needs to free
+    """
+    heapq.heapify(entries)
+    victims = []
+    freed = 0
+    while entries and freed < bytes_to_free:
+        last_accessed, size, subject_id = heapq.heappop(entries)
+        victims.append((subject_id, size))
+        freed += size
+    return victims
@@ -22,6 +22,7 @@ from contextlib import contextmanager
 import os
 import sqlite3
 import stat
+import threading
 import time
 
 from eventlet import sleep
@@ -54,6 +55,32 @@ Possible values:
 Related options:
     * ``subject_cache_dir``
 
+""")),
+
+    cfg.IntOpt('subject_cache_sqlite_flush_interval', default=0, min=0,
+               help=_("""
+The interval, in seconds, at which subject cache hit statistics are written
+to the sqlite database.
+
+Every time an subject is served from the cache, its hit count and last access
+time are updated in the sqlite database. By default, this happens
+synchronously on every cache hit. Setting this option to a positive value
+makes the sqlite driver buffer these updates in memory and write them in a
+single transaction at most once per interval, so that serving a cache hit
+does not take the sqlite write lock. Buffered updates are also written out
+before the statistics are read, for instance when listing cached subjects or
+pruning the cache.
+
+Buffered updates that have not been written out yet are lost if the process
+exits, so the statistics may slightly undercount hits.
+
+Possible values:
+    * 0 to write cache hit statistics synchronously
+    * Any positive integer
+
+Related options:
+    * ``subject_cache_driver``
+
 """)),
 ]
 
@@ -61,6 +88,7 @@ CONF = cfg.CONF
 CONF.register_opts(sqlite_opts)
 
 DEFAULT_SQL_CALL_TIMEOUT = 2
+MAX_IDLE_CONNECTIONS = 8
 
 
 class SqliteConnection(sqlite3.Connection):
@@ -89,10 +117,76 @@ class SqliteConnection(sqlite3.Connection):
         return self._timeout(lambda: sqlite3.Connection.execute(
             self, *args, **kwargs))
 
+    def executemany(self, *args, **kwargs):
+        return self._timeout(lambda: sqlite3.Connection.executemany(
+            self, *args, **kwargs))
+
     def commit(self):
         return self._timeout(lambda: sqlite3.Connection.commit(self))
 
 
+class ConnectionPool(object):
+
+    """
+    Per-process pool of connections to an SQLite database.
+
+    Keeping connections open avoids reconnecting and re-issuing the
+    connection PRAGMAs on every call, and lets each connection reuse its
+    cache of prepared statements. Connections are never shared with a
+    forked child: a pool used from a new process starts out empty.
+    """
+
+    def __init__(self, db_path, max_idle=MAX_IDLE_CONNECTIONS):
+        self.db_path = db_path
+        self.max_idle = max_idle
+        self.pid = os.getpid()
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False,
+                               factory=SqliteConnection)
+        conn.row_factory = sqlite3.Row
+        conn.text_factory = str
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute('PRAGMA count_changes = OFF')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        return conn
+
+    def get(self):
+        """Check out an idle connection, or open a new one."""
+        with self.lock:
+            if self.pid != os.getpid():
+                # NOTE: the connections were opened by our parent process
+                # and must not be used (or closed) from here.
+                self.idle = []
+                self.pid = os.getpid()
+            if self.idle:
+                return self.idle.pop()
+        return self._connect()
+
+    def put(self, conn):
+        """Return a connection to the pool, closing it if it is full."""
+        with self.lock:
+            if self.pid == os.getpid() and len(self.idle) < self.max_idle:
+                self.idle.append(conn)
+                return
+        conn.close()
+
+
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_connection_pool(db_path):
+    """Return the connection pool of this process for a database."""
+    with _POOLS_LOCK:
+        pool = _POOLS.get(db_path)
+        if pool is None:
+            pool = _POOLS[db_path] = ConnectionPool(db_path)
+        return pool
+
+
 def dict_factory(cur, row):
     return {col[0]: row[idx] for idx, col in enumerate(cur.description)}
 
@@ -116,12 +210,20 @@ class Driver(base.Driver):
         # Create the SQLite database that will hold our cache attributes
         self.initialize_db()
 
+        self.pool = get_connection_pool(self.db_path)
+        self._pending_hits = {}
+        self._pending_lock = threading.Lock()
+        self._last_flush = time.time()
+
     def initialize_db(self):
         db = CONF.subject_cache_sqlite_db
         self.db_path = os.path.join(self.base_dir, db)
         try:
             conn = sqlite3.connect(self.db_path, check_same_thread=False,
                                    factory=SqliteConnection)
+            # Write-ahead logging lets readers proceed while a hit count
+            # update or a new cache entry is being written.
+            conn.execute('PRAGMA journal_mode = WAL')
             conn.executescript("""
                 CREATE TABLE IF NOT EXISTS cached_subjects (
                     subject_id TEXT PRIMARY KEY,
@@ -146,8 +248,6 @@ class Driver(base.Driver):
         """
         sizes = []
         for path in self.get_cache_files(self.base_dir):
-            if path == self.db_path:
-                continue
             file_info = os.stat(path)
             sizes.append(file_info[stat.ST_SIZE])
         return sum(sizes)
@@ -161,6 +261,7 @@ class Driver(base.Driver):
         if not self.is_cached(subject_id):
             return 0
 
+        self.flush_hits()
         hits = 0
         with self.get_db() as db:
             cur = db.execute("""SELECT hits FROM cached_subjects
@@ -174,6 +275,7 @@ class Driver(base.Driver):
         Returns a list of records about cached subjects.
         """
         LOG.debug("Gathering cached subject entries.")
+        self.flush_hits()
         with self.get_db() as db:
             cur = db.execute("""SELECT
                              subject_id, hits, last_accessed, last_modified, size
@@ -225,6 +327,9 @@ class Driver(base.Driver):
         """
         Removes all cached subject files and any attributes about the subjects
         """
+        with self._pending_lock:
+            self._pending_hits.clear()
+
         deleted = 0
         with self.get_db() as db:
             for path in self.get_cache_files(self.base_dir):
@@ -240,6 +345,9 @@ class Driver(base.Driver):
 
         :param subject_id: Subject ID
         """
+        with self._pending_lock:
+            self._pending_hits.pop(subject_id, None)
+
         path = self.get_subject_filepath(subject_id)
         with self.get_db() as db:
             delete_cached_file(path)
@@ -286,6 +394,7 @@ class Driver(base.Driver):
         Return a tuple containing the subject_id and size of the least recently
         accessed cached file, or None if no cached files.
         """
+        self.flush_hits()
         with self.get_db() as db:
             cur = db.execute("""SELECT subject_id FROM cached_subjects
                              ORDER BY last_accessed LIMIT 1""")
@@ -303,13 +412,65 @@ class Driver(base.Driver):
             size = 0
         return subject_id, size
 
+    def get_prune_candidates(self, bytes_to_free):
+        """
+        Return a list of (subject_id, size) tuples for the least recently
+        accessed cached files, oldest first, whose combined size is at
+        least the supplied number of bytes.
+
+        The candidates are read in a single ordered scan of the cache
+        table, which stops as soon as enough bytes have been found.
+
+        :param bytes_to_free: Number of bytes the pruner needs to free
+        """
+        victims = []
+        freed = 0
+        if bytes_to_free <= 0:
+            return victims
+
+        self.flush_hits()
+        with self.get_db() as db:
+            cur = db.execute("""SELECT subject_id, size FROM cached_subjects
+                             ORDER BY last_accessed""")
+            for subject_id, size in cur:
+                victims.append((subject_id, size))
+                freed += size
+                if freed >= bytes_to_free:
+                    break
+        return victims
+
+    def delete_cached_subjects(self, subject_ids):
+        """
+        Removes the cached subject files and any attributes about the
+        subjects for all the supplied subject identifiers, deleting their
+        records in a single transaction.
+
+        :param subject_ids: List of subject IDs
+        """
+        if not subject_ids:
+            return
+
+        with self._pending_lock:
+            for subject_id in subject_ids:
+                self._pending_hits.pop(subject_id, None)
+
+        with self.get_db() as db:
+            for subject_id in subject_ids:
+                delete_cached_file(self.get_subject_filepath(subject_id))
+            db.executemany("""DELETE FROM cached_subjects
+                           WHERE subject_id = ?""",
+                           [(subject_id, ) for subject_id in subject_ids])
+            db.commit()
+
     @contextmanager
-    def open_for_write(self, subject_id):
+    def open_for_write(self, subject_id, offset=0):
         """
         Open a file for writing the subject file for an subject
         with supplied identifier.
 
         :param subject_id: Subject ID
+        :param offset: Number of bytes of the partial subject file in the
+                       invalid directory to keep
         """
         incomplete_path = self.get_subject_filepath(subject_id, 'incomplete')
 
@@ -353,7 +514,8 @@ class Driver(base.Driver):
                 db.commit()
 
         try:
-            with open(incomplete_path, 'wb') as cache_file:
+            with self.open_incomplete_file(subject_id,
+                                           offset) as cache_file:
                 yield cache_file
         except Exception as e:
             with excutils.save_and_reraise_exception():
@@ -380,36 +542,79 @@ class Driver(base.Driver):
         path = self.get_subject_filepath(subject_id)
         with open(path, 'rb') as cache_file:
             yield cache_file
+        self.record_hit(subject_id)
+
+    def record_hit(self, subject_id):
+        """
+        Increment the hit count and update the last access time of a
+        cached subject, either right away or, when
+        ``subject_cache_sqlite_flush_interval`` is set, by buffering the
+        update until the next flush.
+
+        :param subject_id: Subject ID
+        """
         now = time.time()
+        interval = CONF.subject_cache_sqlite_flush_interval
+        if not interval:
+            with self.get_db() as db:
+                db.execute("""UPDATE cached_subjects
+                           SET hits = hits + 1, last_accessed = ?
+                           WHERE subject_id = ?""",
+                           (now, subject_id))
+                db.commit()
+            return
+
+        with self._pending_lock:
+            hits, last_accessed = self._pending_hits.get(subject_id, (0, now))
+            self._pending_hits[subject_id] = (hits + 1, now)
+            due = now - self._last_flush >= interval
+        if due:
+            self.flush_hits()
+
+    def flush_hits(self):
+        """
+        Write out any buffered cache hit statistics in a single
+        transaction.
+        """
+        with self._pending_lock:
+            pending = self._pending_hits
+            self._pending_hits = {}
+            self._last_flush = time.time()
+        if not pending:
+            return
+
+        LOG.debug("Flushing hit statistics of %d cached subjects",
+                  len(pending))
         with self.get_db() as db:
-            db.execute("""UPDATE cached_subjects
-                       SET hits = hits + 1, last_accessed = ?
-                       WHERE subject_id = ?""",
-                       (now, subject_id))
+            db.executemany("""UPDATE cached_subjects
+                           SET hits = hits + ?, last_accessed = ?
+                           WHERE subject_id = ?""",
+                           [(hits, last_accessed, subject_id)
+                            for subject_id, (hits, last_accessed)
+                            in pending.items()])
             db.commit()
 
     @contextmanager
     def get_db(self):
         """
-        Returns a context manager that produces a database connection that
-        self-closes and calls rollback if an error occurs while using the
-        database connection
+        Returns a context manager that produces a pooled database
+        connection that is returned to the pool afterwards, and that calls
+        rollback and is discarded if an error occurs while using it
         """
-        conn = sqlite3.connect(self.db_path, check_same_thread=False,
-                               factory=SqliteConnection)
-        conn.row_factory = sqlite3.Row
-        conn.text_factory = str
-        conn.execute('PRAGMA synchronous = NORMAL')
-        conn.execute('PRAGMA count_changes = OFF')
-        conn.execute('PRAGMA temp_store = MEMORY')
+        conn = self.pool.get()
+        reusable = False
         try:
             yield conn
+            reusable = True
         except sqlite3.DatabaseError as e:
             msg = _LE("Error executing SQLite call. Got error: %s") % e
             LOG.error(msg)
             conn.rollback()
         finally:
-            conn.close()
+            if reusable:
+                self.pool.put(conn)
+            else:
+                conn.close()
 
     def queue_subject(self, subject_id):
         """
@@ -489,9 +694,15 @@ class Driver(base.Driver):
 
         :param basepath: Directory to look in for cache files
         """
+        # NOTE: the write-ahead log and shared memory index of the
+        # database live next to it and are not cache files either.
+        db_files = (self.db_path,
+                    self.db_path + '-wal',
+                    self.db_path + '-shm',
+                    self.db_path + '-journal')
         for fname in os.listdir(basepath):
             path = os.path.join(basepath, fname)
-            if path != self.db_path and os.path.isfile(path):
+            if path not in db_files and os.path.isfile(path):
                 yield path
 
 
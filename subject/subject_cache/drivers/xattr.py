@@ -49,23 +49,32 @@ $subject_cache_dir/
   incomplete/
   invalid/
   queue/
+  ledger/
+
+The ``ledger`` subdirectory only exists when ``subject_cache_xattr_ledger``
+is enabled. It holds an append-only journal of cache entries, which lets
+the size of the cache and its least recently accessed entries be found
+without stat'ing every cached file.
 """
 
 from __future__ import absolute_import
 from contextlib import contextmanager
 import errno
+import fcntl
 import os
 import stat
 import time
 
 from oslo_config import cfg
 from oslo_log import log as logging
+from oslo_serialization import jsonutils
 from oslo_utils import encodeutils
 from oslo_utils import excutils
 import six
 import xattr
 
 from subject.common import exception
+from subject.common import utils
 from subject.i18n import _, _LI, _LW
 from subject.subject_cache.drivers import base
 
@@ -73,6 +82,164 @@ LOG = logging.getLogger(__name__)
 
 CONF = cfg.CONF
 
+# The journal is rewritten from the in-memory state once it holds this
+# many records and more than twice as many records as cache entries.
+LEDGER_COMPACT_MIN_RECORDS = 1024
+
+
+class Ledger(object):
+
+    """
+    Append-only journal of the size, modification time, access time and
+    hit count of cached subjects.
+
+    Every process using the cache appends records to the journal and
+    replays the records appended by others before answering a query, so
+    the total size of the cache is known without stat'ing any file. The
+    journal is compacted by rewriting it to a temporary file and renaming
+    that over it; readers notice the new inode and replay it from the
+    start. A record torn by a crash is skipped on replay.
+    """
+
+    def __init__(self, ledger_dir):
+        self.path = os.path.join(ledger_dir, 'journal')
+        self.lock_path = os.path.join(ledger_dir, 'lock')
+        utils.safe_mkdirs(ledger_dir)
+        self._reset()
+
+    def _reset(self, inode=None):
+        # subject_id -> [size, last_modified, last_accessed, hits]
+        self.entries = {}
+        self.total_size = 0
+        self.records = 0
+        self.offset = 0
+        self.inode = inode
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    @contextmanager
+    def _locked(self, operation):
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _append(self, record):
+        line = (jsonutils.dumps(record) + '\n').encode('utf-8')
+        with self._locked(fcntl.LOCK_SH):
+            with open(self.path, 'ab') as journal:
+                journal.write(line)
+
+    def _apply(self, line):
+        try:
+            record = jsonutils.loads(line)
+            op, subject_id = record[0], record[1]
+        except (ValueError, TypeError, IndexError):
+            LOG.debug("Skipping corrupt subject cache ledger record")
+            return
+
+        entry = self.entries.get(subject_id)
+        if op == 'C':
+            # An subject was cached: [op, id, size, mtime]
+            self._remove(subject_id)
+            size, mtime = record[2], record[3]
+            self.entries[subject_id] = [size, mtime, mtime, 0]
+            self.total_size += size
+        elif op == 'S':
+            # Snapshot written by compaction: [op, id, size, mtime,
+            # atime, hits]
+            self._remove(subject_id)
+            self.entries[subject_id] = list(record[2:6])
+            self.total_size += record[2]
+        elif op == 'R' and entry is not None:
+            # An subject was read: [op, id, atime]
+            entry[2] = max(entry[2], record[2])
+            entry[3] += 1
+        elif op == 'D':
+            # An subject was deleted: [op, id]
+            self._remove(subject_id)
+
+    def _remove(self, subject_id):
+        entry = self.entries.pop(subject_id, None)
+        if entry is not None:
+            self.total_size -= entry[0]
+
+    def refresh(self):
+        """Replay the records appended since the last refresh."""
+        self._replay()
+        if (self.records > LEDGER_COMPACT_MIN_RECORDS and
+                self.records > 2 * len(self.entries)):
+            self.compact()
+
+    def _replay(self):
+        try:
+            journal = open(self.path, 'rb')
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            self._reset()
+            return
+
+        with journal:
+            inode = os.fstat(journal.fileno()).st_ino
+            if inode != self.inode:
+                self._reset(inode)
+            journal.seek(self.offset)
+            data = journal.read()
+
+        # Only complete records are consumed; a trailing partial record
+        # is left for the next refresh.
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            if line:
+                self._apply(line.decode('utf-8'))
+                self.records += 1
+        self.offset += end
+
+    def _rewrite(self, entries):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as journal:
+            for subject_id, entry in six.iteritems(entries):
+                record = ['S', subject_id] + list(entry)
+                journal.write((jsonutils.dumps(record) + '\n').encode(
+                    'utf-8'))
+            journal.flush()
+            os.fsync(journal.fileno())
+        os.rename(tmp_path, self.path)
+
+    def compact(self):
+        """Rewrite the journal so it holds one record per cache entry."""
+        with self._locked(fcntl.LOCK_EX):
+            # Pick up anything appended before we took the lock.
+            self._replay()
+            self._rewrite(self.entries)
+        LOG.debug("Compacted subject cache ledger to %d records",
+                  len(self.entries))
+        self._replay()
+
+    def rebuild(self, entries):
+        """
+        Replace the journal with the supplied entries.
+
+        :param entries: Dict mapping subject IDs to lists of size,
+                        modification time, access time and hits
+        """
+        with self._locked(fcntl.LOCK_EX):
+            self._rewrite(entries)
+        self._replay()
+
+    def record_commit(self, subject_id, size, mtime):
+        self._append(['C', str(subject_id), size, mtime])
+
+    def record_access(self, subject_id, atime):
+        self._append(['R', str(subject_id), atime])
+
+    def record_delete(self, subject_id):
+        self._append(['D', str(subject_id)])
+
 
 class Driver(base.Driver):
 
@@ -118,10 +285,20 @@ class Driver(base.Driver):
             if os.path.exists(fake_subject_filepath):
                 os.unlink(fake_subject_filepath)
 
+        self.ledger = None
+        if CONF.subject_cache_xattr_ledger:
+            self.ledger = Ledger(os.path.join(self.base_dir, 'ledger'))
+            if not self.ledger.exists():
+                self.reconcile()
+
     def get_cache_size(self):
         """
         Returns the total size in bytes of the subject cache.
         """
+        if self.ledger is not None:
+            self.ledger.refresh()
+            return self.ledger.total_size
+
         sizes = []
         for path in get_all_regular_files(self.base_dir):
             file_info = os.stat(path)
@@ -145,6 +322,16 @@ class Driver(base.Driver):
         Returns a list of records about cached subjects.
         """
         LOG.debug("Gathering cached subject entries.")
+        if self.ledger is not None:
+            self.ledger.refresh()
+            return [{'subject_id': subject_id,
+                     'size': size,
+                     'last_modified': last_modified,
+                     'last_accessed': last_accessed,
+                     'hits': hits}
+                    for subject_id, (size, last_modified, last_accessed, hits)
+                    in sorted(six.iteritems(self.ledger.entries))]
+
         entries = []
         for path in get_all_regular_files(self.base_dir):
             subject_id = os.path.basename(path)
@@ -157,7 +344,7 @@ class Driver(base.Driver):
             entry['hits'] = self.get_hit_count(subject_id)
 
             entries.append(entry)
-        entries.sort()  # Order by ID
+        entries.sort(key=lambda entry: entry['subject_id'])  # Order by ID
         return entries
 
     def is_cached(self, subject_id):
@@ -205,6 +392,8 @@ class Driver(base.Driver):
         for path in get_all_regular_files(self.base_dir):
             delete_cached_file(path)
             deleted += 1
+        if self.ledger is not None:
+            self.ledger.rebuild({})
         return deleted
 
     def delete_cached_subject(self, subject_id):
@@ -215,6 +404,8 @@ class Driver(base.Driver):
         """
         path = self.get_subject_filepath(subject_id)
         delete_cached_file(path)
+        if self.ledger is not None:
+            self.ledger.record_delete(subject_id)
 
     def delete_all_queued_subjects(self):
         """
@@ -240,6 +431,10 @@ class Driver(base.Driver):
         Return a tuple containing the subject_id and size of the least recently
         accessed cached file, or None if no cached files.
         """
+        if self.ledger is not None:
+            victims = self.get_prune_candidates(1)
+            return victims[0] if victims else None
+
         stats = []
         for path in get_all_regular_files(self.base_dir):
             file_info = os.stat(path)
@@ -253,13 +448,44 @@ class Driver(base.Driver):
         stats.sort()
         return os.path.basename(stats[0][2]), stats[0][1]
 
+    def get_prune_candidates(self, bytes_to_free):
+        """
+        Return a list of (subject_id, size) tuples for the least recently
+        accessed cached files, oldest first, whose combined size is at
+        least the supplied number of bytes.
+
+        The cache directory is scanned once and the candidates are popped
+        off a heap ordered by access time.
+
+        :param bytes_to_free: Number of bytes the pruner needs to free
+        """
+        if bytes_to_free <= 0:
+            return []
+
+        if self.ledger is not None:
+            self.ledger.refresh()
+            stats = [(last_accessed, size, subject_id)
+                     for subject_id, (size, last_modified, last_accessed, hits)
+                     in six.iteritems(self.ledger.entries)]
+            return base.select_lru_victims(stats, bytes_to_free)
+
+        stats = []
+        for path in get_all_regular_files(self.base_dir):
+            file_info = os.stat(path)
+            stats.append((file_info[stat.ST_ATIME],  # access time
+                          file_info[stat.ST_SIZE],   # size in bytes
+                          os.path.basename(path)))   # subject ID
+        return base.select_lru_victims(stats, bytes_to_free)
+
     @contextmanager
-    def open_for_write(self, subject_id):
+    def open_for_write(self, subject_id, offset=0):
         """
         Open a file for writing the subject file for an subject
         with supplied identifier.
 
         :param subject_id: Subject ID
+        :param offset: Number of bytes of the partial subject file in the
+                       invalid directory to keep
         """
         incomplete_path = self.get_subject_filepath(subject_id, 'incomplete')
 
@@ -276,6 +502,11 @@ class Driver(base.Driver):
                            final_path=final_path))
             os.rename(incomplete_path, final_path)
 
+            if self.ledger is not None:
+                self.ledger.record_commit(subject_id,
+                                          os.path.getsize(final_path),
+                                          time.time())
+
             # Make sure that we "pop" the subject from the queue...
             if self.is_queued(subject_id):
                 LOG.debug("Removing subject '%s' from queue after "
@@ -295,7 +526,8 @@ class Driver(base.Driver):
             os.rename(incomplete_path, invalid_path)
 
         try:
-            with open(incomplete_path, 'wb') as cache_file:
+            with self.open_incomplete_file(subject_id,
+                                           offset) as cache_file:
                 yield cache_file
         except Exception as e:
             with excutils.save_and_reraise_exception():
@@ -324,6 +556,28 @@ class Driver(base.Driver):
             yield cache_file
         path = self.get_subject_filepath(subject_id)
         inc_xattr(path, 'hits', 1)
+        if self.ledger is not None:
+            self.ledger.record_access(subject_id, time.time())
+
+    def reconcile(self):
+        """
+        Rebuild the ledger, if one is used, from the files in the cache
+        directory.
+        """
+        if self.ledger is None:
+            return
+
+        entries = {}
+        for path in get_all_regular_files(self.base_dir):
+            file_info = os.stat(path)
+            entries[os.path.basename(path)] = [
+                file_info[stat.ST_SIZE],
+                file_info[stat.ST_MTIME],
+                file_info[stat.ST_ATIME],
+                int(get_xattr(path, 'hits', default=0))]
+        self.ledger.rebuild(entries)
+        LOG.info(_LI("Rebuilt subject cache ledger with %d entries"),
+                 len(entries))
 
     def queue_subject(self, subject_id):
         """
@@ -0,0 +1,190 @@
+# Copyright 2011 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Admission and eviction policies for the Subject Cache
+
+The admission policy decides whether an subject that was not found in the
+cache is tee'd into it as it is downloaded. The eviction policy decides
+which cached subjects the cache-pruner removes when the cache has grown
+beyond its maximum size.
+"""
+
+import time
+
+from oslo_config import cfg
+from oslo_log import log as logging
+
+from subject.subject_cache.drivers import base
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+# Counters saturate at this value, as the 4-bit counters of TinyLFU do.
+SKETCH_MAX_COUNT = 15
+SKETCH_DEPTH = 4
+SKETCH_WIDTH = 4096
+
+
+class FrequencySketch(object):
+
+    """
+    A count-min sketch estimating how often each subject was requested
+    recently, in constant memory.
+
+    After ``sample_size`` requests have been recorded every counter is
+    halved, so that subjects which were popular a long time ago do not
+    keep their counts forever.
+    """
+
+    def __init__(self, width=SKETCH_WIDTH, depth=SKETCH_DEPTH):
+        self.width = width
+        self.depth = depth
+        self.rows = [[0] * width for i in range(depth)]
+        self.sample_size = 10 * width
+        self.samples = 0
+
+    def _indexes(self, key):
+        return [hash((seed, key)) % self.width for seed in range(self.depth)]
+
+    def estimate(self, key):
+        """Returns the estimated number of recent requests for key."""
+        return min(row[index]
+                   for row, index in zip(self.rows, self._indexes(key)))
+
+    def increment(self, key):
+        """Records a request for key."""
+        indexes = self._indexes(key)
+        count = min(row[index] for row, index in zip(self.rows, indexes))
+        if count < SKETCH_MAX_COUNT:
+            # Conservative update: only the counters at the minimum can be
+            # exact, so only those are raised.
+            for row, index in zip(self.rows, indexes):
+                if row[index] == count:
+                    row[index] += 1
+
+        self.samples += 1
+        if self.samples >= self.sample_size:
+            self.reset()
+
+    def reset(self):
+        """Halves every counter."""
+        for row in self.rows:
+            for index, count in enumerate(row):
+                row[index] = count >> 1
+        self.samples //= 2
+
+
+class AdmissionPolicy(object):
+
+    """Admits every subject into the cache."""
+
+    def admit(self, subject_id):
+        """
+        Records a cache miss for an subject and returns True if the subject
+        should be tee'd into the cache.
+
+        :param subject_id: Subject ID
+        """
+        return True
+
+
+class TinyLFUAdmission(AdmissionPolicy):
+
+    """
+    Admits an subject into the cache only once it has missed the cache
+    ``subject_cache_admission_min_hits`` times recently, so that subjects
+    downloaded just once do not push out subjects that are downloaded
+    over and over.
+    """
+
+    def __init__(self):
+        self.sketch = FrequencySketch()
+
+    def admit(self, subject_id):
+        self.sketch.increment(subject_id)
+        frequency = self.sketch.estimate(subject_id)
+        if frequency < CONF.subject_cache_admission_min_hits:
+            LOG.debug("Not admitting subject '%(subject_id)s' into the cache "
+                      "after %(frequency)d recent requests",
+                      {'subject_id': subject_id, 'frequency': frequency})
+            return False
+        return True
+
+
+class EvictionPolicy(object):
+
+    """Evicts the least recently accessed subjects first."""
+
+    def get_prune_candidates(self, driver, bytes_to_free):
+        """
+        Return a list of (subject_id, size) tuples for the cached subjects
+        to evict, in order, whose combined size is at least the supplied
+        number of bytes (or every cached subject, if the cache is smaller
+        than that).
+
+        :param driver: The subject cache driver
+        :param bytes_to_free: Number of bytes the pruner needs to free
+        """
+        return driver.get_prune_candidates(bytes_to_free)
+
+
+class GDSFEviction(EvictionPolicy):
+
+    """
+    Evicts the subjects with the fewest hits per byte first, in the manner
+    of Greedy-Dual-Size-Frequency, so that one large subject is given up
+    before many small ones that are used as often.
+
+    GDSF ages entries with an inflation value that rises as entries are
+    evicted. The drivers record when each subject was last accessed but no
+    per-entry inflation value, so the score is aged by halving it every
+    ``subject_cache_gdsf_half_life`` seconds since the last access instead.
+    """
+
+    def score(self, entry, now):
+        age = max(now - entry['last_accessed'], 0)
+        frequency = (entry['hits'] or 0) + 1
+        return (float(frequency) / max(entry['size'], 1) *
+                0.5 ** (age / float(CONF.subject_cache_gdsf_half_life)))
+
+    def get_prune_candidates(self, driver, bytes_to_free):
+        now = time.time()
+        entries = [(self.score(entry, now), entry['size'], entry['subject_id'])
+                   for entry in driver.get_cached_subjects()]
+        return base.select_lru_victims(entries, bytes_to_free)
+
+
+ADMISSION_POLICIES = {
+    'always': AdmissionPolicy,
+    'tinylfu': TinyLFUAdmission,
+}
+
+EVICTION_POLICIES = {
+    'lru': EvictionPolicy,
+    'gdsf': GDSFEviction,
+}
+
+
+def get_admission_policy():
+    """Returns the configured admission policy."""
+    name = CONF.subject_cache_admission_policy.lower()
+    return ADMISSION_POLICIES[name]()
+
+
+def get_eviction_policy():
+    """Returns the configured eviction policy."""
+    name = CONF.subject_cache_eviction_policy.lower()
+    return EVICTION_POLICIES[name]()
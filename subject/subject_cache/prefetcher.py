@@ -17,25 +17,92 @@
 Prefetches subjects into the Subject Cache
 """
 
+import time
+
 import eventlet
 import subject_store
+from oslo_config import cfg
 from oslo_log import log as logging
+from oslo_utils import encodeutils
 
 from subject.common import exception
 from subject import context
-from subject.i18n import _LI, _LW
+from subject.i18n import _LE, _LI, _LW
 from subject.subject_cache import base
 import subject.registry.client.v1.api as registry
 
+CONF = cfg.CONF
 LOG = logging.getLogger(__name__)
 
 
+class BandwidthLimiter(object):
+
+    """
+    Paces the chunks read by any number of concurrent fetches so that
+    together they do not exceed a fixed number of bytes per second.
+    """
+
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self.next_slot = time.time()
+
+    def limit(self, data_iter):
+        for chunk in data_iter:
+            now = time.time()
+            # Reserve a slot for this chunk before sleeping, so that
+            # fetches sharing the limiter queue up behind each other.
+            start = max(self.next_slot, now)
+            self.next_slot = start + len(chunk) / self.rate
+            if start > now:
+                eventlet.sleep(start - now)
+            yield chunk
+
+
 class Prefetcher(base.CacheApp):
 
     def __init__(self):
         super(Prefetcher, self).__init__()
         registry.configure_registry_client()
         registry.configure_registry_admin_creds()
+        self.limiters = {}
+
+    def get_limiter(self, location):
+        """
+        Returns the bandwidth limiter shared by all fetches from the store
+        of the supplied location, or None if bandwidth is not limited.
+        """
+        rate = CONF.subject_cache_prefetch_bandwidth
+        if not rate:
+            return None
+        scheme = location.split(':', 1)[0]
+        if scheme not in self.limiters:
+            self.limiters[scheme] = BandwidthLimiter(rate)
+        return self.limiters[scheme]
+
+    def get_subject_data(self, subject_id, subject_meta, ctx):
+        """
+        Returns a tuple of an iterator over the subject data still to be
+        cached and the offset it starts at. Where the store supports it,
+        a fetch interrupted earlier is resumed rather than started over.
+        """
+        location = subject_meta['location']
+        offset = self.cache.get_resumable_size(subject_id,
+                                               subject_meta.get('size'))
+        if offset:
+            try:
+                subject_data, subject_size = subject_store.get_from_backend(
+                    location, offset=offset, context=ctx)
+                LOG.info(_LI("Resuming fetch of subject '%(subject_id)s' "
+                             "at byte %(offset)d"),
+                         {'subject_id': subject_id, 'offset': offset})
+                return subject_data, offset
+            except subject_store.StoreRandomGetNotSupported:
+                LOG.debug("Store does not support ranged reads, fetching "
+                          "subject '%s' from the start", subject_id)
+
+        subject_data, subject_size = subject_store.get_from_backend(
+            location, context=ctx)
+        return subject_data, 0
 
     def fetch_subject_into_cache(self, subject_id):
         ctx = context.RequestContext(is_admin=True, show_deleted=True)
@@ -51,16 +118,32 @@ class Prefetcher(base.CacheApp):
             LOG.warn(_LW("No metadata found for subject '%s'") % subject_id)
             return False
 
-        location = subject_meta['location']
-        subject_data, subject_size = subject_store.get_from_backend(location,
-                                                               context=ctx)
+        subject_data, offset = self.get_subject_data(subject_id, subject_meta,
+                                                     ctx)
+        limiter = self.get_limiter(subject_meta['location'])
+        if limiter is not None:
+            subject_data = limiter.limit(subject_data)
+
         LOG.debug("Caching subject '%s'", subject_id)
         cache_tee_iter = self.cache.cache_tee_iter(subject_id, subject_data,
-                                                   subject_meta['checksum'])
+                                                   subject_meta['checksum'],
+                                                   offset=offset)
         # Subject is tee'd into cache and checksum verified
         # as we iterate
         list(cache_tee_iter)
-        return True
+        # The tee carries on without caching when it fails to write to the
+        # cache, so check whether the subject actually made it in.
+        return self.cache.is_cached(subject_id)
+
+    def _fetch_subject(self, subject_id):
+        try:
+            return self.fetch_subject_into_cache(subject_id)
+        except Exception as e:
+            LOG.error(_LE("Failed to cache subject '%(subject_id)s': "
+                          "%(error)s"),
+                      {'subject_id': subject_id,
+                       'error': encodeutils.exception_to_unicode(e)})
+            return False
 
     def run(self):
 
@@ -72,8 +155,12 @@ class Prefetcher(base.CacheApp):
         num_subjects = len(subjects)
         LOG.debug("Found %d subjects to prefetch", num_subjects)
 
-        pool = eventlet.GreenPool(num_subjects)
-        results = pool.imap(self.fetch_subject_into_cache, subjects)
+        # The queue is ordered oldest first and the pool starts fetches
+        # in that order as slots free up, so the subjects that have waited
+        # longest are fetched first.
+        pool = eventlet.GreenPool(min(num_subjects,
+                                      CONF.subject_cache_prefetch_concurrency))
+        results = pool.imap(self._fetch_subject, subjects)
         successes = sum([1 for r in results if r is True])
         if successes != num_subjects:
             LOG.warn(_LW("Failed to successfully cache all "
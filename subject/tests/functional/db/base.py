@@ -26,6 +26,7 @@ from six.moves import reduce
 
 from subject.common import exception
 from subject.common import timeutils
+from subject.common import utils
 from subject import context
 from subject.tests import functional
 import subject.tests.functional.db as db_tests
@@ -334,6 +335,44 @@ class DriverTests(object):
         self.assertEqual('bar', properties['foo']['value'])
         self.assertTrue(properties['foo']['deleted'])
 
+    def test_subject_update_changed_properties(self):
+        fixture = {'properties': {'foo': 'baz', 'far': 'bof', 'ping': 'pong'}}
+        subject = self.db_api.subject_update(self.adm_context, UUID1, fixture)
+        actual = {p['name']: p['value'] for p in subject['properties']
+                  if not p['deleted']}
+        self.assertEqual(fixture['properties'], actual)
+
+        subject = self.db_api.subject_get(self.adm_context, UUID1)
+        actual = {p['name']: p['value'] for p in subject['properties']
+                  if not p['deleted']}
+        self.assertEqual(fixture['properties'], actual)
+
+    def test_subject_update_purge_some_properties(self):
+        fixture = {'properties': {'foo': 'bar'}}
+        subject = self.db_api.subject_update(self.adm_context, UUID1,
+                                             fixture, purge_props=True)
+        properties = {p['name']: p for p in subject['properties']}
+        self.assertFalse(properties['foo']['deleted'])
+        self.assertEqual('bar', properties['foo']['value'])
+        self.assertTrue(properties['far']['deleted'])
+
+    def test_subject_update_revives_deleted_property(self):
+        self.db_api.subject_update(self.adm_context, UUID1,
+                                   {'properties': {}}, purge_props=True)
+        fixture = {'properties': {'foo': 'baz'}}
+        subject = self.db_api.subject_update(self.adm_context, UUID1, fixture)
+        properties = {p['name']: p for p in subject['properties']}
+        self.assertFalse(properties['foo']['deleted'])
+        self.assertEqual('baz', properties['foo']['value'])
+        self.assertTrue(properties['far']['deleted'])
+
+    def test_subject_update_tags(self):
+        self.db_api.subject_tag_set_all(self.context, UUID1, ['ping', 'pong'])
+        self.db_api.subject_update(self.adm_context, UUID1,
+                                   {'tags': ['pong', 'foo']})
+        tags = self.db_api.subject_tag_get_all(self.context, UUID1)
+        self.assertEqual(['pong', 'foo'], tags)
+
     def test_subject_update_bad_name(self):
         fixture = {'name': u'A new name with forbidden symbol \U0001f62a'}
         self.assertRaises(exception.Invalid, self.db_api.subject_update,
@@ -359,6 +398,40 @@ class DriverTests(object):
         self.assertRaises(exception.Invalid, self.db_api.subject_update,
                           self.adm_context, UUID1, fixture)
 
+    def test_subject_update_location_changes(self):
+        locations = [{'url': u, 'metadata': {}, 'status': 'active'}
+                     for u in ('a', 'b', 'c')]
+        subject = self.db_api.subject_update(self.adm_context, UUID3,
+                                             {'locations': locations})
+        loc_a, loc_b, loc_c = subject['locations']
+
+        # a is changed, b is removed, c is kept and d is added
+        loc_a['url'] = 'a2'
+        loc_a['metadata'] = {'key': 'value'}
+        loc_d = {'url': 'd', 'metadata': {}, 'status': 'active'}
+        subject = self.db_api.subject_update(
+            self.adm_context, UUID3, {'locations': [loc_a, loc_c, loc_d]})
+        self.assertEqual([loc_a, loc_c],
+                         [loc for loc in subject['locations']
+                          if loc['id'] in (loc_a['id'], loc_c['id'])])
+        self.assertEqual(['a2', 'c', 'd'],
+                         sorted(loc['url'] for loc in subject['locations']))
+        self.assertNotIn(loc_b['id'],
+                         [loc['id'] for loc in subject['locations']])
+
+        subject = self.db_api.subject_get(self.adm_context, UUID3)
+        self.assertEqual(['a2', 'c', 'd'],
+                         sorted(loc['url'] for loc in subject['locations']))
+
+    def test_subject_update_unknown_location_id(self):
+        locations = [{'url': 'a', 'metadata': {}, 'status': 'active'}]
+        self.db_api.subject_update(self.adm_context, UUID3,
+                                   {'locations': locations})
+        locations = [{'id': -1, 'url': 'b', 'metadata': {},
+                      'status': 'active'}]
+        self.assertRaises(exception.NotFound, self.db_api.subject_update,
+                          self.adm_context, UUID3, {'locations': locations})
+
     def test_update_locations_direct(self):
         """
         For some reasons update_locations can be called directly
@@ -379,6 +452,68 @@ class DriverTests(object):
                           self.db_api.subject_location_update,
                           self.adm_context, UUID1, bad_location)
 
+    def _create_pending_delete_subject(self, count):
+        locations = [{'url': 'file:///pending/%d' % i, 'metadata': {},
+                      'status': 'active'} for i in range(count)]
+        fixture = {'status': 'pending_delete', 'locations': locations}
+        subject = self.db_api.subject_create(self.adm_context, fixture)
+        for loc in subject['locations']:
+            self.db_api.subject_location_delete(self.adm_context,
+                                                subject['id'], loc['id'],
+                                                'pending_delete')
+        return subject
+
+    def test_subject_location_get_pending_delete(self):
+        subject = self._create_pending_delete_subject(3)
+        locations = self.db_api.subject_location_get_pending_delete(
+            self.adm_context)
+        self.assertEqual(3, len(locations))
+        self.assertEqual(sorted(loc['id'] for loc in locations),
+                         [loc['id'] for loc in locations])
+        self.assertEqual(set([subject['id']]),
+                         set(loc['subject_id'] for loc in locations))
+        self.assertEqual(['file:///pending/%d' % i for i in range(3)],
+                         sorted(loc['url'] for loc in locations))
+
+        page = self.db_api.subject_location_get_pending_delete(
+            self.adm_context, limit=2)
+        self.assertEqual(locations[:2], page)
+        page = self.db_api.subject_location_get_pending_delete(
+            self.adm_context, marker=locations[1]['id'], limit=2)
+        self.assertEqual(locations[2:], page)
+
+    def test_subject_location_get_pending_delete_min_age(self):
+        self._create_pending_delete_subject(1)
+        locations = self.db_api.subject_location_get_pending_delete(
+            self.adm_context, min_age=3600)
+        self.assertEqual([], locations)
+
+    def test_subject_locations_scrubbed(self):
+        subject = self._create_pending_delete_subject(2)
+        locations = self.db_api.subject_location_get_pending_delete(
+            self.adm_context)
+
+        scrubbed = self.db_api.subject_locations_scrubbed(
+            self.adm_context, [locations[0]['id']])
+        self.assertEqual([], scrubbed)
+        subject = self.db_api.subject_get(self.adm_context, subject['id'])
+        self.assertEqual('pending_delete', subject['status'])
+        self.assertEqual(locations[1:],
+                         self.db_api.subject_location_get_pending_delete(
+                             self.adm_context))
+
+        scrubbed = self.db_api.subject_locations_scrubbed(
+            self.adm_context, [locations[1]['id']])
+        self.assertEqual([subject['id']], scrubbed)
+        subject = self.db_api.subject_get(self.adm_context, subject['id'])
+        self.assertEqual('deleted', subject['status'])
+        self.assertEqual([], self.db_api.subject_location_get_pending_delete(
+            self.adm_context))
+
+        scrubbed = self.db_api.subject_locations_scrubbed(
+            self.adm_context, [loc['id'] for loc in locations])
+        self.assertEqual([], scrubbed)
+
     def test_subject_property_delete(self):
         fixture = {'name': 'ping', 'value': 'pong', 'subject_id': UUID1}
         prop = self.db_api.subject_property_create(self.context, fixture)
@@ -391,6 +526,18 @@ class DriverTests(object):
         subject = self.db_api.subject_get(self.context, UUID1)
         self.assertEqual(self.fixtures[0]['id'], subject['id'])
 
+    def test_subject_get_with_tags(self):
+        self.db_api.subject_tag_set_all(self.context, UUID1, ['ping', 'pong'])
+        subject, tags = self.db_api.subject_get_with_tags(self.context, UUID1)
+        self.assertEqual(self.fixtures[0]['id'], subject['id'])
+        self.assertEqual(['ping', 'pong'], sorted(tags))
+
+    def test_subject_get_with_tags_disallow_deleted(self):
+        self.db_api.subject_destroy(self.adm_context, UUID1)
+        self.assertRaises(exception.NotFound,
+                          self.db_api.subject_get_with_tags,
+                          self.context, UUID1)
+
     def test_subject_get_disallow_deleted(self):
         self.db_api.subject_destroy(self.adm_context, UUID1)
         self.assertRaises(exception.NotFound, self.db_api.subject_get,
@@ -605,6 +752,23 @@ class DriverTests(object):
         subjects = self.db_api.subject_get_all(self.context, marker=UUID3)
         self.assertEqual(2, len(subjects))
 
+    def test_subject_get_all_marker_sort_dir_asc(self):
+        subjects = self.db_api.subject_get_all(self.context, marker=UUID1,
+                                               sort_dir=['asc'], limit=1)
+        self.assertEqual([UUID2], [s['id'] for s in subjects])
+        subjects = self.db_api.subject_get_all(self.context, marker=UUID2,
+                                               sort_dir=['asc'])
+        self.assertEqual([UUID3], [s['id'] for s in subjects])
+
+    def test_subject_get_all_keyset_marker(self):
+        marker_subject = self.db_api.subject_get(self.context, UUID3)
+        sort_keys = utils.keyset_sort_keys(['created_at'])
+        marker = utils.encode_keyset_marker(
+            sort_keys, [marker_subject[key] for key in sort_keys])
+        subjects = self.db_api.subject_get_all(self.context, marker=marker)
+        self.assertEqual(2, len(subjects))
+        self.assertEqual([UUID2, UUID1], [s['id'] for s in subjects])
+
     def test_subject_get_all_marker_with_size(self):
         # Use sort_key=size to test BigInteger
         subjects = self.db_api.subject_get_all(self.context, sort_key=['size'],
@@ -1952,6 +2116,45 @@ class DBPurgeTests(test_utils.BaseTestCase):
         tasks = self.db_api.task_get_all(self.adm_context)
         self.assertEqual(len(tasks), 2)
 
+    def test_db_purge_in_batches(self):
+        deleted_at = timeutils.utcnow() - datetime.timedelta(days=2)
+        self.create_subjects([build_subject_fixture(deleted=True,
+                                                    deleted_at=deleted_at)
+                              for i in range(4)])
+        purged = self.db_api.purge_deleted_rows(self.adm_context, 1, 2)
+        self.assertEqual(5, purged['subjects'])
+        self.assertEqual(1, purged['tasks'])
+        # Tables are purged before the tables they refer to
+        tables = list(purged)
+        self.assertLess(tables.index('subject_properties'),
+                        tables.index('subjects'))
+        subjects = self.db_api.subject_get_all(self.adm_context)
+        self.assertEqual(len(subjects), 2)
+
+    @mock.patch('time.sleep')
+    def test_db_purge_throttled(self, mock_sleep):
+        deleted_at = timeutils.utcnow() - datetime.timedelta(days=2)
+        self.create_subjects([build_subject_fixture(deleted=True,
+                                                    deleted_at=deleted_at)
+                              for i in range(3)])
+        purged = self.db_api.purge_deleted_rows(self.adm_context, 1, 2,
+                                                batch_sleep=0.5,
+                                                batch_duration=60)
+        self.assertEqual(4, purged['subjects'])
+        mock_sleep.assert_any_call(0.5)
+        subjects = self.db_api.subject_get_all(self.adm_context)
+        self.assertEqual(len(subjects), 2)
+
+    def test_db_purge_dry_run(self):
+        purged = self.db_api.purge_deleted_rows(self.adm_context, 1, 5,
+                                                dry_run=True)
+        self.assertEqual(1, purged['subjects'])
+        self.assertEqual(1, purged['tasks'])
+        subjects = self.db_api.subject_get_all(self.adm_context)
+        self.assertEqual(len(subjects), 3)
+        tasks = self.db_api.task_get_all(self.adm_context)
+        self.assertEqual(len(tasks), 3)
+
 
 class TestVisibility(test_utils.BaseTestCase):
     def setUp(self):
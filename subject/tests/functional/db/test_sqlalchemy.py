@@ -160,6 +160,29 @@ class TestSqlAlchemyQuota(base.DriverQuotaTests,
         self.addCleanup(db_tests.reset)
 
 
+class TestSqlAlchemyTrackedQuota(TestSqlAlchemyQuota):
+
+    def setUp(self):
+        super(TestSqlAlchemyTrackedQuota, self).setUp()
+        self.config(track_user_storage_usage=True)
+
+    def test_storage_quota_tracked_owner_change(self):
+        total = sum(f['size'] for f in self.owner1_fixtures)
+        self.assertEqual(total, self.db_api.user_get_storage_usage(
+            self.context1, self.owner_id1))
+
+        fixture = self.owner1_fixtures[0]
+        self.db_api.subject_update(self.context1, fixture['id'],
+                                   {'owner': 'new-owner'})
+
+        self.assertEqual(total - fixture['size'],
+                         self.db_api.user_get_storage_usage(self.context1,
+                                                            self.owner_id1))
+        self.assertEqual(fixture['size'],
+                         self.db_api.user_get_storage_usage(self.context1,
+                                                            'new-owner'))
+
+
 class TestDBPurge(base.DBPurgeTests,
                   base.FunctionalInitWrapper):
 
@@ -13,12 +13,20 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import threading
+import time
+
+import fixtures
+import mock
 from mox3 import mox
+from six.moves import BaseHTTPServer
 from six.moves import http_client
+from six.moves import socketserver
 import testtools
 
 from subject.common import auth
 from subject.common import client
+from subject.common import exception
 from subject.tests import utils
 
 
@@ -88,3 +96,164 @@ class TestClient(testtools.TestCase):
         resp = self.client.do_request('GET', '/v1/subjects/detail',
                                       params=params)
         self.assertEqual(fake, resp)
+
+
+class TestConnectionPool(testtools.TestCase):
+
+    def setUp(self):
+        super(TestConnectionPool, self).setUp()
+        self.pool = client.ConnectionPool(max_size=2, max_idle=60)
+        patcher = mock.patch.object(client, '_is_connection_idle',
+                                    return_value=True)
+        self.is_idle = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_get_empty(self):
+        self.assertIsNone(self.pool.get())
+
+    def test_get_reuses_connection(self):
+        connection = mock.Mock()
+        self.pool.put(connection)
+        self.assertIs(connection, self.pool.get())
+        self.assertIsNone(self.pool.get())
+        self.assertFalse(connection.close.called)
+
+    def test_get_closes_dead_connection(self):
+        connection = mock.Mock()
+        self.pool.put(connection)
+        self.is_idle.return_value = False
+        self.assertIsNone(self.pool.get())
+        connection.close.assert_called_once_with()
+
+    @mock.patch.object(client.time, 'time')
+    def test_get_closes_expired_connection(self, mock_time):
+        connection = mock.Mock()
+        mock_time.return_value = 1000
+        self.pool.put(connection)
+        mock_time.return_value = 1061
+        self.assertIsNone(self.pool.get())
+        connection.close.assert_called_once_with()
+
+    def test_put_closes_connections_beyond_max_size(self):
+        connections = [mock.Mock() for i in range(3)]
+        for connection in connections:
+            self.pool.put(connection)
+        connections[0].close.assert_called_once_with()
+        self.assertIs(connections[2], self.pool.get())
+        self.assertIs(connections[1], self.pool.get())
+
+    def test_put_without_max_size_closes_connection(self):
+        pool = client.ConnectionPool(max_size=0)
+        connection = mock.Mock()
+        pool.put(connection)
+        connection.close.assert_called_once_with()
+        self.assertIsNone(pool.get())
+
+
+class TestConnectionReuse(testtools.TestCase):
+
+    BODY = b'x' * 100000
+
+    def setUp(self):
+        super(TestConnectionReuse, self).setUp()
+        body = self.BODY
+        self.peers = set()
+        peers = self.peers
+        self.posts = []
+        posts = self.posts
+        self.post_delay = 0
+        self.post_closes = False
+        test = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                peers.add(self.client_address)
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                posts.append(self.rfile.read(length))
+                time.sleep(test.post_delay)
+                self.send_response(200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                # closes the connection without telling the client
+                self.close_connection = test.post_closes
+
+            def log_message(self, *args, **kwargs):
+                return
+
+        class Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+
+        server = Server(('127.0.0.1', 0), Handler)
+        self.port = server.server_address[1]
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.useFixture(fixtures.MonkeyPatch(
+            'subject.common.client._POOLS', {}))
+
+    def _read_bodies(self, pool_size, in_flight):
+        base_client = client.BaseClient('127.0.0.1', port=self.port,
+                                        pool_size=pool_size)
+        responses = [base_client.do_request('GET', '/')
+                     for i in range(in_flight)]
+        return [len(response.read()) for response in responses]
+
+    def test_bodies_read_with_more_requests_than_pool_size(self):
+        self.assertEqual([len(self.BODY)] * 3, self._read_bodies(1, 3))
+        # the connections of the two requests beyond the pool size are
+        # closed once read, the last one is reused
+        self.assertEqual([len(self.BODY)] * 3, self._read_bodies(1, 3))
+        self.assertEqual(5, len(self.peers))
+
+    def test_bodies_read_without_pool(self):
+        self.assertEqual([len(self.BODY)] * 3, self._read_bodies(0, 3))
+        self.assertEqual([len(self.BODY)] * 3, self._read_bodies(0, 3))
+        self.assertEqual(6, len(self.peers))
+        self.assertEqual({}, client._POOLS)
+
+    def test_connection_reused_once_read(self):
+        base_client = client.BaseClient('127.0.0.1', port=self.port)
+        for i in range(3):
+            response = base_client.do_request('GET', '/')
+            self.assertEqual(self.BODY, response.read())
+        self.assertEqual(1, len(self.peers))
+
+    def test_connection_closed_with_unread_response(self):
+        base_client = client.BaseClient('127.0.0.1', port=self.port)
+        response = base_client.do_request('GET', '/')
+        response.read(10)
+        response.close()
+        response = base_client.do_request('GET', '/')
+        self.assertEqual(self.BODY, response.read())
+        self.assertEqual(2, len(self.peers))
+
+    def test_post_not_resent_after_timeout_on_reused_connection(self):
+        base_client = client.BaseClient('127.0.0.1', port=self.port,
+                                        timeout=0.5)
+        base_client.do_request('POST', '/', body='first')
+        self.post_delay = 1
+        self.assertRaises(exception.ClientConnectionError,
+                          base_client.do_request, 'POST', '/', body='second')
+        self.assertEqual([b'first', b'second'], self.posts)
+
+    @mock.patch.object(client, '_is_connection_idle', return_value=True)
+    def test_post_resent_when_reused_connection_was_closed(self, mock_idle):
+        # the connection is closed by the server just as it is reused
+        base_client = client.BaseClient('127.0.0.1', port=self.port)
+        self.post_closes = True
+        base_client.do_request('POST', '/', body='first')
+        # lets the server close its end of the connection
+        time.sleep(0.1)
+        response = base_client.do_request('POST', '/', body='second')
+        self.assertEqual(200, response.status)
+        self.assertEqual([b'first', b'second'], self.posts)
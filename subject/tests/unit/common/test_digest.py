@@ -0,0 +1,94 @@
+# Copyright 2016 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import hashlib
+
+import mock
+
+from subject.common import digest
+from subject.common import utils
+from subject.tests import utils as test_utils
+
+CHUNKS = [b'abc', b'defg', b'', b'hij']
+DATA = b''.join(CHUNKS)
+
+
+class TestMultiDigest(test_utils.BaseTestCase):
+
+    def _update(self, multi_digest):
+        for chunk in CHUNKS:
+            multi_digest.update(chunk)
+
+    def test_single_pass(self):
+        multi_digest = digest.MultiDigest(['md5', 'sha512'])
+        self._update(multi_digest)
+        self.assertEqual(hashlib.md5(DATA).hexdigest(),
+                         multi_digest.hexdigest('md5'))
+        self.assertEqual(hashlib.sha512(DATA).hexdigest(),
+                         multi_digest.hexdigest('sha512'))
+
+    def test_updates_verifier(self):
+        verifier = mock.Mock()
+        multi_digest = digest.MultiDigest(['sha256'], verifier=verifier)
+        self._update(multi_digest)
+        self.assertEqual([mock.call(chunk) for chunk in CHUNKS],
+                         verifier.update.call_args_list)
+
+    def test_in_thread(self):
+        verifier = mock.Mock()
+        multi_digest = digest.MultiDigest(['md5', 'sha256'],
+                                          verifier=verifier, in_thread=True)
+        self._update(multi_digest)
+        self.assertEqual(hashlib.md5(DATA).hexdigest(),
+                         multi_digest.hexdigest('md5'))
+        self.assertEqual(hashlib.sha256(DATA).hexdigest(),
+                         multi_digest.hexdigest('sha256'))
+        self.assertEqual(len(CHUNKS), verifier.update.call_count)
+
+    def test_wait_without_updates(self):
+        multi_digest = digest.MultiDigest(['md5'], in_thread=True)
+        multi_digest.wait()
+        self.assertEqual(hashlib.md5().hexdigest(),
+                         multi_digest.hexdigest('md5'))
+
+    def test_get_upload_digest(self):
+        self.config(hashing_algorithm='sha384', hashing_in_thread=True)
+        verifier = mock.Mock()
+        multi_digest = digest.get_upload_digest(verifier)
+        self.assertEqual(['sha384'], list(multi_digest.hashes))
+        self.assertIs(verifier, multi_digest.verifier)
+        self.assertTrue(multi_digest.in_thread)
+
+    def test_hashing_algorithm_choices(self):
+        self.assertIn('sha512', digest.HASHING_ALGORITHMS)
+        self.assertNotIn('shake_128', digest.HASHING_ALGORITHMS)
+        opt = [o for o in digest.digest_opts
+               if o.name == 'hashing_algorithm'][0]
+        self.assertEqual('sha256', opt.type('sha256'))
+        self.assertRaises(ValueError, opt.type, 'sha5l2')
+
+    def test_get_checksum_digest(self):
+        multi_digest = digest.get_checksum_digest()
+        self.assertEqual(['md5'], list(multi_digest.hashes))
+        self.assertIsNone(multi_digest.verifier)
+        self.assertFalse(multi_digest.in_thread)
+
+    def test_cooperative_reader(self):
+        multi_digest = digest.MultiDigest(['sha512'])
+        reader = utils.CooperativeReader(iter(CHUNKS), digest=multi_digest)
+        data = b''.join(iter(lambda: reader.read(4), b''))
+        self.assertEqual(DATA, data)
+        self.assertEqual(hashlib.sha512(DATA).hexdigest(),
+                         multi_digest.hexdigest('sha512'))
@@ -0,0 +1,142 @@
+# Copyright 2016 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from subject.common import exception
+from subject.common import metadata_cache
+import subject.context
+from subject.tests import utils as test_utils
+
+
+class TestSubjectMetadataCache(test_utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestSubjectMetadataCache, self).setUp()
+        self.cache = metadata_cache.SubjectMetadataCache(2, 30)
+
+    def test_get_set(self):
+        self.assertIsNone(self.cache.get('s1', 'k1'))
+        self.cache.set('s1', 'k1', 'v1', self.cache.epoch)
+        self.assertEqual('v1', self.cache.get('s1', 'k1'))
+        self.assertIsNone(self.cache.get('s1', 'k2'))
+
+    def test_least_recently_used_evicted(self):
+        self.cache.set('s1', 'k', 'v1', self.cache.epoch)
+        self.cache.set('s2', 'k', 'v2', self.cache.epoch)
+        self.cache.get('s1', 'k')
+        self.cache.set('s3', 'k', 'v3', self.cache.epoch)
+        self.assertEqual('v1', self.cache.get('s1', 'k'))
+        self.assertIsNone(self.cache.get('s2', 'k'))
+        self.assertEqual('v3', self.cache.get('s3', 'k'))
+
+    @mock.patch.object(metadata_cache.time, 'time')
+    def test_entries_expire(self, mock_time):
+        mock_time.return_value = 1000
+        self.cache.set('s1', 'k', 'v1', self.cache.epoch)
+        mock_time.return_value = 1029
+        self.assertEqual('v1', self.cache.get('s1', 'k'))
+        mock_time.return_value = 1030
+        self.assertIsNone(self.cache.get('s1', 'k'))
+
+    def test_invalidate(self):
+        self.cache.set('s1', 'k1', 'v1', self.cache.epoch)
+        self.cache.set('s1', 'k2', 'v2', self.cache.epoch)
+        self.cache.invalidate('s1')
+        self.assertIsNone(self.cache.get('s1', 'k1'))
+        self.assertIsNone(self.cache.get('s1', 'k2'))
+
+    def test_set_after_invalidate_ignored(self):
+        epoch = self.cache.epoch
+        self.cache.invalidate('s1')
+        self.cache.set('s1', 'k', 'stale', epoch)
+        self.assertIsNone(self.cache.get('s1', 'k'))
+
+
+class TestMetadataCacheGet(test_utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestMetadataCacheGet, self).setUp()
+        self.config(subject_metadata_cache_size=10)
+        self.addCleanup(metadata_cache.clear)
+        self.context = subject.context.RequestContext(tenant='tenant1')
+        self.fetch = mock.Mock(return_value={'id': 's1', 'tags': ['a']})
+
+    def test_disabled(self):
+        self.config(subject_metadata_cache_size=0)
+        metadata_cache.get('ns', self.context, 's1', self.fetch)
+        metadata_cache.get('ns', self.context, 's1', self.fetch)
+        self.assertEqual(2, self.fetch.call_count)
+
+    def test_read_through(self):
+        value = metadata_cache.get('ns', self.context, 's1', self.fetch)
+        value['tags'].append('b')
+        value = metadata_cache.get('ns', self.context, 's1', self.fetch)
+        self.assertEqual({'id': 's1', 'tags': ['a']}, value)
+        self.assertEqual(1, self.fetch.call_count)
+
+    def test_keyed_by_visibility_context(self):
+        other_context = subject.context.RequestContext(tenant='tenant2')
+        metadata_cache.get('ns', self.context, 's1', self.fetch)
+        metadata_cache.get('ns', other_context, 's1', self.fetch)
+        self.assertEqual(2, self.fetch.call_count)
+
+    def test_errors_not_cached(self):
+        self.fetch.side_effect = exception.NotFound
+        self.assertRaises(exception.NotFound, metadata_cache.get,
+                          'ns', self.context, 's1', self.fetch)
+        self.assertRaises(exception.NotFound, metadata_cache.get,
+                          'ns', self.context, 's1', self.fetch)
+        self.assertEqual(2, self.fetch.call_count)
+
+    def test_invalidated_by_notification(self):
+        endpoint = metadata_cache.SubjectNotificationEndpoint()
+        metadata_cache.get('ns', self.context, 's1', self.fetch)
+        endpoint.info({}, 'subject.localhost', 'subject.member.create',
+                      {'subject_id': 's1', 'member_id': 'tenant2'}, {})
+        metadata_cache.get('ns', self.context, 's1', self.fetch)
+        endpoint.info({}, 'subject.localhost', 'subject.update',
+                      {'id': 's1'}, {})
+        metadata_cache.get('ns', self.context, 's1', self.fetch)
+        self.assertEqual(3, self.fetch.call_count)
+
+
+class TestMetadataCacheListener(test_utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestMetadataCacheListener, self).setUp()
+        self.addCleanup(setattr, metadata_cache, '_LISTENER', None)
+
+    @mock.patch.object(metadata_cache.oslo_messaging,
+                       'get_notification_listener')
+    @mock.patch.object(metadata_cache.socket, 'gethostname',
+                       return_value='host1')
+    def _get_pool(self, worker_index, mock_hostname, mock_listener):
+        with mock.patch.object(metadata_cache.wsgi, 'get_worker_index',
+                               return_value=worker_index):
+            with mock.patch.object(metadata_cache.sys, 'argv',
+                                   ['/usr/bin/subject-api']):
+                metadata_cache._start_listener()
+        return mock_listener.call_args[1]['pool']
+
+    def test_pool_named_after_worker_index(self):
+        self.assertEqual('subject-metadata-cache-host1-subject-api-2',
+                         self._get_pool(2))
+        # a restarted worker consumes from the same queue
+        self.assertEqual(self._get_pool(2), self._get_pool(2))
+
+    def test_pool_without_workers(self):
+        self.assertEqual('subject-metadata-cache-host1-subject-api-0',
+                         self._get_pool(None))
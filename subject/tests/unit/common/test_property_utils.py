@@ -13,6 +13,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import mock
 # NOTE(jokke): simplified transition to py3, behaves like py2 xrange
 from six.moves import range
 
@@ -326,6 +327,38 @@ class TestPropertyRulesWithRoles(base.IsolatedUnitTest):
             'x_case_insensitive', 'delete',
             create_context(self.policy, ['member'])))
 
+    def test_property_rules_parsed_once(self):
+        rules_checker = property_utils.PropertyRules(self.policy)
+        with mock.patch.object(property_utils.CONFIG, 'read') as mock_read:
+            other_rules_checker = property_utils.PropertyRules(self.policy)
+        self.assertFalse(mock_read.called)
+        self.assertIs(rules_checker.rule_set, other_rules_checker.rule_set)
+
+    def test_property_rules_reloaded_on_change(self):
+        rules_checker = property_utils.PropertyRules(self.policy)
+        self.assertTrue(rules_checker.check_property_rules(
+            'test_prop', 'delete', create_context(self.policy, ['admin'])))
+        self.set_property_protection_rules({'.*': {'create': ['member'],
+                                                   'read': ['member'],
+                                                   'update': ['member'],
+                                                   'delete': ['member']}})
+        rules_checker = property_utils.PropertyRules(self.policy)
+        self.assertEqual(1, len(rules_checker.rules))
+        self.assertFalse(rules_checker.check_property_rules(
+            'test_prop', 'delete', create_context(self.policy, ['admin'])))
+
+    def test_property_rules_decision_cache_bounded(self):
+        self.rules_checker = property_utils.PropertyRules(self.policy)
+        self.stubs.Set(property_utils, 'RULE_DECISION_CACHE_SIZE', 2)
+        context = create_context(self.policy, ['member'])
+        for action in ['create', 'read', 'update']:
+            self.assertTrue(self.rules_checker.check_property_rules(
+                'x_owner_prop', action, context))
+        self.assertEqual(
+            [('x_owner_prop', 'read', frozenset(['member'])),
+             ('x_owner_prop', 'update', frozenset(['member']))],
+            list(self.rules_checker.rule_set.decisions))
+
 
 class TestPropertyRulesWithPolicies(base.IsolatedUnitTest):
 
@@ -338,6 +371,11 @@ class TestPropertyRulesWithPolicies(base.IsolatedUnitTest):
     def tearDown(self):
         super(TestPropertyRulesWithPolicies, self).tearDown()
 
+    def test_policy_rules_added_again_after_reload(self):
+        self.policy.set_rules({}, overwrite=True, use_conf=False)
+        property_utils.PropertyRules(self.policy)
+        self.assertIn('spl_creator_policy:create', self.policy.rules)
+
     def test_check_property_rules_create_permitted_specific_policy(self):
         self.assertTrue(self.rules_checker.check_property_rules(
                         'spl_creator_policy', 'create',
@@ -16,6 +16,7 @@
 #    under the License.
 import datetime
 
+import mock
 from oslo_config import cfg
 from oslo_serialization import jsonutils
 from oslo_utils import encodeutils
@@ -253,6 +254,42 @@ class TestRPCClient(base.IsolatedUnitTest):
         self.assertEqual(4, rst)
         self.assertIsInstance(rst, int)
 
+    def test_batch(self):
+        with mock.patch.object(self.client, 'bulk_request',
+                               wraps=self.client.bulk_request) as bulk:
+            with self.client.batch() as batch:
+                subjects = batch.get_subjects(keyword=True)
+                count = batch.count_subjects(subjects=[1, 2, 3])
+                self.assertFalse(subjects.done())
+
+            bulk.assert_called_once_with(
+                [{'command': 'get_subjects', 'kwargs': {'keyword': True}},
+                 {'command': 'count_subjects',
+                  'kwargs': {'subjects': [1, 2, 3]}}])
+        self.assertTrue(subjects.result())
+        self.assertEqual(3, count.result())
+
+    def test_batch_result_flushes(self):
+        batch = self.client.batch()
+        subjects = batch.get_subjects(keyword=True)
+        error = batch.raise_value_error()
+        count = batch.count_subjects(subjects=[1])
+        self.assertTrue(subjects.result())
+        self.assertTrue(count.done())
+        self.assertEqual(1, count.result())
+        self.assertRaises(ValueError, error.result)
+
+    def test_batch_request_error(self):
+        batch = self.client.batch()
+        subjects = batch.get_subjects(keyword=True)
+        count = batch.count_subjects(subjects=[1])
+        with mock.patch.object(self.client, 'bulk_request',
+                               side_effect=exception.ClientConnectionError):
+            self.assertRaises(exception.ClientConnectionError,
+                              subjects.result)
+            self.assertRaises(exception.ClientConnectionError,
+                              count.result)
+
 
 class TestRPCJSONSerializer(test_utils.BaseTestCase):
 
@@ -14,9 +14,11 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import datetime
 import os
 import tempfile
 
+import mock
 import six
 import webob
 
@@ -25,6 +27,27 @@ from subject.common import utils
 from subject.tests import utils as test_utils
 
 
+class ShortReadFile(object):
+    """A file object returning at most a few bytes per read, as sockets do."""
+
+    def __init__(self, data, max_read):
+        self.data = six.BytesIO(data)
+        self.max_read = max_read
+
+    def read(self, length=-1):
+        if length is None or length < 0:
+            return self.data.read()
+        return self.data.read(min(length, self.max_read))
+
+
+class ShortReadRawFile(ShortReadFile):
+
+    def readinto(self, buf):
+        chunk = self.read(len(buf))
+        buf[:len(chunk)] = chunk
+        return len(chunk)
+
+
 class TestUtils(test_utils.BaseTestCase):
     """Test routines in subject.utils"""
 
@@ -115,6 +138,74 @@ class TestUtils(test_utils.BaseTestCase):
         read_size = 8 * 1024           # 8k, as in httplib
         self._test_reader_chunked(chunk_size, read_size)
 
+    def test_cooperative_reader_coalesces_short_reads(self):
+        data = b'abcdefghijklmnopqrstuvwxyz'
+        for fd in (ShortReadFile(data, 3), ShortReadRawFile(data, 3)):
+            reader = utils.CooperativeReader(fd)
+            chunks = []
+            while True:
+                chunks.append(reader.read(10))
+                if not chunks[-1]:
+                    break
+            self.assertEqual([10, 10, 6, 0], [len(c) for c in chunks])
+            self.assertEqual(data, b''.join(chunks))
+
+    def test_cooperative_reader_returns_bytes(self):
+        data = b'abcdefghij'
+        data_list = [data[i:i + 3] for i in range(0, len(data), 3)]
+        for fd in (data_list, ShortReadFile(data, 3),
+                   ShortReadRawFile(data, 3), six.BytesIO(data)):
+            reader = utils.CooperativeReader(fd)
+            # two full blocks, then the short last one
+            for i in range(3):
+                self.assertIs(bytes, type(reader.read(4)))
+
+    @mock.patch.object(utils, 'MAX_COOP_READER_BLOCK_SIZE', 4)
+    def test_cooperative_reader_caps_block_size(self):
+        data = b'abcdefghij'
+        for fd in ([data], ShortReadFile(data, 3), ShortReadRawFile(data, 3)):
+            reader = utils.CooperativeReader(fd)
+            self.assertEqual(b'abcd', reader.read(10))
+            self.assertEqual(b'efgh', reader.read(10))
+
+    def test_cooperative_reader_iterates_blocks(self):
+        data = b'abcdefghij'
+        data_list = [data[i:i + 3] for i in range(0, len(data), 3)]
+        for fd in (data_list, ShortReadRawFile(data, 3)):
+            reader = utils.CooperativeReader(fd, block_size=4)
+            self.assertEqual([b'abcd', b'efgh', b'ij'], list(reader))
+
+    def test_cooperative_reader_yields_once_per_block(self):
+        data = b'*' * 64
+        reader = utils.CooperativeReader(ShortReadRawFile(data, 1),
+                                         block_size=16)
+        with mock.patch.object(utils, 'sleep') as mock_sleep:
+            self.assertEqual(data, b''.join(reader))
+        # Four full blocks and the empty read at the end
+        self.assertEqual(5, mock_sleep.call_count)
+
+    def test_cooperative_reader_limit(self):
+        BYTES = 1024
+        for fd in (six.BytesIO(b'*' * BYTES), [b'*' * BYTES],
+                   ShortReadRawFile(b'*' * BYTES, 100)):
+            reader = utils.CooperativeReader(fd, limit=BYTES)
+            self.assertEqual(BYTES, len(b''.join(reader)))
+
+        def _consume_all_iter(fd):
+            for chunk in utils.CooperativeReader(fd, limit=BYTES - 1):
+                pass
+
+        def _consume_all_read(fd):
+            reader = utils.CooperativeReader(fd, limit=BYTES - 1)
+            while reader.read(10):
+                pass
+
+        for consume in (_consume_all_iter, _consume_all_read):
+            for fd in (six.BytesIO(b'*' * BYTES), [b'*' * BYTES],
+                       ShortReadRawFile(b'*' * BYTES, 100)):
+                self.assertRaises(exception.SubjectSizeLimitExceeded,
+                                  consume, fd)
+
     def test_limiting_reader(self):
         """Ensure limiting reader class accesses all bytes of file"""
         BYTES = 1024
@@ -158,6 +249,18 @@ class TestUtils(test_utils.BaseTestCase):
 
         self.assertRaises(exception.SubjectSizeLimitExceeded, _consume_all_read)
 
+    def test_limiting_reader_readinto(self):
+        """Ensure limiting reader passes readinto through if supported"""
+        BYTES = 1024
+        reader = utils.LimitingReader(six.StringIO("*" * BYTES), BYTES)
+        self.assertFalse(hasattr(reader, 'readinto'))
+
+        reader = utils.LimitingReader(six.BytesIO(b"*" * BYTES), BYTES - 1)
+        buf = bytearray(BYTES - 1)
+        self.assertEqual(BYTES - 1, reader.readinto(buf))
+        self.assertRaises(exception.SubjectSizeLimitExceeded,
+                          reader.readinto, buf)
+
     def test_get_meta_from_headers(self):
         resp = webob.Response()
         resp.headers = {"x-subject-meta-name": 'test',
@@ -390,6 +493,27 @@ class TestUtils(test_utils.BaseTestCase):
                               utils.parse_valid_host_port,
                               pair)
 
+    def test_keyset_sort_keys(self):
+        self.assertEqual(['name', 'created_at', 'id'],
+                         utils.keyset_sort_keys(['name']))
+        self.assertEqual(['id', 'created_at'],
+                         utils.keyset_sort_keys(['id']))
+
+    def test_keyset_marker(self):
+        created_at = datetime.datetime(2016, 10, 5, 12, 30, 1, 250)
+        sort_keys = ['name', 'size', 'created_at', 'id']
+        values = [None, 17, created_at, 'fake-id']
+        marker = utils.encode_keyset_marker(sort_keys, values)
+        self.assertTrue(utils.is_keyset_marker(marker))
+        self.assertFalse(utils.is_keyset_marker('fake-id'))
+        self.assertEqual((sort_keys, values),
+                         utils.decode_keyset_marker(marker))
+
+    def test_keyset_marker_invalid(self):
+        for marker in ('ks1.', 'ks1.!!!', 'ks1.WzFd'):
+            self.assertRaises(exception.InvalidParameterValue,
+                              utils.decode_keyset_marker, marker)
+
 
 class SplitFilterOpTestCase(test_utils.BaseTestCase):
 
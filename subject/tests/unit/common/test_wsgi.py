@@ -17,6 +17,7 @@
 import datetime
 import gettext
 import os
+import signal
 import socket
 
 from babel import localedata
@@ -24,6 +25,7 @@ import eventlet.patcher
 import fixtures
 import mock
 from oslo_concurrency import processutils
+import oslo_messaging
 from oslo_serialization import jsonutils
 import routes
 import six
@@ -35,6 +37,7 @@ from subject.common import exception
 from subject.common import utils
 from subject.common import wsgi
 from subject import i18n
+from subject import notifier
 from subject.tests import utils as test_utils
 
 
@@ -575,6 +578,62 @@ class ServerTest(test_utils.BaseTestCase):
             self.assertEqual(processutils.get_worker_count(),
                              len(server.children))
 
+    def test_worker_index_reused(self):
+        pids = iter(range(100, 110))
+        server = wsgi.Server()
+        with mock.patch.object(os, 'fork', side_effect=lambda: next(pids)):
+            for i in range(3):
+                server.run_child()
+            self.assertEqual({100: 0, 101: 1, 102: 2},
+                             server.worker_indexes)
+            server._remove_children(101)
+            server.run_child()
+        self.assertEqual({100: 0, 102: 2, 103: 1}, server.worker_indexes)
+
+    def test_worker_index_set_in_child(self):
+        self.addCleanup(setattr, wsgi, '_WORKER_INDEX', None)
+        server = wsgi.Server()
+        server.worker_indexes = {100: 0}
+        server.run_server = mock.Mock()
+        with mock.patch.object(os, 'fork', return_value=0):
+            with mock.patch.object(wsgi.signal, 'signal'):
+                self.assertRaises(SystemExit, server.run_child)
+        self.assertEqual(1, wsgi.get_worker_index())
+
+    def test_child_flushes_notifications_on_sigterm(self):
+        self.addCleanup(setattr, wsgi, '_WORKER_INDEX', None)
+        server = wsgi.Server()
+        server.run_server = mock.Mock()
+        with mock.patch.object(os, 'fork', return_value=0):
+            with mock.patch.object(wsgi.signal, 'signal') as mock_signal:
+                self.assertRaises(SystemExit, server.run_child)
+        handlers = dict(c[0] for c in mock_signal.call_args_list)
+        self.assertNotEqual(signal.SIG_DFL, handlers[signal.SIGTERM])
+
+        with mock.patch.object(wsgi.signal, 'signal') as mock_signal:
+            with mock.patch.object(eventlet, 'spawn_n') as mock_spawn:
+                handlers[signal.SIGTERM](signal.SIGTERM, None)
+        # a second SIGTERM kills the child right away
+        mock_signal.assert_called_once_with(signal.SIGTERM, signal.SIG_DFL)
+        mock_spawn.assert_called_once_with(server._terminate_child)
+
+    @mock.patch.object(os, 'kill')
+    @mock.patch.object(notifier.atexit, 'register')
+    @mock.patch.object(oslo_messaging, 'Notifier')
+    @mock.patch.object(oslo_messaging, 'get_notification_transport')
+    def test_terminate_child_sends_queued_notifications(
+            self, mock_get_transport, mock_notifier, mock_register,
+            mock_kill):
+        self.config(notification_queue_size=10)
+        self.stubs.Set(notifier, '_DISPATCHER', None)
+        notifier.Notifier().info('subject.send', {'bytes_sent': 3})
+        self.assertFalse(mock_notifier.return_value.info.called)
+
+        wsgi.Server._terminate_child()
+        mock_notifier.return_value.info.assert_called_once_with(
+            {}, 'subject.send', {'bytes_sent': 3})
+        mock_kill.assert_called_once_with(os.getpid(), signal.SIGTERM)
+
 
 class TestHelpers(test_utils.BaseTestCase):
 
@@ -13,12 +13,16 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+from contextlib import contextmanager
+
 from oslo_policy import policy
+import six
 # NOTE(jokke): simplified transition to py3, behaves like py2 xrange
 from six.moves import range
 import testtools
 import webob
 
+import subject.api.common
 import subject.api.middleware.cache
 import subject.api.policy
 from subject.common import exception
@@ -168,6 +172,10 @@ class ProcessRequestTestCacheFilter(subject.api.middleware.cache.CacheFilter):
             def get_subject_size(self, subject_id):
                 pass
 
+            @contextmanager
+            def open_for_read(self, subject_id):
+                yield six.BytesIO(b'0123456789')
+
         self.cache = DummyCache()
         self.policy = unit_test_utils.FakePolicyEnforcer()
 
@@ -379,6 +387,211 @@ class TestCacheMiddlewareProcessRequest(base.IsolatedUnitTest):
         self.assertEqual('c1234', response.headers['Content-MD5'])
         self.assertEqual('123456789', response.headers['Content-Length'])
 
+    def test_v1_process_request_file_wrapper(self):
+        """
+        Test that a cache hit is handed to the server's file wrapper, and
+        that the subject.send notification is sent when it is closed.
+        """
+        class FakeFileWrapper(object):
+            def __init__(self, filelike, blksize):
+                self.filelike = filelike
+
+            def __iter__(self):
+                return iter([self.filelike.read()])
+
+            def close(self):
+                self.filelike.close()
+
+        notifications = []
+
+        def fake_subject_send_notification(bytes_written, expected_size,
+                                           subject_meta, request, notifier):
+            notifications.append((bytes_written, expected_size))
+
+        self.stubs.Set(subject.api.middleware.cache,
+                       'subject_send_notification',
+                       fake_subject_send_notification)
+
+        subject_id = 'test1'
+
+        def fake_get_v1_subject_metadata(*args, **kwargs):
+            return {
+                'id': subject_id,
+                'name': 'fake_subject',
+                'status': 'active',
+                'checksum': 'c1234',
+                'owner': '',
+                'size': '10',
+                'deleted': False,
+                'properties': {'distro': 'fake'},
+            }
+
+        request = webob.Request.blank('/v1/subjects/%s/file' % subject_id)
+        request.context = context.RequestContext()
+        request.environ['wsgi.file_wrapper'] = FakeFileWrapper
+        cache_filter = ProcessRequestTestCacheFilter()
+        cache_filter._get_v1_subject_metadata = fake_get_v1_subject_metadata
+        response = cache_filter.process_request(request)
+
+        self.assertIsInstance(response.app_iter, FakeFileWrapper)
+        self.assertEqual('10', response.headers['Content-Length'])
+        self.assertEqual('application/octet-stream',
+                         response.headers['Content-Type'])
+        self.assertEqual('c1234', response.headers['ETag'])
+        self.assertEqual('fake_subject',
+                         response.headers['x-subject-meta-name'])
+        self.assertEqual('fake',
+                         response.headers['x-subject-meta-property-distro'])
+        self.assertEqual([b'0123456789'], list(response.app_iter))
+        self.assertEqual([], notifications)
+
+        response.app_iter.close()
+        self.assertEqual([(10, 10)], notifications)
+
+    def test_v1_process_request_file_wrapper_partial(self):
+        """
+        Test that the subject.send notification of a cache hit handed to
+        the server's file wrapper counts only the bytes actually sent.
+        """
+        class FakeFileWrapper(object):
+            def __init__(self, filelike, blksize):
+                self.filelike = filelike
+
+            def __iter__(self):
+                return iter([self.filelike.read(4)])
+
+            def close(self):
+                self.filelike.close()
+
+        notifications = []
+
+        def fake_subject_send_notification(bytes_written, expected_size,
+                                           subject_meta, request, notifier):
+            notifications.append((bytes_written, expected_size))
+
+        self.stubs.Set(subject.api.middleware.cache,
+                       'subject_send_notification',
+                       fake_subject_send_notification)
+
+        subject_id = 'test1'
+        subject_meta = {
+            'id': subject_id,
+            'name': 'fake_subject',
+            'status': 'active',
+            'checksum': 'c1234',
+            'owner': '',
+            'size': '10',
+            'deleted': False,
+            'properties': {},
+        }
+        request = webob.Request.blank('/v1/subjects/%s/file' % subject_id)
+        request.context = context.RequestContext()
+        request.environ['wsgi.file_wrapper'] = FakeFileWrapper
+        cache_filter = ProcessRequestTestCacheFilter()
+        cache_filter._get_v1_subject_metadata = lambda *args: subject_meta
+        response = cache_filter.process_request(request)
+
+        # the client goes away after the first four bytes
+        self.assertEqual([b'0123'], list(response.app_iter))
+        response.app_iter.close()
+        self.assertEqual([(4, 10)], notifications)
+
+    def _get_range_response(self, range_header, posthooks=None):
+        subject_id = 'test1'
+        request = webob.Request.blank('/v1/subjects/test1/file')
+        request.context = context.RequestContext()
+        request.headers['Range'] = range_header
+        if posthooks is not None:
+            request.environ['eventlet.posthooks'] = posthooks
+        subject_meta = {
+            'id': subject_id,
+            'name': 'fake_subject',
+            'status': 'active',
+            'checksum': 'c1234',
+            'owner': '',
+            'size': 10,
+        }
+
+        cache_filter = ProcessRequestTestCacheFilter()
+        ranges = cache_filter._get_request_ranges(request, subject_meta)
+        if ranges is None:
+            return None
+        return cache_filter._process_range_request(request, subject_id,
+                                                   subject_meta, ranges)
+
+    def test_parse_byte_ranges(self):
+        parse = subject.api.middleware.cache.parse_byte_ranges
+        self.assertEqual([(0, 10)], parse('bytes=0-9', 10))
+        self.assertEqual([(0, 10)], parse('bytes=0-100', 10))
+        self.assertEqual([(5, 10)], parse('bytes=5-', 10))
+        self.assertEqual([(7, 10)], parse('bytes=-3', 10))
+        self.assertEqual([(0, 1), (5, 7)], parse('bytes=0-0, 5-6', 10))
+        self.assertEqual([], parse('bytes=10-', 10))
+        self.assertEqual([], parse('bytes=-0', 10))
+        self.assertIsNone(parse('bytes=9-3', 10))
+        self.assertIsNone(parse('bytes=a-b', 10))
+        self.assertIsNone(parse('items=0-1', 10))
+        self.assertIsNone(parse('bytes=', 10))
+
+    def test_process_request_single_range(self):
+        response = self._get_range_response('bytes=2-5')
+        self.assertEqual(206, response.status_int)
+        self.assertEqual('bytes 2-5/10', response.headers['Content-Range'])
+        self.assertEqual('4', response.headers['Content-Length'])
+        self.assertEqual('application/octet-stream',
+                         response.headers['Content-Type'])
+        self.assertEqual(b'2345', b''.join(response.app_iter))
+
+    def test_process_request_multiple_ranges(self):
+        response = self._get_range_response('bytes=0-1,-2')
+        self.assertEqual(206, response.status_int)
+        self.assertNotIn('Content-Range', response.headers)
+        content_type = response.headers['Content-Type']
+        self.assertTrue(content_type.startswith(
+            'multipart/byteranges; boundary='))
+        boundary = content_type.split('boundary=')[1]
+
+        body = b''.join(response.app_iter)
+        self.assertEqual(int(response.headers['Content-Length']), len(body))
+        expected = ('\r\n--%(b)s\r\n'
+                    'Content-Type: application/octet-stream\r\n'
+                    'Content-Range: bytes 0-1/10\r\n\r\n01'
+                    '\r\n--%(b)s\r\n'
+                    'Content-Type: application/octet-stream\r\n'
+                    'Content-Range: bytes 8-9/10\r\n\r\n89'
+                    '\r\n--%(b)s--\r\n' % {'b': boundary})
+        self.assertEqual(expected.encode('ascii'), body)
+
+    def test_process_request_range_headers_and_notification(self):
+        notifications = []
+
+        def fake_subject_send_notification(bytes_written, expected_size,
+                                           subject_meta, request, notifier):
+            notifications.append((bytes_written, expected_size))
+
+        self.stubs.Set(subject.api.common, 'subject_send_notification',
+                       fake_subject_send_notification)
+        posthooks = []
+        response = self._get_range_response('bytes=0-1,-2',
+                                            posthooks=posthooks)
+        self.assertEqual('fake_subject',
+                         response.headers['x-subject-meta-name'])
+        self.assertEqual('c1234', response.headers['ETag'])
+        body = b''.join(response.app_iter)
+        self.assertEqual(int(response.headers['Content-Length']), len(body))
+
+        for hook, args, kwargs in posthooks:
+            hook(None, *args, **kwargs)
+        self.assertEqual([(4, 4)], notifications)
+
+    def test_process_request_unsatisfiable_range(self):
+        response = self._get_range_response('bytes=20-30')
+        self.assertEqual(416, response.status_int)
+        self.assertEqual('bytes */10', response.headers['Content-Range'])
+
+    def test_process_request_invalid_range_ignored(self):
+        self.assertIsNone(self._get_range_response('bytes=5-1'))
+
     def test_v2_process_request_without_checksum(self):
         def dummy_img_iterator():
             for i in range(3):
@@ -634,6 +847,42 @@ class TestCacheMiddlewareProcessResponse(base.IsolatedUnitTest):
         actual = cache_filter.process_response(resp)
         self.assertEqual(resp, actual)
 
+    def test_process_GET_response_partial_not_cached(self):
+        """
+        Test that a response carrying only part of an subject is not tee'd
+        into the cache.
+        """
+        cache_filter = ProcessRequestTestCacheFilter()
+        cache_filter._get_v1_subject_metadata = self.fail
+        subject_id = 'test1'
+        request = webob.Request.blank('/v1/subjects/%s' % subject_id)
+        request.context = context.RequestContext()
+        app_iter = iter([b'x' * 10])
+        resp = webob.Response(request=request, app_iter=app_iter,
+                              status=206)
+        actual = cache_filter._process_GET_response(resp, subject_id,
+                                                    version='v1')
+        self.assertEqual(resp, actual)
+        self.assertIs(app_iter, actual.app_iter)
+
+    def test_process_GET_response_range_miss_not_cached(self):
+        """
+        Test that the response to a range request missing the cache is not
+        tee'd into the cache, even when it is not a 206 response.
+        """
+        cache_filter = ProcessRequestTestCacheFilter()
+        cache_filter._get_v1_subject_metadata = self.fail
+        subject_id = 'test1'
+        request = webob.Request.blank('/v1/subjects/%s' % subject_id)
+        request.context = context.RequestContext()
+        request.headers['Range'] = 'bytes=0-9'
+        app_iter = iter([b'x' * 10])
+        resp = webob.Response(request=request, app_iter=app_iter)
+        actual = cache_filter._process_GET_response(resp, subject_id,
+                                                    version='v1')
+        self.assertEqual(resp, actual)
+        self.assertIs(app_iter, actual.app_iter)
+
     def test_process_response_without_download_subject_policy(self):
         """
         Test for cache middleware raise webob.exc.HTTPForbidden directly
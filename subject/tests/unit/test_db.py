@@ -25,6 +25,7 @@ from oslo_utils import timeutils
 
 from subject.common import crypt
 from subject.common import exception
+from subject.common import metadata_cache
 import subject.context
 import subject.db
 from subject.db.sqlalchemy import api
@@ -175,6 +176,21 @@ class TestSubjectRepo(test_utils.BaseTestCase):
         self.assertEqual(256, subject.size)
         self.assertEqual(TENANT1, subject.owner)
 
+    def test_get_metadata_cached(self):
+        self.config(subject_metadata_cache_size=10)
+        self.addCleanup(metadata_cache.clear)
+        with mock.patch.object(self.db, 'subject_get_with_tags',
+                               wraps=self.db.subject_get_with_tags) as get:
+            subject = self.subject_repo.get(UUID1)
+            subject.name = 'foo'
+            subject = self.subject_repo.get(UUID1)
+            self.assertEqual('1', subject.name)
+            self.assertEqual(1, get.call_count)
+
+            self.subject_repo.save(subject)
+            self.subject_repo.get(UUID1)
+            self.assertEqual(2, get.call_count)
+
     def test_location_value(self):
         subject = self.subject_repo.get(UUID3)
         self.assertEqual(UUID3_LOCATION, subject.locations[0]['url'])
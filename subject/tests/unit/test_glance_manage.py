@@ -37,7 +37,33 @@ class DBCommandsTestCase(test_utils.BaseTestCase):
     def test_purge_command(self, mock_context, mock_db_purge):
         mock_context.return_value = self.context
         self.commands.purge(1, 100)
-        mock_db_purge.assert_called_once_with(self.context, 1, 100)
+        mock_db_purge.assert_called_once_with(self.context, 1, 100,
+                                              batch_sleep=0,
+                                              batch_duration=None,
+                                              dry_run=False)
+
+    @mock.patch.object(db_api, 'purge_deleted_rows')
+    @mock.patch.object(context, 'get_admin_context')
+    def test_purge_command_batches(self, mock_context, mock_db_purge):
+        mock_context.return_value = self.context
+        self.commands.purge(1, 100, batch_sleep=0.5, batch_duration=2,
+                            dry_run=True)
+        mock_db_purge.assert_called_once_with(self.context, 1, 100,
+                                              batch_sleep=0.5,
+                                              batch_duration=2,
+                                              dry_run=True)
+
+    def test_purge_command_negative_batch_sleep(self):
+        exit = self.assertRaises(SystemExit, self.commands.purge, 1, 100,
+                                 batch_sleep=-1)
+        self.assertEqual("Must supply a non-negative value for batch sleep.",
+                         exit.code)
+
+    def test_purge_command_zero_batch_duration(self):
+        exit = self.assertRaises(SystemExit, self.commands.purge, 1, 100,
+                                 batch_duration=0)
+        self.assertEqual("Must supply a positive, non-zero value for batch "
+                         "duration.", exit.code)
 
     def test_purge_command_negative_rows(self):
         exit = self.assertRaises(SystemExit, self.commands.purge, 1, -1)
@@ -63,7 +89,10 @@ class DBCommandsTestCase(test_utils.BaseTestCase):
         mock_context.return_value = self.context
         value = (2 ** 31) - 1
         self.commands.purge(age_in_days=1, max_rows=value)
-        mock_db_purge.assert_called_once_with(self.context, 1, value)
+        mock_db_purge.assert_called_once_with(self.context, 1, value,
+                                              batch_sleep=0,
+                                              batch_duration=None,
+                                              dry_run=False)
 
     def test_purge_command_exceeded_maximum_rows(self):
         # value(2 ** 31) is greater than max_rows(2147483647) by 1.
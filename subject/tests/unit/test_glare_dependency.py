@@ -0,0 +1,153 @@
+# Copyright 2016 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+from datetime import datetime
+
+import mock
+
+from subject.common import exception as exc
+from subject.common.glare import definitions
+from subject.glare import dependency
+from subject.glare import updater
+from subject.tests import utils
+
+
+class ArtifactStub(definitions.ArtifactType):
+    depends_on = definitions.ArtifactReference()
+    depends_on_list = definitions.ArtifactReferenceList()
+
+
+def _artifact(artifact_id, depends_on=None, depends_on_list=None):
+    ts = datetime.now()
+    artifact = ArtifactStub(id=artifact_id, state='creating', created_at=ts,
+                            updated_at=ts, version='1.0', owner='me',
+                            name=artifact_id)
+    if depends_on is not None:
+        artifact.depends_on = depends_on
+    if depends_on_list is not None:
+        artifact.depends_on_list = depends_on_list
+    return artifact
+
+
+class FakeArtifactRepo(object):
+    def __init__(self, artifacts):
+        self.artifacts = {art.id: art for art in artifacts}
+        self.get_many_calls = []
+
+    def get_many(self, artifact_ids):
+        self.get_many_calls.append(sorted(artifact_ids))
+        return [self.artifacts[artifact_id] for artifact_id in artifact_ids
+                if artifact_id in self.artifacts]
+
+
+class GetOnlyArtifactRepo(object):
+    def __init__(self, artifacts):
+        self.artifacts = {art.id: art for art in artifacts}
+        self.get_calls = []
+
+    def get(self, artifact_id):
+        self.get_calls.append(artifact_id)
+        return self.artifacts[artifact_id]
+
+
+class TestDependencyResolver(utils.BaseTestCase):
+    def setUp(self):
+        super(TestDependencyResolver, self).setUp()
+        # the ids of the dependencies of a stored artifact are fetched,
+        # the dependency objects it carries are only used for their ids
+        leaves = [_artifact('leaf%d' % i) for i in range(30)]
+        middle = _artifact('middle', depends_on_list=leaves)
+        top = [_artifact('top%d' % i, depends_on=middle) for i in range(30)]
+        self.base_repo = FakeArtifactRepo(leaves + [middle] + top)
+        self.top_ids = [art.id for art in top]
+        self.resolver = dependency.DependencyResolver(self.base_repo)
+
+    def test_resolve_one_round_trip_per_level(self):
+        arts = self.resolver.resolve('new', self.top_ids)
+        self.assertEqual(self.top_ids, [art.id for art in arts])
+        self.assertEqual(3, len(self.base_repo.get_many_calls))
+        self.assertEqual(sorted(self.top_ids),
+                         self.base_repo.get_many_calls[0])
+        self.assertEqual(['middle'], self.base_repo.get_many_calls[1])
+        self.assertEqual(30, len(self.base_repo.get_many_calls[2]))
+
+    def test_resolve_uses_identity_map(self):
+        arts = self.resolver.resolve('new', self.top_ids[:1])
+        self.assertEqual(arts, self.resolver.resolve('new', self.top_ids[:1]))
+        self.resolver.resolve('new', ['middle'])
+        self.assertEqual(3, len(self.base_repo.get_many_calls))
+
+    def test_forget(self):
+        self.resolver.resolve('new', ['leaf0'])
+        self.resolver.forget('leaf0')
+        self.resolver.resolve('new', ['leaf0'])
+        self.assertEqual([['leaf0'], ['leaf0']],
+                         self.base_repo.get_many_calls)
+
+    def test_circular_dependency(self):
+        self.assertRaises(exc.ArtifactCircularDependency,
+                          self.resolver.resolve, 'top0', ['top0'])
+        self.assertRaises(exc.ArtifactCircularDependency,
+                          self.resolver.resolve, 'leaf3', self.top_ids)
+
+    def test_circular_dependency_through_identity_map(self):
+        self.resolver.resolve('new', self.top_ids)
+        self.assertRaises(exc.ArtifactCircularDependency,
+                          self.resolver.resolve, 'leaf3', ['top0'])
+
+    def test_not_found(self):
+        self.assertRaises(exc.ArtifactNotFound,
+                          self.resolver.resolve, 'new', ['top0', 'missing'])
+
+    def test_hidden_indirect_dependency(self):
+        # middle, which top0 depends on, is not visible to the caller
+        del self.base_repo.artifacts['middle']
+        arts = self.resolver.resolve('new', ['top0'])
+        self.assertEqual(['top0'], [art.id for art in arts])
+        self.assertEqual([['top0'], ['middle']],
+                         self.base_repo.get_many_calls)
+        # the hidden artifact is not asked for again
+        self.resolver.resolve('new', ['top1'])
+        self.assertEqual(['top1'], self.base_repo.get_many_calls[-1])
+        # but it is not found as a direct dependency
+        self.assertRaises(exc.ArtifactNotFound,
+                          self.resolver.resolve, 'new', ['middle'])
+
+    def test_set_dependency_list(self):
+        repo = dependency.ArtifactRepo(self.base_repo, plugins=None)
+        artifact = repo.helper.proxy(_artifact('new'))
+        artifact.depends_on_list = ['leaf0', 'leaf1']
+        artifact.depends_on = 'middle'
+        self.assertEqual(['leaf0', 'leaf1'],
+                         [art.id for art in artifact.depends_on_list])
+        self.assertEqual('middle', artifact.depends_on.id)
+        # the leaves already fetched are not fetched again for middle
+        self.assertEqual([['leaf0', 'leaf1'], ['middle']],
+                         self.base_repo.get_many_calls[:2])
+        self.assertEqual(28, len(self.base_repo.get_many_calls[2]))
+
+    def test_get_many_falls_back_to_get(self):
+        base_repo = GetOnlyArtifactRepo(self.base_repo.artifacts.values())
+        repo = dependency.ArtifactRepo(base_repo, plugins=None)
+        factory = dependency.ArtifactFactory(
+            mock.Mock(new_artifact=lambda **kwargs: _artifact('new')),
+            ArtifactStub, updater.ArtifactRepoProxy(repo))
+        artifact = factory.new_artifact(depends_on='top0',
+                                        depends_on_list=['leaf0'])
+        self.assertEqual('top0', artifact.depends_on.id)
+        self.assertEqual(['leaf0'],
+                         [art.id for art in artifact.depends_on_list])
+        # leaf0 is fetched once, although top0 depends on it through middle
+        self.assertEqual(32, len(base_repo.get_calls))
+        self.assertEqual(32, len(set(base_repo.get_calls)))
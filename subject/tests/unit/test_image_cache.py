@@ -240,6 +240,54 @@ class SubjectCacheTestCase(object):
         self.assertEqual(0, self.cache.get_cache_size())
         self.assertFalse(self.cache.is_cached('xxx'))
 
+    @skip_if_disabled
+    def test_prune_to_target_size(self):
+        """
+        Test that the pruner frees space down to the configured target
+        size, removing the least recently accessed subjects first.
+        """
+        for x in range(10):
+            FIXTURE_FILE = six.BytesIO(FIXTURE_DATA)
+            self.assertTrue(self.cache.cache_subject_file(x, FIXTURE_FILE))
+
+        for x in range(10):
+            with self.cache.open_for_read(x) as cache_file:
+                for chunk in cache_file:
+                    pass
+
+        self.config(subject_cache_prune_target_size=3 * units.Ki)
+        self.assertEqual((7, 7 * units.Ki), self.cache.prune())
+
+        self.assertEqual(3 * units.Ki, self.cache.get_cache_size())
+        for x in range(0, 7):
+            self.assertFalse(self.cache.is_cached(x),
+                             "Subject %s was cached!" % x)
+        for x in range(7, 10):
+            self.assertTrue(self.cache.is_cached(x),
+                            "Subject %s was not cached!" % x)
+
+    @skip_if_disabled
+    def test_get_prune_candidates(self):
+        """
+        Test that prune candidates are returned oldest first and only
+        cover the number of bytes asked for.
+        """
+        for x in range(3):
+            FIXTURE_FILE = six.BytesIO(FIXTURE_DATA)
+            self.assertTrue(self.cache.cache_subject_file(x, FIXTURE_FILE))
+
+        for x in range(3):
+            with self.cache.open_for_read(x) as cache_file:
+                for chunk in cache_file:
+                    pass
+
+        self.assertEqual([], self.cache.driver.get_prune_candidates(0))
+        self.assertEqual([('0', FIXTURE_LENGTH), ('1', FIXTURE_LENGTH)],
+                         self.cache.driver.get_prune_candidates(
+                             FIXTURE_LENGTH + 1))
+        self.assertEqual(3, len(self.cache.driver.get_prune_candidates(
+            10 * FIXTURE_LENGTH)))
+
     @skip_if_disabled
     def test_queue(self):
         """
@@ -323,6 +371,50 @@ class SubjectCacheTestCase(object):
         self.assertFalse(os.path.exists(incomplete_file_path))
         self.assertTrue(os.path.exists(invalid_file_path))
 
+    def test_cache_tee_iter_resume(self):
+        """
+        Test that a fetch interrupted part way through can be resumed from
+        the partial file left in the invalid/ directory
+        """
+        subject_id = '1'
+        data = b'a' * 1024 + b'b' * 1024
+        checksum = hashlib.md5(data).hexdigest()
+
+        def failing_iter():
+            yield data[:700]
+            raise IOError
+
+        list(self.cache.cache_tee_iter(subject_id, failing_iter(), checksum))
+        self.assertFalse(self.cache.is_cached(subject_id))
+
+        offset = self.cache.get_resumable_size(subject_id, len(data))
+        self.assertEqual(700, offset)
+
+        tee_iter = self.cache.cache_tee_iter(subject_id, iter([data[offset:]]),
+                                             checksum, offset=offset)
+        self.assertEqual(data[offset:], b''.join(tee_iter))
+        self.assertTrue(self.cache.is_cached(subject_id))
+        with self.cache.open_for_read(subject_id) as cache_file:
+            self.assertEqual(data, cache_file.read())
+        self.assertEqual(0, self.cache.get_resumable_size(subject_id,
+                                                          len(data)))
+
+    def test_get_resumable_size_full_file(self):
+        """
+        Test that a partial file as large as the subject, which was fetched
+        in full and failed verification, is not resumed
+        """
+        subject_id = '1'
+        try:
+            with self.cache.driver.open_for_write(subject_id) as cache_file:
+                cache_file.write(b'a' * 10)
+                raise IOError
+        except IOError:
+            pass
+
+        self.assertEqual(0, self.cache.get_resumable_size(subject_id, 10))
+        self.assertEqual(10, self.cache.get_resumable_size(subject_id, 20))
+
     def test_caching_iterator(self):
         """
         Test to see if the caching iterator interacts properly with the driver
@@ -431,6 +523,139 @@ class SubjectCacheTestCase(object):
         # checksum is invalid, caching will fail:
         self.assertFalse(cache.is_cached(subject_id))
 
+    def test_get_fill_iter_disabled(self):
+        """
+        Test that no fill is followed unless single-flight filling is on.
+        """
+        subject_id = '1'
+        caching_iter = self.cache.get_caching_iter(subject_id, None,
+                                                   iter([b'a', b'b']))
+        self.assertEqual(b'a', next(caching_iter))
+        self.assertIsNone(self.cache.get_fill_iter(subject_id))
+        self.assertEqual([b'b'], list(caching_iter))
+
+    def test_get_fill_iter_follows_fill(self):
+        """
+        Test that a second reader follows the in-flight fill of an subject
+        and sees exactly the data written by it.
+        """
+        self.config(subject_cache_single_flight=True)
+        subject_id = '1'
+        data = [b'a', b'b', b'c', b'd', b'e', b'f']
+        self.assertIsNone(self.cache.get_fill_iter(subject_id))
+
+        caching_iter = self.cache.get_caching_iter(subject_id, None,
+                                                   iter(data))
+        self.assertEqual(b'a', next(caching_iter))
+
+        fill_iter = self.cache.get_fill_iter(subject_id)
+        self.assertIsNotNone(fill_iter)
+        self.assertEqual(b'a', next(fill_iter))
+
+        self.assertEqual(data[1:], list(caching_iter))
+        self.assertEqual(b''.join(data[1:]), b''.join(fill_iter))
+        self.assertTrue(self.cache.is_cached(subject_id))
+        self.assertIsNone(self.cache.get_fill_iter(subject_id))
+
+    def test_get_fill_iter_fill_aborted(self):
+        """
+        Test that a reader following a fill fails when the fill is
+        abandoned before completion.
+        """
+        self.config(subject_cache_single_flight=True)
+        subject_id = '1'
+        data = [b'a', b'b', b'c']
+
+        caching_iter = self.cache.get_caching_iter(subject_id, None,
+                                                   iter(data))
+        self.assertEqual(b'a', next(caching_iter))
+        fill_iter = self.cache.get_fill_iter(subject_id)
+        self.assertEqual(b'a', next(fill_iter))
+
+        caching_iter.close()
+        self.assertRaises(exception.GlanceException, next, fill_iter)
+        self.assertFalse(self.cache.is_cached(subject_id))
+        self.assertIsNone(self.cache.get_fill_iter(subject_id))
+
+    def test_get_fill_iter_fill_failed_before_open(self):
+        """
+        Test that a fill which fails before the reader opens its file is
+        not followed, so that the reader falls through to the backend.
+        """
+        self.config(subject_cache_single_flight=True)
+        subject_id = '1'
+
+        caching_iter = self.cache.get_caching_iter(subject_id, None,
+                                                   iter([b'a', b'b']))
+        self.assertEqual(b'a', next(caching_iter))
+        fill = subject_cache._FILLS[subject_id]
+        # the fill fails, and its file is moved away, while still
+        # registered
+        fill.finish(failed=True)
+        os.unlink(self.cache.driver.get_subject_filepath(subject_id,
+                                                         'incomplete'))
+        self.assertIsNone(self.cache.get_fill_iter(subject_id))
+        caching_iter.close()
+
+    def test_get_fill_iter_fill_file_gone(self):
+        """
+        Test that a fill whose file is gone before the reader opens it is
+        not followed.
+        """
+        self.config(subject_cache_single_flight=True)
+        subject_id = '1'
+
+        caching_iter = self.cache.get_caching_iter(subject_id, None,
+                                                   iter([b'a', b'b']))
+        self.assertEqual(b'a', next(caching_iter))
+        os.unlink(self.cache.driver.get_subject_filepath(subject_id,
+                                                         'incomplete'))
+        self.assertIsNone(self.cache.get_fill_iter(subject_id))
+        caching_iter.close()
+
+    def test_get_fill_iter_fill_stalled_before_data(self):
+        """
+        Test that a fill which writes nothing within the wait timeout is
+        abandoned, so that the reader falls through to the backend.
+        """
+        self.config(subject_cache_single_flight=True,
+                    subject_cache_fill_wait_timeout=1)
+        subject_id = '1'
+
+        caching_iter = self.cache.get_caching_iter(subject_id, None,
+                                                   iter([b'', b'a']))
+        self.assertEqual(b'', next(caching_iter))
+        start = time.time()
+        self.assertIsNone(self.cache.get_fill_iter(subject_id))
+        self.assertGreaterEqual(time.time() - start, 1)
+
+        # later readers do not wait on the abandoned fill at all
+        start = time.time()
+        self.assertIsNone(self.cache.get_fill_iter(subject_id))
+        self.assertLess(time.time() - start, 1)
+
+        self.assertEqual([b'a'], list(caching_iter))
+        self.assertTrue(self.cache.is_cached(subject_id))
+
+    def test_get_fill_iter_fill_stalled(self):
+        """
+        Test that a reader following a fill fails when the fill writes
+        nothing more within the wait timeout.
+        """
+        self.config(subject_cache_single_flight=True,
+                    subject_cache_fill_wait_timeout=1)
+        subject_id = '1'
+
+        caching_iter = self.cache.get_caching_iter(subject_id, None,
+                                                   iter([b'a', b'b']))
+        self.assertEqual(b'a', next(caching_iter))
+        fill_iter = self.cache.get_fill_iter(subject_id)
+        self.assertEqual(b'a', next(fill_iter))
+
+        self.assertRaises(exception.GlanceException, next, fill_iter)
+        self.assertIsNone(self.cache.get_fill_iter(subject_id))
+        self.assertEqual([b'b'], list(caching_iter))
+
 
 class TestSubjectCacheXattr(test_utils.BaseTestCase,
                           SubjectCacheTestCase):
@@ -473,6 +698,51 @@ class TestSubjectCacheXattr(test_utils.BaseTestCase,
             return
 
 
+class TestSubjectCacheXattrLedger(TestSubjectCacheXattr):
+
+    """Tests subject caching when xattr is used with a ledger in cache"""
+
+    def setUp(self):
+        super(TestSubjectCacheXattrLedger, self).setUp()
+
+        if getattr(self, 'disabled', False):
+            return
+
+        self.config(subject_cache_xattr_ledger=True)
+        self.cache = subject_cache.SubjectCache()
+
+    @skip_if_disabled
+    def test_ledger_shared_between_caches(self):
+        """
+        Test that changes made through one cache are seen by another one
+        using the same cache directory.
+        """
+        other_cache = subject_cache.SubjectCache()
+        self._setup_fixture_file()
+        self.assertEqual(FIXTURE_LENGTH, other_cache.get_cache_size())
+
+        self.cache.delete_cached_subject(1)
+        self.assertEqual(0, other_cache.get_cache_size())
+        self.assertEqual([], other_cache.get_cached_subjects())
+
+    @skip_if_disabled
+    def test_reconcile(self):
+        """
+        Test that reconciling the cache rebuilds the ledger from the files
+        in the cache directory.
+        """
+        self._setup_fixture_file()
+        with open(os.path.join(self.cache_dir, '2'), 'wb') as cache_file:
+            cache_file.write(FIXTURE_DATA)
+
+        self.assertEqual(FIXTURE_LENGTH, self.cache.get_cache_size())
+        self.cache.reconcile()
+        self.assertEqual(2 * FIXTURE_LENGTH, self.cache.get_cache_size())
+        self.assertEqual(['1', '2'],
+                         [entry['subject_id'] for entry
+                          in self.cache.get_cached_subjects()])
+
+
 class TestSubjectCacheSqlite(test_utils.BaseTestCase,
                            SubjectCacheTestCase):
 
@@ -505,6 +775,50 @@ class TestSubjectCacheSqlite(test_utils.BaseTestCase,
                     subject_cache_max_size=5 * units.Ki)
         self.cache = subject_cache.SubjectCache()
 
+    def test_get_db_reuses_connections(self):
+        """Test that database connections are pooled and use WAL."""
+        driver = self.cache.driver
+        with driver.get_db() as db:
+            first = db
+            mode = db.execute('PRAGMA journal_mode').fetchone()[0]
+        self.assertEqual('wal', mode.lower())
+
+        with driver.get_db() as db:
+            self.assertIs(first, db)
+
+    def test_hits_buffered_until_flush(self):
+        """
+        Test that cache hit statistics are buffered when a flush interval
+        is configured, and written out before they are read.
+        """
+        self.config(subject_cache_sqlite_flush_interval=3600)
+        self._setup_fixture_file()
+
+        for x in range(2):
+            with self.cache.open_for_read(1) as cache_file:
+                for chunk in cache_file:
+                    pass
+
+        with self.cache.driver.get_db() as db:
+            cur = db.execute("""SELECT hits FROM cached_subjects
+                             WHERE subject_id = ?""", ('1',))
+            self.assertEqual(0, cur.fetchone()[0])
+
+        self.assertEqual(2, self.cache.get_hit_count(1))
+
+    def test_hits_buffered_dropped_on_delete(self):
+        """Test that buffered hits of a deleted subject are discarded."""
+        self.config(subject_cache_sqlite_flush_interval=3600)
+        self._setup_fixture_file()
+
+        with self.cache.open_for_read(1) as cache_file:
+            for chunk in cache_file:
+                pass
+        self.cache.delete_cached_subject(1)
+
+        self.assertEqual({}, self.cache.driver._pending_hits)
+        self.assertEqual([], self.cache.get_cached_subjects())
+
 
 class TestSubjectCacheNoDep(test_utils.BaseTestCase):
 
@@ -561,3 +875,61 @@ class TestSubjectCacheNoDep(test_utils.BaseTestCase):
 
         caching_iter = cache.get_caching_iter('dummy_id', None, iter(data))
         self.assertEqual(data, list(caching_iter))
+
+    def test_get_caching_iter_tinylfu_admission(self):
+        self.config(subject_cache_admission_policy='tinylfu',
+                    subject_cache_admission_min_hits=2)
+
+        class CountingDriver(object):
+
+            writes = 0
+
+            def is_cacheable(self, *args, **kwargs):
+                return True
+
+            @contextmanager
+            def open_for_write(self, *args, **kwargs):
+                CountingDriver.writes += 1
+                yield six.BytesIO()
+
+        self.driver = CountingDriver()
+        cache = subject_cache.SubjectCache()
+        data = [b'a', b'b']
+
+        self.assertEqual(data, list(cache.get_caching_iter('dummy_id', None,
+                                                           iter(data))))
+        self.assertEqual(0, CountingDriver.writes)
+        self.assertEqual(data, list(cache.get_caching_iter('dummy_id', None,
+                                                           iter(data))))
+        self.assertEqual(1, CountingDriver.writes)
+
+    def test_prune_gdsf_eviction(self):
+        self.config(subject_cache_eviction_policy='gdsf',
+                    subject_cache_max_size=10)
+        now = time.time()
+
+        class EntriesDriver(object):
+
+            deleted = []
+
+            def get_cache_size(self):
+                return 1110
+
+            def get_cached_subjects(self):
+                return [
+                    {'subject_id': 'large', 'size': 1000, 'hits': 50,
+                     'last_accessed': now},
+                    {'subject_id': 'small', 'size': 10, 'hits': 1,
+                     'last_accessed': now},
+                    {'subject_id': 'stale', 'size': 100, 'hits': 50,
+                     'last_accessed': now - 365 * 24 * 3600},
+                ]
+
+            def delete_cached_subjects(self, subject_ids):
+                EntriesDriver.deleted.extend(subject_ids)
+
+        self.driver = EntriesDriver()
+        cache = subject_cache.SubjectCache()
+
+        self.assertEqual((2, 1100), cache.prune())
+        self.assertEqual(['stale', 'large'], EntriesDriver.deleted)
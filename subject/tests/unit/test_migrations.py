@@ -142,73 +142,34 @@ class MigrationsMixin(test_migrations.WalkVersionsMixin):
 
         self._walk_versions(False, False)
 
-    def _pre_upgrade_003(self, engine):
-        now = datetime.datetime.now()
-        subjects = db_utils.get_table(engine, 'subjects')
-        data = {'deleted': False, 'created_at': now, 'updated_at': now,
-                'type': 'kernel', 'status': 'active', 'is_public': True}
-        subjects.insert().values(data).execute()
-        return data
+    def _check_002(self, engine, data):
+        usage = db_utils.get_table(engine, 'subject_storage_usage')
+        self.assertEqual(['owner', 'size'], sorted(usage.c.keys()))
 
     def _check_003(self, engine, data):
         subjects = db_utils.get_table(engine, 'subjects')
-        self.assertNotIn('type', subjects.c,
-                         "'type' column found in subjects table columns! "
-                         "subjects table columns reported by metadata: %s\n"
-                         % subjects.c.keys())
-        subjects_prop = db_utils.get_table(engine, 'subject_properties')
-        result = subjects_prop.select().execute()
-        types = []
-        for row in result:
-            if row['key'] == 'type':
-                types.append(row['value'])
-        self.assertIn(data['type'], types)
-
-    def _pre_upgrade_004(self, engine):
-        """Insert checksum data sample to check if migration goes fine with
-        data.
-        """
-        now = timeutils.utcnow()
-        subjects = db_utils.get_table(engine, 'subjects')
-        data = [
-            {
-                'deleted': False, 'created_at': now, 'updated_at': now,
-                'type': 'kernel', 'status': 'active', 'is_public': True,
-            }
-        ]
-        engine.execute(subjects.insert(), data)
-        return data
+        index_data = [(idx.name, [c.name for c in idx.columns])
+                      for idx in subjects.indexes]
+        self.assertIn(('created_at_id_subject_idx', ['created_at', 'id']),
+                      index_data)
 
     def _check_004(self, engine, data):
-        """Assure that checksum data is present on table"""
-        subjects = db_utils.get_table(engine, 'subjects')
-        self.assertIn('checksum', subjects.c)
-        self.assertEqual(32, subjects.c['checksum'].type.length)
-
-    def _pre_upgrade_005(self, engine):
-        now = timeutils.utcnow()
-        subjects = db_utils.get_table(engine, 'subjects')
-        data = [
-            {
-                'deleted': False, 'created_at': now, 'updated_at': now,
-                'type': 'kernel', 'status': 'active', 'is_public': True,
-                # Integer type signed size limit
-                'size': 2147483647
-            }
-        ]
-        engine.execute(subjects.insert(), data)
-        return data
+        locations = db_utils.get_table(engine, 'subject_locations')
+        index_data = [(idx.name, [c.name for c in idx.columns])
+                      for idx in locations.indexes]
+        self.assertIn(('ix_subject_locations_status_deleted_at',
+                       ['status', 'deleted_at']), index_data)
 
     def _check_005(self, engine, data):
-
         subjects = db_utils.get_table(engine, 'subjects')
-        select = subjects.select().execute()
-
-        sizes = [row['size'] for row in select if row['size'] is not None]
-        migrated_data_sizes = [element['size'] for element in data]
-
-        for migrated in migrated_data_sizes:
-            self.assertIn(migrated, sizes)
+        self.assertIsInstance(subjects.c['os_hash_algo'].type, types.String)
+        self.assertEqual(64, subjects.c['os_hash_algo'].type.length)
+        self.assertIsInstance(subjects.c['os_hash_value'].type, types.String)
+        self.assertEqual(128, subjects.c['os_hash_value'].type.length)
+        index_data = [(idx.name, [c.name for c in idx.columns])
+                      for idx in subjects.indexes]
+        self.assertIn(('os_hash_value_subject_idx', ['os_hash_value']),
+                      index_data)
 
     def _pre_upgrade_006(self, engine):
         now = timeutils.utcnow()
@@ -15,11 +15,16 @@
 #    under the License.
 
 import datetime
+import errno
+import os
 
+import eventlet
+import fixtures
 import glance_store
 import mock
 from oslo_config import cfg
 import oslo_messaging
+from oslo_serialization import jsonutils
 import webob
 
 import subject.async
@@ -137,6 +142,129 @@ class TestNotifier(utils.BaseTestCase):
         notifier.set_defaults()
         mock_set_trans_defaults.assert_called_with('subject')
 
+    @mock.patch.object(notifier.atexit, 'register')
+    @mock.patch.object(oslo_messaging, 'Notifier')
+    @mock.patch.object(oslo_messaging, 'get_notification_transport')
+    def test_notifier_queues_notifications(self, mock_get_transport,
+                                           mock_notifier, mock_register):
+        self.config(notification_queue_size=10)
+        self.stubs.Set(notifier, '_DISPATCHER', None)
+        nfier = notifier.Notifier()
+        nfier.info('subject.send', {'bytes_sent': 3})
+        nfier.error('subject.upload', 'failed')
+        self.assertFalse(mock_notifier.return_value.info.called)
+        self.assertEqual(2, notifier.get_dispatcher().depth)
+        mock_register.assert_called_once_with(notifier.flush)
+
+        notifier.flush()
+        mock_notifier.return_value.info.assert_called_once_with(
+            {}, 'subject.send', {'bytes_sent': 3})
+        mock_notifier.return_value.error.assert_called_once_with(
+            {}, 'subject.upload', 'failed')
+        self.assertEqual(0, notifier.get_dispatcher().depth)
+
+    @mock.patch.object(oslo_messaging, 'Notifier')
+    @mock.patch.object(oslo_messaging, 'get_notification_transport')
+    def test_notifier_sends_without_queue(self, mock_get_transport,
+                                          mock_notifier):
+        self.stubs.Set(notifier, '_DISPATCHER', None)
+        nfier = notifier.Notifier()
+        nfier.warn('subject.send', {})
+        mock_notifier.return_value.warn.assert_called_once_with(
+            {}, 'subject.send', {})
+        self.assertIsNone(notifier.get_dispatcher())
+
+
+class TestNotificationDispatcher(utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestNotificationDispatcher, self).setUp()
+        self.notifier = mock.Mock(publisher_id='subject.localhost')
+        self.spill_dir = self.useFixture(fixtures.TempDir()).path
+
+    def _put(self, dispatcher, count):
+        for i in range(count):
+            dispatcher.put(self.notifier, 'info', 'subject.send', {'n': i})
+
+    def _sent(self):
+        return [c[0][2]['n'] for c in self.notifier.info.call_args_list]
+
+    def test_send_in_batches(self):
+        dispatcher = notifier.NotificationDispatcher(10, 2)
+        self._put(dispatcher, 5)
+        self.assertEqual(5, dispatcher.depth)
+        eventlet.sleep(0)
+        self.assertEqual([0, 1], self._sent())
+        dispatcher.flush(1)
+        self.assertEqual([0, 1, 2, 3, 4], self._sent())
+        self.assertEqual({'depth': 0, 'sent': 5, 'failed': 0, 'dropped': 0,
+                          'spilled': 0}, dispatcher.get_stats())
+
+    def test_send_failure_counted(self):
+        self.notifier.info.side_effect = [Exception('broker'), None]
+        dispatcher = notifier.NotificationDispatcher(10, 10)
+        self._put(dispatcher, 2)
+        dispatcher.flush(1)
+        self.assertEqual(1, dispatcher.sent)
+        self.assertEqual(1, dispatcher.failed)
+
+    def test_overflow_drop(self):
+        dispatcher = notifier.NotificationDispatcher(2, 10)
+        self._put(dispatcher, 5)
+        self.assertEqual(2, dispatcher.depth)
+        self.assertEqual(3, dispatcher.dropped)
+        dispatcher.flush(1)
+        self.assertEqual([0, 1], self._sent())
+
+    def test_overflow_spill(self):
+        dispatcher = notifier.NotificationDispatcher(
+            2, 10, overflow_policy='spill', spill_dir=self.spill_dir)
+        self.stubs.Set(dispatcher, '_get_notifier',
+                       lambda publisher_id: self.notifier)
+        self._put(dispatcher, 5)
+        self.assertEqual(3, dispatcher.spilled)
+        with open(dispatcher.spill_path) as spill_file:
+            spilled = [jsonutils.loads(line) for line in spill_file]
+        self.assertEqual([2, 3, 4], [e['payload']['n'] for e in spilled])
+
+        dispatcher.flush(1)
+        self.assertEqual([0, 1, 2, 3, 4], self._sent())
+        self.assertFalse(os.path.exists(dispatcher.spill_path))
+
+    def test_flush_timeout_drops_queued(self):
+        dispatcher = notifier.NotificationDispatcher(10, 10)
+        self._put(dispatcher, 3)
+        dispatcher.flush(0)
+        self.assertEqual(3, dispatcher.dropped)
+        self.assertEqual(0, dispatcher.depth)
+
+    def test_flush_timeout_spills_queued(self):
+        dispatcher = notifier.NotificationDispatcher(
+            10, 10, overflow_policy='spill', spill_dir=self.spill_dir)
+        self._put(dispatcher, 3)
+        dispatcher.flush(0)
+        self.assertEqual(3, dispatcher.spilled)
+        self.assertEqual(0, dispatcher.dropped)
+        self.assertTrue(os.path.exists(dispatcher.spill_path))
+
+    @mock.patch.object(notifier.os, 'kill')
+    def test_adopt_spilled(self, mock_kill):
+        mock_kill.side_effect = OSError(errno.ESRCH, 'No such process')
+        spill_path = os.path.join(self.spill_dir, 'notifications-1.spill')
+        with open(spill_path, 'w') as spill_file:
+            spill_file.write(jsonutils.dumps({
+                'publisher_id': 'subject.host1', 'priority': 'info',
+                'event_type': 'subject.send', 'payload': {'n': 7}}) + '\n')
+
+        with mock.patch.object(notifier.NotificationDispatcher,
+                               '_get_notifier', return_value=self.notifier):
+            dispatcher = notifier.NotificationDispatcher(
+                10, 10, overflow_policy='spill', spill_dir=self.spill_dir)
+            dispatcher.flush(1)
+        mock_kill.assert_called_once_with(1, 0)
+        self.assertEqual([7], self._sent())
+        self.assertEqual([], os.listdir(self.spill_dir))
+
 
 class TestSubjectNotifications(utils.BaseTestCase):
     """Test Subject Notifications work"""
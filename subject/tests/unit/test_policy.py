@@ -18,6 +18,7 @@ import os.path
 
 import mock
 import oslo_config.cfg
+from oslo_policy import policy as oslo_policy
 
 import subject.api.policy
 from subject.common import exception
@@ -182,6 +183,108 @@ class TestPolicyEnforcer(base.IsolatedUnitTest):
                           enforcer.enforce, context, 'get_subject', {})
 
 
+class TestPolicyDecisionCache(base.IsolatedUnitTest):
+    def setUp(self):
+        super(TestPolicyDecisionCache, self).setUp()
+        self.config(policy_file=os.path.join(self.test_dir, 'gobble.gobble'),
+                    group='oslo_policy')
+        self.stats = subject.api.policy.DecisionStats()
+        self.stubs.Set(subject.api.policy, 'STATS', self.stats)
+        self.stubs.Set(subject.api.policy, '_CACHE', None)
+        evaluate = oslo_policy.Enforcer.enforce
+        patcher = mock.patch.object(oslo_policy.Enforcer, 'enforce',
+                                    autospec=True, side_effect=evaluate)
+        self.evaluate = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _evaluated(self, action):
+        return [c[0][1] for c in self.evaluate.call_args_list].count(action)
+
+    def _get_context(self, enforcer, roles=None, tenant=None):
+        context = subject.context.RequestContext(
+            roles=roles or ['member'],
+            tenant=tenant or unit_test_utils.TENANT1,
+            policy_enforcer=enforcer)
+        self.evaluate.reset_mock()
+        return context
+
+    def test_request_decisions_cached(self):
+        self.set_policy_rules({'get_subject_location': 'role:member'})
+        enforcer = subject.api.policy.Enforcer()
+        context = self._get_context(enforcer)
+        for i in range(100):
+            enforcer.enforce(context, 'get_subject_location', {})
+        self.assertEqual(1, self._evaluated('get_subject_location'))
+        self.assertEqual(99, self.stats.hits)
+        self.assertEqual(1, self.stats.misses)
+        self.assertEqual(0.99, self.stats.hit_rate)
+
+        context = self._get_context(enforcer)
+        enforcer.enforce(context, 'get_subject_location', {})
+        self.assertEqual(1, self._evaluated('get_subject_location'))
+
+    def test_decisions_keyed_by_referenced_target(self):
+        self.set_policy_rules({'get_subject': 'tenant:%(owner)s'})
+        enforcer = subject.api.policy.Enforcer()
+        context = self._get_context(enforcer)
+        owner, other = unit_test_utils.TENANT1, unit_test_utils.TENANT2
+        for i in range(10):
+            enforcer.enforce(context, 'get_subject',
+                             {'owner': owner, 'name': str(i)})
+            self.assertRaises(exception.Forbidden, enforcer.enforce,
+                              context, 'get_subject',
+                              {'owner': other, 'name': str(i)})
+        self.assertEqual(2, self._evaluated('get_subject'))
+
+    def test_denied_decisions_cached(self):
+        self.set_policy_rules({'get_subject': 'role:admin'})
+        enforcer = subject.api.policy.Enforcer()
+        context = self._get_context(enforcer)
+        for i in range(3):
+            self.assertRaises(exception.Forbidden, enforcer.enforce,
+                              context, 'get_subject', {})
+            self.assertFalse(enforcer.check(context, 'get_subject', {}))
+        self.assertEqual(1, self._evaluated('get_subject'))
+
+    def test_process_decisions_cached(self):
+        self.config(policy_decision_cache_size=10)
+        self.set_policy_rules({'get_subject': 'role:member'})
+        enforcer = subject.api.policy.Enforcer()
+        for tenant in (unit_test_utils.TENANT1, unit_test_utils.TENANT2):
+            context = self._get_context(enforcer, roles=['member'],
+                                        tenant=tenant)
+            enforcer.enforce(context, 'get_subject', {})
+        self.assertEqual(0, self._evaluated('get_subject'))
+
+        context = self._get_context(enforcer, roles=['reader'])
+        self.assertRaises(exception.Forbidden, enforcer.enforce,
+                          context, 'get_subject', {})
+        self.assertEqual(1, self._evaluated('get_subject'))
+
+    def test_process_decisions_invalidated_on_reload(self):
+        self.config(policy_decision_cache_size=10)
+        self.set_policy_rules({'get_subject': 'role:member'})
+        enforcer = subject.api.policy.Enforcer()
+        context = self._get_context(enforcer)
+        enforcer.enforce(context, 'get_subject', {})
+
+        enforcer.set_rules(oslo_policy.Rules.from_dict({'get_subject': '!'}),
+                           overwrite=False)
+        for context in (context, self._get_context(enforcer)):
+            self.assertRaises(exception.Forbidden, enforcer.enforce,
+                              context, 'get_subject', {})
+
+    def test_process_cache_bounded(self):
+        self.config(policy_decision_cache_size=2)
+        self.set_policy_rules({'get_subject': 'tenant:%(owner)s'})
+        enforcer = subject.api.policy.Enforcer()
+        for owner in ('a', 'b', 'c'):
+            self.assertRaises(exception.Forbidden, enforcer.enforce,
+                              self._get_context(enforcer), 'get_subject',
+                              {'owner': owner})
+        self.assertEqual(2, len(subject.api.policy.get_cache()._decisions))
+
+
 class TestPolicyEnforcerNoFile(base.IsolatedUnitTest):
     def test_policy_file_specified_but_not_found(self):
         """Missing defined policy file should result in a default ruleset"""
@@ -46,12 +46,32 @@ class TestBasicSchema(test_utils.BaseTestCase):
         expected = {'ham': 'virginia', 'eggs': 'scrambled'}
         self.assertEqual(expected, filtered)
 
+    def test_validate_reuses_validator(self):
+        self.schema.validate({'ham': 'no'})
+        validator = self.schema._get_validator()
+        self.schema.validate({'eggs': 'scrambled'})
+        self.assertIs(validator, self.schema._get_validator())
+
+    def test_filter_sets_null_extra_properties_empty(self):
+        obj = {'ham': None, 'bacon': None, 'toast': 'brown'}
+        filtered = self.schema.filter(obj)
+        expected = {'ham': None, 'bacon': ''}
+        self.assertEqual(expected, filtered)
+
     def test_merge_properties(self):
         self.schema.merge_properties({'bacon': {'type': 'string'}})
         expected = set(['ham', 'eggs', 'bacon'])
         actual = set(self.schema.raw()['properties'].keys())
         self.assertEqual(expected, actual)
 
+    def test_merge_properties_after_validate_and_filter(self):
+        obj = {'ham': 'virginia', 'bacon': 'crispy'}
+        self.assertRaises(exception.InvalidObject, self.schema.validate, obj)
+        self.assertEqual({'ham': 'virginia'}, self.schema.filter(obj))
+        self.schema.merge_properties({'bacon': {'type': 'string'}})
+        self.schema.validate(obj)  # No exception raised
+        self.assertEqual(obj, self.schema.filter(obj))
+
     def test_merge_conflicting_properties(self):
         conflicts = {'eggs': {'type': 'integer'}}
         self.assertRaises(exception.SchemaLoadError,
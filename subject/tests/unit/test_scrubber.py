@@ -16,6 +16,7 @@
 import uuid
 
 import glance_store
+from mock import call
 from mock import patch
 from mox3 import mox
 from oslo_config import cfg
@@ -45,70 +46,91 @@ class TestScrubber(test_utils.BaseTestCase):
         scrubber._db_queue = None
         super(TestScrubber, self).tearDown()
 
-    def _scrubber_cleanup_with_store_delete_exception(self, ex):
-        uri = 'file://some/path/%s' % uuid.uuid4()
-        id = 'helloworldid'
+    def _scrub_location(self, uri, *results):
         scrub = scrubber.Scrubber(glance_store)
-        scrub.registry = self.mox.CreateMockAnything()
-        scrub.registry.get_subject(id).AndReturn({'status': 'pending_delete'})
-        scrub.registry.update_subject(id, {'status': 'deleted'})
         self.mox.StubOutWithMock(glance_store, "delete_from_backend")
-        glance_store.delete_from_backend(
-            uri,
-            mox.IgnoreArg()).AndRaise(ex)
+        for result in results:
+            call = glance_store.delete_from_backend(uri, mox.IgnoreArg())
+            if isinstance(result, Exception):
+                call.AndRaise(result)
+            else:
+                call.AndReturn(result)
         self.mox.ReplayAll()
-        scrub._scrub_subject(id, [(id, '-', uri)])
+        scrub._scrub_location('helloworldid', 1, uri)
         self.mox.VerifyAll()
+        return scrub
 
     def test_store_delete_successful(self):
         uri = 'file://some/path/%s' % uuid.uuid4()
-        id = 'helloworldid'
-
-        scrub = scrubber.Scrubber(glance_store)
-        scrub.registry = self.mox.CreateMockAnything()
-        scrub.registry.get_subject(id).AndReturn({'status': 'pending_delete'})
-        scrub.registry.update_subject(id, {'status': 'deleted'})
-        self.mox.StubOutWithMock(glance_store, "delete_from_backend")
-        glance_store.delete_from_backend(uri, mox.IgnoreArg()).AndReturn('')
-        self.mox.ReplayAll()
-        scrub._scrub_subject(id, [(id, '-', uri)])
-        self.mox.VerifyAll()
+        scrub = self._scrub_location(uri, '')
+        self.assertEqual([1], scrub.scrubbed)
 
     def test_store_delete_store_exceptions(self):
         # While scrubbing subject data, all store exceptions, other than
-        # NotFound, cause subject scrubbing to fail. Essentially, no attempt
-        # would be made to update the status of subject.
-
+        # NotFound, cause subject scrubbing to fail. Essentially, the
+        # location is not recorded as scrubbed.
+        self.config(scrub_retries=0)
         uri = 'file://some/path/%s' % uuid.uuid4()
-        id = 'helloworldid'
         ex = glance_store.GlanceStoreException()
-
-        scrub = scrubber.Scrubber(glance_store)
-        scrub.registry = self.mox.CreateMockAnything()
-        self.mox.StubOutWithMock(glance_store, "delete_from_backend")
-        glance_store.delete_from_backend(
-            uri,
-            mox.IgnoreArg()).AndRaise(ex)
-        self.mox.ReplayAll()
-        scrub._scrub_subject(id, [(id, '-', uri)])
-        self.mox.VerifyAll()
+        scrub = self._scrub_location(uri, ex)
+        self.assertEqual([], scrub.scrubbed)
 
     def test_store_delete_notfound_exception(self):
         # While scrubbing subject data, NotFound exception is ignored and subject
         # scrubbing succeeds
         uri = 'file://some/path/%s' % uuid.uuid4()
-        id = 'helloworldid'
         ex = glance_store.NotFound(message='random')
+        scrub = self._scrub_location(uri, ex)
+        self.assertEqual([1], scrub.scrubbed)
+
+    @patch.object(scrubber.eventlet, 'sleep')
+    def test_store_delete_retried_with_backoff(self, mock_sleep):
+        self.config(scrub_retries=3)
+        uri = 'file://some/path/%s' % uuid.uuid4()
+        ex = glance_store.GlanceStoreException()
+        scrub = self._scrub_location(uri, ex, ex, '')
+        self.assertEqual([1], scrub.scrubbed)
+        self.assertEqual([call(1), call(2)], mock_sleep.call_args_list)
 
+    @patch.object(scrubber.eventlet, 'sleep')
+    def test_store_delete_retries_exhausted(self, mock_sleep):
+        self.config(scrub_retries=2)
+        uri = 'file://some/path/%s' % uuid.uuid4()
+        ex = glance_store.GlanceStoreException()
+        scrub = self._scrub_location(uri, ex, ex, ex)
+        self.assertEqual([], scrub.scrubbed)
+        self.assertEqual(2, mock_sleep.call_count)
+
+    @patch.object(scrubber.db_api, 'get_api')
+    def test_scrubbed_locations_recorded_in_batches(self, mock_get_api):
+        self.config(scrub_batch_size=2)
         scrub = scrubber.Scrubber(glance_store)
-        scrub.registry = self.mox.CreateMockAnything()
-        scrub.registry.get_subject(id).AndReturn({'status': 'pending_delete'})
-        scrub.registry.update_subject(id, {'status': 'deleted'})
-        self.mox.StubOutWithMock(glance_store, "delete_from_backend")
-        glance_store.delete_from_backend(uri, mox.IgnoreArg()).AndRaise(ex)
-        self.mox.ReplayAll()
-        scrub._scrub_subject(id, [(id, '-', uri)])
-        self.mox.VerifyAll()
+        db = mock_get_api.return_value
+        with patch.object(scrub, '_delete_subject_location_from_backend'):
+            for loc_id in range(1, 4):
+                scrub._scrub_location('helloworldid', loc_id,
+                                      'file://some/path/%d' % loc_id)
+        db.subject_locations_scrubbed.assert_called_once_with(
+            scrub.admin_context, [1, 2])
+        self.assertEqual([3], scrub.scrubbed)
+
+    @patch.object(scrubber.db_api, 'get_api')
+    def test_run(self, mock_get_api):
+        self.config(scrub_pool_size=2)
+        scrub = scrubber.Scrubber(glance_store)
+        db = mock_get_api.return_value
+        db.subject_locations_scrubbed.return_value = ['helloworldid']
+        locations = [('helloworldid', loc_id, 'file://some/path/%d' % loc_id)
+                     for loc_id in range(1, 4)]
+        with patch.object(scrub.db_queue, 'get_all_locations',
+                          return_value=iter(locations)):
+            with patch.object(scrub, '_delete_subject_location_from_backend'
+                              ) as mock_delete:
+                scrub.run()
+        self.assertEqual(3, mock_delete.call_count)
+        db.subject_locations_scrubbed.assert_called_once_with(
+            scrub.admin_context, [1, 2, 3])
+        self.assertEqual([], scrub.scrubbed)
 
 
 class TestScrubDBQueue(test_utils.BaseTestCase):
@@ -119,66 +141,45 @@ class TestScrubDBQueue(test_utils.BaseTestCase):
     def tearDown(self):
         super(TestScrubDBQueue, self).tearDown()
 
-    def _create_subject_list(self, count):
-        subjects = []
+    def _create_location_list(self, count):
+        locations = []
         for x in range(count):
-            subjects.append({'id': x})
+            locations.append({'id': x, 'subject_id': 'subject-%d' % (x % 3),
+                              'url': 'file://some/path/%d' % x})
 
-        return subjects
+        return locations
 
-    def test_get_all_subjects(self):
+    def _get_all_locations(self, locations):
         scrub_queue = scrubber.ScrubDBQueue()
-        subjects = self._create_subject_list(15)
-        subject_pager = SubjectPager(subjects)
-
-        def make_get_subjects_detailed(pager):
-            def mock_get_subjects_detailed(filters, marker=None):
-                return pager()
-            return mock_get_subjects_detailed
 
-        with patch.object(scrub_queue.registry, 'get_subjects_detailed') as (
-                _mock_get_subjects_detailed):
-            _mock_get_subjects_detailed.side_effect = (
-                make_get_subjects_detailed(subject_pager))
-            actual = list(scrub_queue._get_all_subjects())
-
-        self.assertEqual(subjects, actual)
-
-    def test_get_all_subjects_paged(self):
-        scrub_queue = scrubber.ScrubDBQueue()
-        subjects = self._create_subject_list(15)
-        subject_pager = SubjectPager(subjects, page_size=4)
-
-        def make_get_subjects_detailed(pager):
-            def mock_get_subjects_detailed(filters, marker=None):
-                return pager()
-            return mock_get_subjects_detailed
-
-        with patch.object(scrub_queue.registry, 'get_subjects_detailed') as (
-                _mock_get_subjects_detailed):
-            _mock_get_subjects_detailed.side_effect = (
-                make_get_subjects_detailed(subject_pager))
-            actual = list(scrub_queue._get_all_subjects())
-
-        self.assertEqual(subjects, actual)
-
-
-class SubjectPager(object):
-    def __init__(self, subjects, page_size=0):
-        subject_count = len(subjects)
-        if page_size == 0 or page_size > subject_count:
-            page_size = subject_count
-        self.subject_batches = []
-        start = 0
-        l = len(subjects)
-        while start < l:
-            self.subject_batches.append(subjects[start: start + page_size])
-            start += page_size
-            if (l - start) < page_size:
-                page_size = l - start
-
-    def __call__(self):
-        if len(self.subject_batches) == 0:
-            return []
-        else:
-            return self.subject_batches.pop(0)
+        def get_pending_delete(context, min_age=0, marker=None, limit=None):
+            start = 0 if marker is None else marker + 1
+            return locations[start:start + limit]
+
+        with patch.object(scrubber.db_api, 'get_api') as mock_get_api:
+            db = mock_get_api.return_value
+            db.subject_location_get_pending_delete.side_effect = (
+                get_pending_delete)
+            actual = list(scrub_queue.get_all_locations())
+        expected = [(loc['subject_id'], loc['id'], loc['url'])
+                    for loc in locations]
+        self.assertEqual(expected, actual)
+        return [c[1]['marker'] for c in
+                db.subject_location_get_pending_delete.call_args_list]
+
+    def test_get_all_locations(self):
+        locations = self._create_location_list(15)
+        markers = self._get_all_locations(locations)
+        self.assertEqual([None], markers)
+
+    def test_get_all_locations_paged(self):
+        self.config(scrub_batch_size=4)
+        locations = self._create_location_list(15)
+        markers = self._get_all_locations(locations)
+        self.assertEqual([None, 3, 7, 11], markers)
+
+    def test_get_all_locations_last_page_full(self):
+        self.config(scrub_batch_size=5)
+        locations = self._create_location_list(15)
+        markers = self._get_all_locations(locations)
+        self.assertEqual([None, 4, 9, 14], markers)
@@ -12,6 +12,8 @@
 #    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 #    License for the specific language governing permissions and limitations
 #    under the License.
+import hashlib
+
 from cursive import exception as cursive_exception
 from cursive import signature_utils
 import glance_store
@@ -131,9 +133,9 @@ class TestStoreSubject(utils.BaseTestCase):
         self.stubs.Set(unit_test_utils.FakeStoreAPI, 'get_from_backend',
                        fake_get_from_backend)
         # This time, subject1.get_data() returns the data wrapped in a
-        # LimitingReader|CooperativeReader pipeline, so peeking under
-        # the hood of those objects to get at the underlying string.
-        self.assertEqual('ZZZ', subject1.get_data().data.fd)
+        # CooperativeReader, so peeking under the hood of that object
+        # to get at the underlying string.
+        self.assertEqual('ZZZ', subject1.get_data().fd)
 
         subject1.locations.pop(0)
         self.assertEqual(1, len(subject1.locations))
@@ -151,6 +153,25 @@ class TestStoreSubject(utils.BaseTestCase):
         self.assertEqual('Z', subject.checksum)
         self.assertEqual('active', subject.status)
 
+    def test_subject_set_data_os_hash(self):
+        context = subject.context.RequestContext(user=USER1)
+        subject_stub = SubjectStub(UUID2, status='queued', locations=[])
+        subject1 = subject.location.SubjectProxy(subject_stub, context,
+                                                 self.store_api,
+                                                 self.store_utils)
+
+        def fake_add_to_backend(conf, subject_id, data, size, context=None):
+            self.assertEqual(b'YYYY', data.read(8))
+            return (subject_id, size, 'Z', {})
+
+        self.config(hashing_algorithm='sha256')
+        self.stubs.Set(self.store_api, 'add_to_backend', fake_add_to_backend)
+        subject1.set_data(iter([b'YY', b'YY']), 4)
+        self.assertEqual('sha256', subject1.os_hash_algo)
+        self.assertEqual(hashlib.sha256(b'YYYY').hexdigest(),
+                         subject1.os_hash_value)
+        self.assertEqual('active', subject1.status)
+
     def test_subject_set_data_location_metadata(self):
         context = subject.context.RequestContext(user=USER1)
         subject_stub = SubjectStub(UUID2, status='queued', locations=[])
@@ -207,10 +207,9 @@ class FakeStoreAPI(object):
             if subject_id in location:
                 raise exception.Duplicate()
         if not size:
-            # 'data' is a string wrapped in a LimitingReader|CooperativeReader
-            # pipeline, so peek under the hood of those objects to get at the
-            # string itself.
-            size = len(data.data.fd)
+            # 'data' is a string wrapped in a CooperativeReader, so peek
+            # under the hood of that object to get at the string itself.
+            size = len(data.fd)
         if (current_store_size + size) > store_max_size:
             raise exception.StorageFull()
         if context.user == USER2:
@@ -0,0 +1,155 @@
+# Copyright 2016 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import datetime
+
+import mock
+from oslo_serialization import jsonutils
+import webob
+
+import subject.api.v1.subjects
+from subject.common import exception
+import subject.tests.unit.utils as unit_test_utils
+import subject.tests.utils as test_utils
+
+DATETIME = datetime.datetime(2012, 5, 16, 15, 27, 36, 325355)
+ISOTIME = '2012-05-16T15:27:36Z'
+
+UUID1 = 'c80a1a6c-bd1f-41c5-90ee-81afedb1d58d'
+UUID2 = 'a85abd86-55b3-4d5b-b0b4-5d0a6e6042fc'
+
+
+class FakeSubject(object):
+
+    def __init__(self, subject_id, name):
+        self.subject_id = subject_id
+        self.name = name
+        self.type = 'program'
+        self.tar_format = None
+        self.subject_format = None
+        self.visibility = 'public'
+        self.size = 1024
+        self.contributor = None
+        self.status = 'active'
+        self.checksum = None
+        self.os_hash_algo = 'sha512'
+        self.os_hash_value = None
+        self.protected = False
+        self.phase = None
+        self.language = None
+        self.score = None
+        self.knowledge = None
+        self.description = None
+        self.subject_desc = None
+        self.owner = unit_test_utils.TENANT1
+        self.created_at = DATETIME
+        self.updated_at = DATETIME
+        self.locations = []
+        self.tags = set(['ping'])
+        self.extra_properties = {'color': u'grün'}
+
+
+class ForbiddenSubject(FakeSubject):
+
+    @property
+    def owner(self):
+        raise exception.Forbidden()
+
+    @owner.setter
+    def owner(self, value):
+        pass
+
+
+class TestSubjectsSerializer(test_utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestSubjectsSerializer, self).setUp()
+        self.serializer = subject.api.v1.subjects.ResponseSerializer()
+        self.subjects = [FakeSubject(UUID1, 'one'), FakeSubject(UUID2, 'two')]
+
+    def _get_response(self, path='/v1/subjects'):
+        request = webob.Request.blank(path)
+        return webob.Response(request=request)
+
+    def _expected_subject(self, subject_id, name):
+        return {'subject': {
+            'id': subject_id,
+            'name': name,
+            'type': 'program',
+            'tar_format': None,
+            'subject_format': None,
+            'visibility': 'public',
+            'size': 1024,
+            'contributor': None,
+            'status': 'active',
+            'checksum': None,
+            'os_hash_algo': 'sha512',
+            'os_hash_value': None,
+            'protected': False,
+            'phase': None,
+            'language': None,
+            'score': None,
+            'knowledge': None,
+            'description': '',
+            'subject_desc': None,
+            'owner': unit_test_utils.TENANT1,
+            'created_at': ISOTIME,
+            'updated_at': ISOTIME,
+            'tags': ['ping'],
+            'color': u'grün',
+            'self': '/v1/subjects/%s' % subject_id,
+            'file': '/v1/subjects/%s/file' % subject_id,
+            'schema': '/v1/schemas/subject',
+        }}
+
+    def test_index(self):
+        response = self._get_response('/v1/subjects?limit=2')
+        result = {'subjects': self.subjects, 'next_marker': UUID2}
+        self.serializer.index(response, result)
+        expected = {
+            'subjects': [self._expected_subject(UUID1, 'one'),
+                         self._expected_subject(UUID2, 'two')],
+            'first': '/v1/subjects?limit=2',
+            'next': '/v1/subjects?limit=2&marker=%s' % UUID2,
+            'schema': '/v1/schemas/subjects',
+        }
+        self.assertEqual(expected, jsonutils.loads(response.body))
+        self.assertEqual('application/json', response.content_type)
+
+    def test_index_no_subjects(self):
+        response = self._get_response()
+        self.serializer.index(response, {'subjects': []})
+        expected = {
+            'subjects': [],
+            'first': '/v1/subjects',
+            'schema': '/v1/schemas/subjects',
+        }
+        self.assertEqual(expected, jsonutils.loads(response.body))
+
+    @mock.patch.object(subject.api.v1.subjects, 'INDEX_CHUNK_SIZE', 1)
+    def test_index_streams_chunks(self):
+        response = self._get_response()
+        self.serializer.index(response, {'subjects': self.subjects})
+        chunks = list(response.app_iter)
+        self.assertEqual(3, len(chunks))
+        body = jsonutils.loads(b''.join(chunks))
+        self.assertEqual([UUID1, UUID2],
+                         [s['subject']['id'] for s in body['subjects']])
+
+    def test_index_forbidden(self):
+        response = self._get_response()
+        result = {'subjects': [ForbiddenSubject(UUID1, 'one')]}
+        self.assertRaises(webob.exc.HTTPForbidden,
+                          self.serializer.index, response, result)
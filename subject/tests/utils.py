@@ -97,6 +97,7 @@ class BaseTestCase(testtools.TestCase):
     def unset_property_protections(self):
         for section in property_utils.CONFIG.sections():
             property_utils.CONFIG.remove_section(section)
+        property_utils.reset_rule_cache()
 
     def _copy_data_file(self, file_name, dst_dir):
         src_file_name = os.path.join('subject/tests/etc', file_name)
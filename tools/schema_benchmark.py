@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# Copyright 2016 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Microbenchmark of the schema handling of the v1 subjects API
+
+Times how the request deserializer of create and update requests and the
+response serializer of list responses spend their CPU, and which part of
+it goes to validating against and filtering with the subject schema. Each
+operation is timed with the schema as it is now, which compiles its
+validator once, and as it was before, when every call rebuilt the raw
+schema, checked it against its meta-schema and built a new validator.
+
+Usage: python tools/schema_benchmark.py [--subjects N] [--repeat N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import datetime
+import timeit
+import uuid
+
+import jsonschema
+from oslo_config import cfg
+from oslo_serialization import jsonutils
+import six
+import webob
+
+from subject.api.v1 import subjects
+import subject.schema
+
+
+class LegacyMixin(object):
+
+    """The schema handling as it was before validators were compiled."""
+
+    def validate(self, obj):
+        jsonschema.validate(obj, self.raw())
+
+    def filter(self, obj):
+        filtered = {}
+        for key, value in six.iteritems(obj):
+            if self._filter_all or key in self.properties:
+                filtered[key] = value
+            if key not in self.properties and value is None:
+                filtered[key] = ''
+        return filtered
+
+
+class LegacySchema(LegacyMixin, subject.schema.Schema):
+    pass
+
+
+class LegacyPermissiveSchema(LegacyMixin, subject.schema.PermissiveSchema):
+    pass
+
+
+class CountingMixin(object):
+
+    """Accumulates the time spent validating and filtering."""
+
+    elapsed = 0.0
+
+    def validate(self, obj):
+        start = timeit.default_timer()
+        try:
+            return super(CountingMixin, self).validate(obj)
+        finally:
+            self.elapsed += timeit.default_timer() - start
+
+    def filter(self, obj):
+        start = timeit.default_timer()
+        try:
+            return super(CountingMixin, self).filter(obj)
+        finally:
+            self.elapsed += timeit.default_timer() - start
+
+
+class FakeSubject(object):
+
+    def __init__(self, index):
+        now = datetime.datetime.utcnow()
+        self.subject_id = str(uuid.uuid4())
+        self.name = 'subject-%d' % index
+        self.type = 'program'
+        self.tar_format = 'tar'
+        self.subject_format = 'pdf'
+        self.visibility = 'public'
+        self.size = 1024 * index
+        self.contributor = 'contributor'
+        self.status = 'active'
+        self.checksum = 'c2e5db72bd7fd153f53ede5da5a06de3'
+        self.protected = False
+        self.phase = 'phase'
+        self.language = 'en'
+        self.score = '5'
+        self.knowledge = 'knowledge'
+        self.description = 'description'
+        self.subject_desc = 'subject description'
+        self.owner = str(uuid.uuid4())
+        self.created_at = now
+        self.updated_at = now
+        self.locations = []
+        self.tags = set(['ping', 'pong'])
+        self.extra_properties = {'foo': 'bar', 'empty': None}
+
+
+def _make_schema(legacy):
+    schema = subjects.get_schema()
+    if cfg.CONF.allow_additional_subject_properties:
+        base = LegacyPermissiveSchema if legacy else (
+            subject.schema.PermissiveSchema)
+    else:
+        base = LegacySchema if legacy else subject.schema.Schema
+    cls = type('Counting' + base.__name__, (CountingMixin, base), {})
+    return cls(schema.name, schema.properties, schema.links)
+
+
+def _create_request():
+    body = {'subject': {'name': 'subject-1', 'type': 'program',
+                        'protected': False, 'tags': ['ping'],
+                        'description': 'description'}}
+    request = webob.Request.blank('/v1/subjects', method='POST')
+    request.content_type = 'application/json'
+    request.body = jsonutils.dump_as_bytes(body)
+    return request
+
+
+def _update_request():
+    body = [{'op': 'replace', 'path': '/name', 'value': 'subject-2'},
+            {'op': 'replace', 'path': '/description', 'value': 'text'},
+            {'op': 'add', 'path': '/tags', 'value': ['ping', 'pong']}]
+    request = webob.Request.blank('/v1/subjects/x', method='PATCH')
+    request.content_type = 'application/openstack-subjects-v1.1-json-patch'
+    request.body = jsonutils.dump_as_bytes(body)
+    return request
+
+
+def _list_response(count):
+    request = webob.Request.blank('/v1/subjects')
+    response = webob.Response(request=request)
+    result = {'subjects': [FakeSubject(i) for i in range(count)]}
+    return response, result
+
+
+def _run(schema, func, repeat):
+    """Returns the mean time of func and the part of it spent in schema."""
+    func()
+    schema.elapsed = 0.0
+    total = timeit.timeit(func, number=repeat)
+    return total / repeat, schema.elapsed / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--subjects', type=int, default=100,
+                        help='Number of subjects in each list response')
+    parser.add_argument('--repeat', type=int, default=200,
+                        help='Number of times each operation is timed')
+    args = parser.parse_args()
+    cfg.CONF([], project='subject')
+
+    print('%-18s %12s %12s %8s' % ('operation', 'total (ms)',
+                                   'schema (ms)', 'schema'))
+    for legacy in (True, False):
+        schema = _make_schema(legacy)
+        deserializer = subjects.RequestDeserializer(schema=schema)
+        serializer = subjects.ResponseSerializer(schema=schema)
+        response, result = _list_response(args.subjects)
+        runs = [
+            ('create', lambda: deserializer.create(_create_request())),
+            ('update', lambda: deserializer.update(_update_request())),
+            ('list', lambda: serializer.index(response, result)),
+        ]
+        suffix = ' (legacy)' if legacy else ''
+        for name, func in runs:
+            total, elapsed = _run(schema, func, args.repeat)
+            print('%-18s %12.3f %12.3f %7.1f%%' % (
+                name + suffix, total * 1000, elapsed * 1000,
+                100.0 * elapsed / total))
+
+
+if __name__ == '__main__':
+    main()
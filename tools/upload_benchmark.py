@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# Copyright 2016 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Throughput benchmark of the reader pipeline of subject uploads
+
+Streams subject data through the readers an upload passes on its way to the
+store, and writes it to a local directory the way the filesystem store
+does: reading blocks of the store's size, updating a checksum and writing
+each block to a file. The data comes either from a file object returning at
+most --read-size bytes per read, as a socket does, or from an iterator of
+chunks of that size, as a chunked request body does.
+
+Each block size is timed with the reader pipeline as it is now, a single
+CooperativeReader enforcing the size cap, and as it was before, a
+CooperativeReader copying the data into each block wrapped in a
+LimitingReader for the size cap.
+
+Usage: python tools/upload_benchmark.py [--size MiB] [--repeat N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import hashlib
+import os
+import shutil
+import tempfile
+import timeit
+
+from subject.common import exception
+from subject.common import utils
+
+MiB = 1024 * 1024
+MAX_BUFFER_SIZE = 128 * MiB
+
+
+class LegacyCooperativeReader(object):
+
+    """The CooperativeReader as it was before blocks were filled in place."""
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.iterator = None
+        if hasattr(fd, 'read'):
+            self.read = utils.cooperative_read(fd)
+        else:
+            self.buffer = b''
+            self.position = 0
+
+    def read(self, length=None):
+        result = bytearray()
+        while len(result) < length:
+            if self.position < len(self.buffer):
+                to_read = length - len(result)
+                chunk = self.buffer[self.position:self.position + to_read]
+                result.extend(chunk)
+                if len(result) >= MAX_BUFFER_SIZE:
+                    raise exception.LimitExceeded()
+                self.position += len(chunk)
+            else:
+                try:
+                    if self.iterator is None:
+                        self.iterator = self.__iter__()
+                    self.buffer = next(self.iterator)
+                    self.position = 0
+                except StopIteration:
+                    self.buffer = b''
+                    self.position = 0
+                    return bytes(result)
+        return bytes(result)
+
+    def __iter__(self):
+        return utils.cooperative_iter(self.fd.__iter__())
+
+
+class SocketFile(object):
+
+    """A file object returning at most read_size bytes per read."""
+
+    def __init__(self, data, read_size):
+        self.data = memoryview(data)
+        self.read_size = read_size
+        self.position = 0
+
+    def read(self, length):
+        length = min(length, self.read_size)
+        chunk = self.data[self.position:self.position + length].tobytes()
+        self.position += len(chunk)
+        return chunk
+
+    def readinto(self, buf):
+        length = min(len(buf), self.read_size)
+        chunk = self.data[self.position:self.position + length]
+        buf[:len(chunk)] = chunk
+        self.position += len(chunk)
+        return len(chunk)
+
+
+def _iter_chunks(data, read_size):
+    view = memoryview(data)
+    for position in range(0, len(data), read_size):
+        yield view[position:position + read_size].tobytes()
+
+
+def _legacy_reader(source, size):
+    return utils.LimitingReader(LegacyCooperativeReader(source), size)
+
+
+def _reader(source, size):
+    return utils.CooperativeReader(source, limit=size)
+
+
+def _store_add(path, data, block_size):
+    """Writes data to path as the filesystem store does."""
+    checksum = hashlib.md5()
+    bytes_written = 0
+    with open(path, 'wb') as f:
+        for buf in utils.chunkreadable(data, block_size):
+            bytes_written += len(buf)
+            checksum.update(buf)
+            f.write(buf)
+    os.unlink(path)
+    return bytes_written
+
+
+def _run(make_reader, make_source, data, block_size, path, repeat):
+    """Returns the throughput of writing data to path in MiB/s."""
+    def upload():
+        reader = make_reader(make_source(), len(data))
+        written = _store_add(path, reader, block_size)
+        assert written == len(data)
+
+    upload()
+    total = timeit.timeit(upload, number=repeat)
+    return len(data) * repeat / total / MiB
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--size', type=int, default=256,
+                        help='Size of the uploaded subject in MiB')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of times each upload is timed')
+    parser.add_argument('--read-size', type=int, default=64 * 1024,
+                        help='Largest number of bytes the source returns '
+                             'at once')
+    parser.add_argument('--block-sizes', type=int, nargs='+',
+                        default=[1, 8, 64],
+                        help='Store block sizes to time, in MiB')
+    args = parser.parse_args()
+
+    data = os.urandom(args.size * MiB)
+    sources = [
+        ('socket', lambda: SocketFile(data, args.read_size)),
+        ('chunked', lambda: _iter_chunks(data, args.read_size)),
+    ]
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'subject')
+    try:
+        print('%-10s %12s %16s %16s' % ('source', 'block (MiB)',
+                                        'legacy (MiB/s)', 'new (MiB/s)'))
+        for name, make_source in sources:
+            for block_size in args.block_sizes:
+                results = [_run(make_reader, make_source, data,
+                                block_size * MiB, path, args.repeat)
+                           for make_reader in (_legacy_reader, _reader)]
+                print('%-10s %12d %16.1f %16.1f' % (
+                    (name, block_size) + tuple(results)))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()